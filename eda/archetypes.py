@@ -0,0 +1,289 @@
+import json
+import os
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from deck_matrix import DeckMatrix, jaccard, popcount
+from lsh import MinHasher, band_keys, candidate_pairs
+
+
+OTHER = "Other"
+
+
+def _connected_components(n: int, edges: np.ndarray) -> np.ndarray:
+    """Component label per node; scipy when installed, otherwise min-label propagation"""
+    try:
+        from scipy import sparse
+        from scipy.sparse.csgraph import connected_components
+    except ImportError:
+        sparse = None
+
+    if sparse is not None:
+        graph = sparse.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n))
+        return connected_components(graph, directed=False)[1]
+
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[edges[:, 0]], labels[edges[:, 1]])
+        updated = labels.copy()
+        np.minimum.at(updated, edges[:, 0], low)
+        np.minimum.at(updated, edges[:, 1], low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+# A cluster is kept only if at least this share of its decks is as similar
+# to its core as predict() requires; merged clusters fall below it
+MIN_REACH = 0.5
+
+
+def _cluster_cards(distinct: DeckMatrix, weights: np.ndarray, labels: np.ndarray,
+                   min_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Clusters of at least min_size (weighted) decks, largest first
+
+    Returns (cluster labels, sizes, card frequency per cluster, cluster slot
+    per deck or -1); decks labelled -1 belong to no cluster.
+    """
+    clustered = np.flatnonzero(labels >= 0)
+    ids, inverse = np.unique(labels[clustered], return_inverse=True)
+    sizes = np.bincount(inverse.ravel(), weights=weights[clustered], minlength=len(ids))
+    kept = np.flatnonzero(sizes >= min_size)
+    kept = kept[np.argsort(-sizes[kept], kind="stable")]
+    id_slot = np.full(len(ids), -1)
+    id_slot[kept] = np.arange(len(kept))
+    slot = np.full(len(distinct), -1)
+    slot[clustered] = id_slot[inverse.ravel()]
+
+    # Weighted card frequency inside each kept cluster
+    card_weight = np.zeros((len(kept), distinct.n_cards))
+    start = 0
+    for chunk in distinct.iter_chunks():
+        rows, cols = np.nonzero(chunk)
+        rows += start
+        in_kept = slot[rows] >= 0
+        np.add.at(card_weight, (slot[rows[in_kept]], cols[in_kept]), weights[rows[in_kept]])
+        start += len(chunk)
+    frequency = card_weight / sizes[kept][:, None] if len(kept) else card_weight
+    return ids[kept], sizes[kept], frequency, slot
+
+
+def _cores(frequency: np.ndarray) -> List[np.ndarray]:
+    """Card columns in at least half of each cluster's decks (its 8 most common if none are)"""
+    cores = []
+    for row in frequency:
+        core = np.flatnonzero(row >= 0.5)
+        cores.append(core if len(core) else np.argsort(-row, kind="stable")[:8])
+    return cores
+
+
+def _core_reach(bits: np.ndarray, weights: np.ndarray, slot: np.ndarray, sizes: np.ndarray,
+                cores: List[np.ndarray], n_cards: int, assign_threshold: float) -> np.ndarray:
+    """Share of each cluster's decks at least assign_threshold similar to its own core"""
+    one_hot = np.zeros((len(cores), n_cards), dtype=bool)
+    for k, core in enumerate(cores):
+        one_hot[k, core] = True
+    core_bits = np.packbits(one_hot, axis=1, bitorder="little")
+
+    rows = np.flatnonzero(slot >= 0)
+    own = core_bits[slot[rows]]
+    both = popcount(bits[rows] & own)
+    either = popcount(bits[rows] | own)
+    reached = both >= assign_threshold * np.maximum(either, 1)
+    return np.bincount(slot[rows], weights=weights[rows] * reached, minlength=len(cores)) / sizes
+
+
+def _split_by_leaders(bits: np.ndarray, weights: np.ndarray, members: np.ndarray, threshold: float,
+                      min_size: int, max_leaders: int = 64) -> np.ndarray:
+    """
+    Re-cluster one component around its most frequent decks
+
+    Members are in frequency order. The most frequent member not yet within
+    `threshold` of a leader becomes the next leader, until what is left
+    could not fill a cluster of min_size; every member then joins its most
+    similar leader, or none (-1) below `threshold`. Unlike single-link
+    components, two archetypes bridged by decks between them end up with
+    separate leaders.
+    """
+    uncovered = np.ones(len(members), dtype=bool)
+    leaders = []
+    while len(leaders) < max_leaders:
+        open_rows = np.flatnonzero(uncovered)
+        if len(open_rows) == 0 or weights[members[open_rows]].sum() < min_size:
+            break
+        leader = open_rows[0]
+        leaders.append(leader)
+        similarity = jaccard(bits[members[open_rows]], bits[members[[leader]]])[:, 0]
+        uncovered[open_rows[similarity >= threshold]] = False
+        uncovered[leader] = False
+
+    if not leaders:
+        return np.full(len(members), -1)
+    similarity = jaccard(bits[members], bits[members[leaders]])
+    best = similarity.argmax(axis=1)
+    best[similarity[np.arange(len(best)), best] < threshold] = -1
+    return best
+
+
+class ArchetypeModel:
+    """
+    Deck archetypes found by Jaccard clustering, and a fast assigner for new decks
+
+    fit() works on distinct decks only: MinHash/LSH proposes candidate pairs
+    (linear in the number of decks), exact popcount Jaccard keeps those at
+    or above `threshold`, and connected components of what is left are the
+    clusters. Clusters holding at least min_size decks become archetypes,
+    each summarised by its core: the cards in at least half its decks.
+    Single links chain archetypes that share a few cards into one
+    component whose core shrinks below anything predict() could match;
+    such components are re-clustered around their most frequent decks,
+    and clusters whose core is still out of reach are dropped.
+
+    predict() assigns a deck to the archetype whose core it is most similar
+    to, or to "Other" below assign_threshold. The model is a few hundred
+    card lists, saved as JSON, so later crawls are labelled without
+    re-clustering.
+    """
+
+    def __init__(self, vocabulary: Sequence[Hashable], cores: List[List[Hashable]], names: List[str],
+                 sizes: Sequence[int], assign_threshold: float = 0.4):
+        self.vocabulary = list(vocabulary)
+        self.cores = [list(core) for core in cores]
+        self.names = list(names)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.assign_threshold = assign_threshold
+        self.core_bits = DeckMatrix.from_decks(self.cores, self.vocabulary).bits
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def fit(cls, matrix: DeckMatrix, threshold: float = 0.6, assign_threshold: float = 0.4,
+            min_size: Optional[int] = None, num_perm: int = 64, bands: int = 16, seed: int = 0,
+            card_label: Callable[[Hashable], str] = str) -> "ArchetypeModel":
+        """
+        Cluster the decks of a DeckMatrix
+
+        The default threshold 0.6 links decks sharing 6 of 8 cards. min_size
+        defaults to 0.2% of the decks (at least 5). card_label turns card keys
+        into the names used for archetype labels (e.g. catalog.card_name).
+        """
+        if min_size is None:
+            min_size = max(5, int(len(matrix) * 0.002))
+
+        # Distinct decks, most frequent first
+        _, first, counts = np.unique(matrix.deck_keys(), return_index=True, return_counts=True)
+        order = np.argsort(-counts, kind="stable")
+        bits = matrix.bits[first[order]]
+        weights = counts[order]
+        distinct = DeckMatrix(bits, matrix.vocabulary, matrix.chunk_size)
+
+        hasher = MinHasher(matrix.n_cards, num_perm, seed)
+        pairs = candidate_pairs(band_keys(hasher.signatures(bits), bands))
+        both = popcount(bits[pairs[:, 0]] & bits[pairs[:, 1]])
+        either = popcount(bits[pairs[:, 0]] | bits[pairs[:, 1]])
+        edges = pairs[both >= threshold * np.maximum(either, 1)]
+
+        labels = _connected_components(len(bits), edges)
+        ids, sizes, frequency, slot = _cluster_cards(distinct, weights, labels, min_size)
+        cores = _cores(frequency)
+        reach = _core_reach(bits, weights, slot, sizes, cores, matrix.n_cards, assign_threshold)
+
+        unreachable = ids[reach < MIN_REACH]
+        if len(unreachable):
+            labels = labels.copy()
+            next_label = labels.max() + 1
+            for component in unreachable:
+                members = np.flatnonzero(labels == component)
+                leader = _split_by_leaders(bits, weights, members, threshold, min_size)
+                labels[members] = np.where(leader >= 0, next_label + leader, -1)
+                next_label += max(int(leader.max()) + 1, 0)
+            ids, sizes, frequency, slot = _cluster_cards(distinct, weights, labels, min_size)
+            cores = _cores(frequency)
+            reach = _core_reach(bits, weights, slot, sizes, cores, matrix.n_cards, assign_threshold)
+
+        reachable = np.flatnonzero(reach >= MIN_REACH)
+
+        # Name each archetype after its two most distinctive core cards
+        overall = matrix.card_counts() / max(len(matrix), 1)
+        kept_cores, names = [], []
+        for k in reachable:
+            core = cores[k]
+            lift = frequency[k][core] / np.maximum(overall[core], 1e-9)
+            signature_cards = core[np.argsort(-lift, kind="stable")[:2]]
+            name = " + ".join(card_label(matrix.vocabulary[j]) for j in signature_cards)
+            while name in names:
+                name += "'"
+            kept_cores.append([matrix.vocabulary[j] for j in core])
+            names.append(name)
+
+        return cls(matrix.vocabulary, kept_cores, names, sizes[reachable].astype(np.int64), assign_threshold)
+
+    @property
+    def deck_column(self) -> str:
+        """Deck column the vocabulary is keyed on: card_ids for card IDs, cards for names"""
+        return "card_ids" if self.vocabulary and isinstance(self.vocabulary[0], (int, np.integer)) else "cards"
+
+    def encode(self, decks: Sequence[Sequence[Hashable]]) -> DeckMatrix:
+        """Encode decks on the model's vocabulary; raises if none of their cards are in it"""
+        decks = list(decks)
+        matrix = DeckMatrix.from_decks(decks, self.vocabulary)
+        if len(self.vocabulary) and not matrix.bits.any() and any(len(deck) for deck in decks):
+            raise ValueError(f"None of the decks' cards are in the model's vocabulary; "
+                             f"it is keyed by {self.deck_column!r}")
+        return matrix
+
+    def predict_matrix(self, matrix: DeckMatrix) -> np.ndarray:
+        """Archetype index per deck (-1 for Other); identical decks are scored once"""
+        if matrix.vocabulary != self.vocabulary:
+            raise ValueError("DeckMatrix vocabulary differs from the model's; encode decks with model.encode()")
+        if len(self) == 0 or len(matrix) == 0:
+            return np.full(len(matrix), -1)
+
+        _, first, inverse = np.unique(matrix.deck_keys(), return_index=True, return_inverse=True)
+        similarity = jaccard(matrix.bits[first], self.core_bits)
+        best = similarity.argmax(axis=1)
+        best[similarity[np.arange(len(best)), best] < self.assign_threshold] = -1
+        return best[inverse.ravel()]
+
+    def labels(self, indices: np.ndarray) -> np.ndarray:
+        names = np.asarray(self.names + [OTHER], dtype=object)
+        return names[np.where(indices < 0, len(self.names), indices)]
+
+    def predict_many(self, decks: Sequence[Sequence[Hashable]]) -> np.ndarray:
+        """Archetype name per deck"""
+        return self.labels(self.predict_matrix(self.encode(decks)))
+
+    def predict(self, deck: Sequence[Hashable]) -> str:
+        return str(self.predict_many([deck])[0])
+
+    def summary(self) -> pd.DataFrame:
+        return pd.DataFrame({"archetype": self.names, "decks": self.sizes,
+                             "core_cards": [len(core) for core in self.cores]})
+
+    def save(self, path: str):
+        data = {"vocabulary": self.vocabulary, "cores": self.cores, "names": self.names,
+                "sizes": self.sizes.tolist(), "assign_threshold": self.assign_threshold}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ArchetypeModel":
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(data["vocabulary"], data["cores"], data["names"], data["sizes"], data["assign_threshold"])
+
+
+def archetype_shares(archetypes: Sequence[str], groups: Sequence[Hashable],
+                     group_name: str = "location_name") -> pd.DataFrame:
+    """Share of each archetype within each group (e.g. region), largest first"""
+    frame = pd.DataFrame({group_name: np.asarray(groups), "archetype": np.asarray(archetypes)})
+    counts = frame.groupby([group_name, "archetype"], sort=False).size().rename("decks").reset_index()
+    counts["share_pct"] = counts["decks"] / counts.groupby(group_name)["decks"].transform("sum") * 100
+    return counts.sort_values([group_name, "decks"], ascending=[True, False], kind="stable", ignore_index=True)
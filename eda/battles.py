@@ -0,0 +1,310 @@
+import hashlib
+import os
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import polars as pl
+import pyarrow.dataset as ds
+import requests
+
+from eda import ClanBasedStrategyClassifier, load_api_key
+from sinks import BatchSink
+
+
+# Both participants' decks per battle; "a" is the participant with the smaller tag
+BATTLE_LIST_COLUMNS = ("a_cards", "a_card_ids", "b_cards", "b_card_ids")
+
+BATTLE_PARTITION_COLUMNS = ["battle_date"]
+
+
+def parse_battle_time(battle_time: str) -> datetime:
+    """The API's compact UTC timestamp, e.g. 20240115T173005.000Z"""
+    return datetime.strptime(battle_time, "%Y%m%dT%H%M%S.%fZ").replace(tzinfo=timezone.utc)
+
+
+def battle_id(battle: Dict) -> str:
+    """Same ID whichever participant's log the battle was read from"""
+    tags = sorted(side.get("tag", "") for side in battle.get("team", []) + battle.get("opponent", []))
+    raw = "|".join([battle.get("battleTime", ""), str(battle.get("gameMode", {}).get("id", ""))] + tags)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def battle_record(battle: Dict) -> Optional[Dict]:
+    """
+    One row per 1v1 battle, oriented by participant tag rather than by whose log it came from
+
+    Team modes (2v2) and entries without decks are skipped. `winner` is
+    "a", "b" or "draw" by crowns.
+    """
+    team, opponent = battle.get("team", []), battle.get("opponent", [])
+    if len(team) != 1 or len(opponent) != 1 or not team[0].get("cards") or not opponent[0].get("cards"):
+        return None
+
+    a, b = sorted([team[0], opponent[0]], key=lambda side: side.get("tag", ""))
+    crowns_a, crowns_b = a.get("crowns", 0), b.get("crowns", 0)
+    record = {
+        "battle_id": battle_id(battle),
+        "battle_time": parse_battle_time(battle["battleTime"]),
+        "battle_type": battle.get("type"),
+        "game_mode": battle.get("gameMode", {}).get("name"),
+        "winner": "a" if crowns_a > crowns_b else "b" if crowns_b > crowns_a else "draw",
+    }
+    for prefix, side in (("a", a), ("b", b)):
+        record.update({
+            f"{prefix}_tag": side.get("tag", "").replace("#", ""),
+            f"{prefix}_name": side.get("name", "Unknown"),
+            f"{prefix}_crowns": side.get("crowns", 0),
+            f"{prefix}_trophies": side.get("startingTrophies"),
+            f"{prefix}_cards": [card.get("name") for card in side["cards"]],
+            f"{prefix}_card_ids": [card.get("id") for card in side["cards"]],
+        })
+    return record
+
+
+class BattleIndex:
+    """
+    SQLite index of stored battles, keyed by (player, battle time)
+
+    A battle is stored once, under both participants, so seeing it again in
+    the other player's log is a primary-key hit. Per-player watermarks record
+    the newest battle seen when that player's own log was last crawled;
+    battles at or before it are skipped on the next crawl without parsing.
+    """
+
+    def __init__(self, path: str = "battle_index.sqlite"):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS player_battles (
+                player_tag TEXT NOT NULL,
+                battle_time TEXT NOT NULL,
+                battle_id TEXT NOT NULL,
+                PRIMARY KEY (player_tag, battle_time)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                player_tag TEXT PRIMARY KEY,
+                battle_time TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def watermark(self, player_tag: str) -> Optional[str]:
+        row = self._conn.execute("SELECT battle_time FROM watermarks WHERE player_tag = ?",
+                                 (player_tag.replace("#", ""),)).fetchone()
+        return row[0] if row else None
+
+    def contains(self, player_tag: str, battle_time: str) -> bool:
+        row = self._conn.execute("SELECT 1 FROM player_battles WHERE player_tag = ? AND battle_time = ?",
+                                 (player_tag.replace("#", ""), battle_time)).fetchone()
+        return row is not None
+
+    def record(self, battles: Iterable[Tuple[str, str, str, str]], watermarks: Dict[str, str]):
+        """Commit (battle_id, battle_time, tag_a, tag_b) rows and advanced watermarks in one transaction"""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO player_battles VALUES (?, ?, ?)",
+                [(tag, battle_time, bid) for bid, battle_time, tag_a, tag_b in battles for tag in (tag_a, tag_b)])
+            self._conn.executemany(
+                "INSERT INTO watermarks VALUES (?, ?) ON CONFLICT (player_tag) "
+                "DO UPDATE SET battle_time = MAX(battle_time, excluded.battle_time)",
+                list(watermarks.items()))
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "battles": self._conn.execute("SELECT COUNT(DISTINCT battle_id) FROM player_battles").fetchone()[0],
+            "players_crawled": self._conn.execute("SELECT COUNT(*) FROM watermarks").fetchone()[0],
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def _time_key(battle_time: datetime) -> str:
+    """Back to the API's string form, which sorts chronologically"""
+    return battle_time.strftime("%Y%m%dT%H%M%S.000Z")
+
+
+def as_polars_battles(batch: pd.DataFrame) -> pl.DataFrame:
+    """Battle frame with storage dtypes: list<int32> IDs, list<utf8> names, UTC timestamps"""
+    frame = pl.from_pandas(batch)
+    casts = [pl.col("battle_time").dt.replace_time_zone("UTC") if frame.schema["battle_time"].time_zone is None
+             else pl.col("battle_time")]
+    for column in BATTLE_LIST_COLUMNS:
+        inner = pl.Int32 if column.endswith("_ids") else pl.Utf8
+        casts.append(pl.col(column).cast(pl.List(inner)))
+    for column in ("battle_type", "game_mode", "winner"):
+        casts.append(pl.col(column).cast(pl.Utf8).cast(pl.Categorical))
+    frame = frame.with_columns(casts)
+    return frame.with_columns(pl.col("battle_time").dt.strftime("%Y-%m-%d").alias("battle_date"))
+
+
+def write_battles(batch: pd.DataFrame, root: str) -> str:
+    """Append one batch of battles to a Parquet dataset partitioned by battle date"""
+    ds.write_dataset(
+        as_polars_battles(batch).to_arrow(),
+        root,
+        format="parquet",
+        partitioning=BATTLE_PARTITION_COLUMNS,
+        partitioning_flavor="hive",
+        existing_data_behavior="overwrite_or_ignore",
+        basename_template=f"battles-{uuid.uuid4().hex}-{{i}}.parquet",
+    )
+    return root
+
+
+def scan_battles(root: str) -> pl.LazyFrame:
+    frame = pl.scan_parquet(os.path.join(root, "**", "*.parquet"), hive_partitioning=True)
+    return frame.with_columns(pl.col("battle_date").cast(pl.Utf8))
+
+
+class BattleSink(BatchSink):
+    """
+    Deduplicating battle writer
+
+    Drops battles already in the index or already buffered, writes each
+    batch to the Parquet store and only then commits it (and any watermarks
+    reached) to the index, so an interrupted run never marks unwritten
+    battles as stored.
+    """
+
+    def __init__(self, root: str, index: BattleIndex, batch_size: int = 5000):
+        super().__init__(batch_size)
+        self.root = root
+        self.index = index
+        self.duplicates = 0
+        self._pending = set()
+        self._watermarks: Dict[str, str] = {}
+
+    def write(self, record: Dict):
+        time_key = _time_key(record["battle_time"])
+        if (record["a_tag"], time_key) in self._pending or self.index.contains(record["a_tag"], time_key):
+            self.duplicates += 1
+            return
+        self._pending.add((record["a_tag"], time_key))
+        super().write(record)
+
+    def mark_crawled(self, player_tag: str, newest_battle_time: str):
+        """Advance a player's watermark together with the next batch written"""
+        player_tag = player_tag.replace("#", "")
+        self._watermarks[player_tag] = max(newest_battle_time, self._watermarks.get(player_tag, ""))
+
+    def write_batch(self, batch: pd.DataFrame):
+        write_battles(batch, self.root)
+        self.index.record(zip(batch["battle_id"], batch["battle_time"].map(_time_key), batch["a_tag"], batch["b_tag"]),
+                          self._watermarks)
+        self._watermarks = {}
+        self._pending.clear()
+
+    def close(self):
+        super().close()
+        if self._watermarks:
+            self.index.record([], self._watermarks)
+            self._watermarks = {}
+
+
+class BattleLogIngester:
+    """
+    Streams new battles from players' battle logs into a BattleSink
+
+    Logs are fetched concurrently through the classifier (so its rate
+    limiter, retries and cache apply) with a bounded window of requests in
+    flight, and each player's log is cut at their watermark before any
+    record is built.
+    """
+
+    def __init__(self, classifier: ClanBasedStrategyClassifier, index: BattleIndex, max_workers: int = 4):
+        self.classifier = classifier
+        self.index = index
+        self.max_workers = max_workers
+
+    def _fetch(self, player_tag: str) -> List[Dict]:
+        try:
+            return self.classifier.fetch_player_battlelog(player_tag)
+        except requests.exceptions.RequestException as e:
+            # Missing players and exhausted retries alike: skip this log, and
+            # since the watermark is not advanced it is retried next run
+            if not (isinstance(e, requests.exceptions.HTTPError) and e.response is not None
+                    and e.response.status_code == 404):
+                print(f"     Error getting battle log of {player_tag}: {str(e)[:50]}")
+            return []
+
+    def iter_logs(self, player_tags: Iterable[str]) -> Iterator[Tuple[str, List[Dict]]]:
+        """(player_tag, battle log) in input order, at most max_workers * 4 fetches ahead"""
+        window = self.max_workers * 4
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            in_flight = deque()
+            for tag in player_tags:
+                in_flight.append((tag, pool.submit(self._fetch, tag)))
+                if len(in_flight) >= window:
+                    tag, future = in_flight.popleft()
+                    yield tag, future.result()
+            while in_flight:
+                tag, future = in_flight.popleft()
+                yield tag, future.result()
+
+    def ingest(self, player_tags: Iterable[str], sink: BattleSink) -> int:
+        """Write every battle newer than each player's watermark; returns battles seen (before dedup)"""
+        seen = 0
+        for tag, log in self.iter_logs(player_tags):
+            watermark = self.index.watermark(tag) or ""
+            for battle in log:
+                if battle.get("battleTime", "") <= watermark:
+                    continue
+                record = battle_record(battle)
+                if record is not None:
+                    sink.write(record)
+                    seen += 1
+            if log:
+                sink.mark_crawled(tag, max(battle.get("battleTime", "") for battle in log))
+        return seen
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ingest the battle logs of crawled players")
+    parser.add_argument("--players", default="../clan_based_deckss.csv",
+                        help="CSV or Parquet deck store whose player_tag column lists the players")
+    parser.add_argument("--root", default="battles_parquet")
+    parser.add_argument("--index", default="battle_index.sqlite")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--mock", action="store_true", help="Ingest from a local mock API instead")
+    args = parser.parse_args()
+
+    from storage import load_decks
+
+    mock = None
+    if args.mock:
+        from mock_api import MockClashRoyaleAPI, build_world
+
+        mock = MockClashRoyaleAPI(build_world(battles_per_player=10)).start()
+        classifier = ClanBasedStrategyClassifier("mock", base_url=mock.base_url)
+        player_tags = list(mock.world["players"])
+    else:
+        classifier = ClanBasedStrategyClassifier(load_api_key())
+        if os.path.isdir(args.players):
+            player_tags = load_decks(args.players)["player_tag"].unique().tolist()
+        else:
+            player_tags = pd.read_csv(args.players, usecols=["player_tag"])["player_tag"].unique().tolist()
+
+    index = BattleIndex(args.index)
+    try:
+        with BattleSink(args.root, index, args.batch_size) as sink:
+            seen = BattleLogIngester(classifier, index, args.workers).ingest(player_tags, sink)
+        print(f"Read {seen} new battle entries from {len(player_tags)} logs: "
+              f"{sink.records_written} stored, {sink.duplicates} duplicates dropped")
+        print(f"Index: {index.counts()}")
+    finally:
+        index.close()
+        classifier.close()
+        if mock is not None:
+            mock.stop()
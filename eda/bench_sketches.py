@@ -0,0 +1,89 @@
+"""
+Memory / accuracy tradeoffs of the approximate (sketch) path vs the exact one
+
+    python bench_sketches.py --decks 100000 1000000 --precisions 10 12 14 16
+
+For each size, decks are drawn from a Zipf-weighted pool of --pool distinct
+decks (so popular lists repeat, as on the real ladder), then distinct decks
+and top decks are counted exactly and with sketches. With --pool 0 every
+deck is an independent draw of 8 skewed cards: almost no deck repeats, the
+exact top decks are ties between decks seen once or twice, and heavy-hitter
+recall on them is close to zero by construction, not a sketch failure.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from sketches import HeavyHitters, HyperLogLog, deck_hashes
+from synthetic import repeated_deck_matrix, synthetic_deck_matrix
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench(n_decks: int, precisions, k: int, epsilon: float, pool: int):
+    matrix = repeated_deck_matrix(n_decks, pool) if pool else synthetic_deck_matrix(n_decks)
+    print(f"\n{n_decks:,} decks" + (f" from a pool of {pool:,}" if pool else ", independent draws"))
+    print(f"{'method':<28}{'estimate':>14}{'error':>9}{'seconds':>10}{'peak MiB':>10}{'state KiB':>11}")
+
+    def python_set():
+        return len({tuple(matrix.decode(i)) for i in range(len(matrix))})
+
+    exact, seconds, peak = _measure(matrix.unique_deck_counts)
+    print(f"{'exact (packed keys)':<28}{exact:>14,}{'':>9}{seconds:>10.2f}{peak / 2**20:>10.1f}{'':>11}")
+    if n_decks <= 1_000_000:
+        _, seconds, peak = _measure(python_set)
+        print(f"{'exact (set of tuples)':<28}{exact:>14,}{'':>9}{seconds:>10.2f}{peak / 2**20:>10.1f}{'':>11}")
+
+    hashes = deck_hashes(matrix)
+    for precision in precisions:
+        def sketch():
+            hll = HyperLogLog(precision)
+            hll.add_hashes(hashes)
+            return hll
+
+        hll, seconds, peak = _measure(sketch)
+        estimate = hll.count()
+        print(f"{f'HyperLogLog p={precision}':<28}{estimate:>14,.0f}{abs(estimate - exact) / exact:>9.2%}"
+              f"{seconds:>10.2f}{peak / 2**20:>10.1f}{hll.registers.nbytes / 1024:>11.1f}")
+
+    # Top decks: exact counts (by hash; collisions are negligible at 64 bits) vs heavy hitters
+    distinct, counts = np.unique(hashes, return_counts=True)
+    exact_hashes = set(distinct[np.argsort(-counts, kind="stable")[:k]].tolist())
+
+    def heavy_hitters():
+        hitters = HeavyHitters(k, epsilon)
+        for start in range(0, len(hashes), 100_000):
+            chunk = hashes[start:start + 100_000]
+            hitters.add(chunk, list(range(start, start + len(chunk))))
+        return hitters
+
+    hitters, seconds, peak = _measure(heavy_hitters)
+    recall = len(exact_hashes & set(hitters.candidates)) / max(len(exact_hashes), 1)
+    print(f"{f'heavy hitters top-{k}':<28}{'recall':>14}{recall:>9.0%}{seconds:>10.2f}"
+          f"{peak / 2**20:>10.1f}{hitters.sketch.table.nbytes / 1024:>11.1f}")
+    print(f"  Count-Min bound: overcount <= {hitters.sketch.epsilon:.4f} x {hitters.sketch.total:,} decks "
+          f"with probability {1 - hitters.sketch.delta:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sketches against exact deck counting")
+    parser.add_argument("--decks", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--precisions", type=int, nargs="+", default=[10, 12, 14, 16])
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--epsilon", type=float, default=0.001)
+    parser.add_argument("--pool", type=int, default=100_000,
+                        help="Distinct decks to draw from (0 = independent draws, few repeats)")
+    args = parser.parse_args()
+
+    for n in args.decks:
+        bench(n, args.precisions, args.top, args.epsilon, args.pool)
@@ -0,0 +1,285 @@
+"""
+Benchmark harness for the crawl, analysis and chart stages
+
+    python benchmark.py --decks 1000 100000 1000000 --check
+
+Collection runs against the local mock API (with configurable latency and
+429s), analysis and charts against synthetic decks. Each stage's wall time,
+tracemalloc peak and peak process RSS are appended to a JSON-lines file
+tagged with the git commit, and --check fails when a stage is slower or
+uses more memory than its recent history on other commits.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from cube import DeckCube
+from eda import ClanBasedStrategyClassifier
+from mock_api import MockClashRoyaleAPI, build_world
+from mmap_store import DeckStore
+from synthetic import synthetic_decks
+from visual import CUBE_FIGURES, FIGURES, compute_chart_data, render_figure
+
+
+def git_commit() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = "unknown", False
+    return {"commit": commit, "dirty": dirty}
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None where it cannot be read"""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def max_rss() -> Optional[int]:
+    """The process's lifetime RSS high-water mark in bytes"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+class RssSampler:
+    """
+    Peak process RSS while a block runs, above the RSS it started at
+
+    tracemalloc only sees memory allocated through Python's allocators,
+    not polars or Arrow buffers, so it reports next to nothing for the
+    polars stages. RSS covers every allocation in the process (not in
+    worker processes). It is sampled on a thread every `interval` seconds,
+    and the rusage high-water mark catches spikes between samples whenever
+    they raise it.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak_mib: Optional[float] = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, current_rss() or 0)
+
+    def __enter__(self) -> "RssSampler":
+        self._start, self._start_max = current_rss(), max_rss()
+        self._peak = self._start or 0
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        if self._start is None:
+            return
+        peak = max(self._peak, current_rss() or 0)
+        end_max = max_rss()
+        if end_max is not None and self._start_max is not None and end_max > self._start_max:
+            peak = max(peak, end_max)
+        self.peak_mib = (peak - self._start) / 2 ** 20
+
+
+def measure(fn: Callable, trace_memory: bool = True):
+    """
+    Run fn with its console output silenced
+
+    Returns (result, seconds, tracemalloc peak MiB or None, peak RSS growth MiB or None).
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with RssSampler() as rss, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result, seconds, peak, rss.peak_mib
+
+
+class Benchmark:
+    """Runs stages and records one JSON line per stage run"""
+
+    def __init__(self, results_path: str, trace_memory: bool = True):
+        self.results_path = results_path
+        self.trace_memory = trace_memory
+        self.run_info = dict(git_commit(), python=platform.python_version(),
+                             machine=platform.machine(), cpus=os.cpu_count())
+        self.results: List[Dict] = []
+
+    def stage(self, name: str, params: Dict, fn: Callable):
+        result, seconds, peak, rss = measure(fn, self.trace_memory)
+        row = dict(self.run_info, timestamp=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   stage=name, params=params, seconds=round(seconds, 4),
+                   peak_mib=round(peak, 2) if peak is not None else None,
+                   rss_mib=round(rss, 2) if rss is not None else None)
+        self.results.append(row)
+        with open(self.results_path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(row) + "\n")
+        peak_text = f"{peak:9.1f} MiB" if peak is not None else " " * 13
+        rss_text = f"{rss:9.1f} MiB RSS" if rss is not None else ""
+        print(f"  {name:<28}{json.dumps(params, sort_keys=True):<48}{seconds:9.3f} s {peak_text} {rss_text}")
+        return result
+
+
+def bench_collect(bench: Benchmark, locations: int, clans: int, members: int, workers: int,
+                  latency: float, rate_limit: Optional[float], throttle_probability: float):
+    world = build_world(n_locations=locations, clans_per_location=clans, members_per_clan=members)
+    params = {"locations": locations, "clans": clans, "members": members, "workers": workers,
+              "latency": latency, "rate_limit": rate_limit, "throttle": throttle_probability}
+    with MockClashRoyaleAPI(world, latency=latency, rate_limit=rate_limit,
+                            throttle_probability=throttle_probability, retry_after=0.05) as api:
+        classifier = ClanBasedStrategyClassifier("benchmark", base_url=api.base_url, backoff_base=0.01,
+                                                 backoff_max=0.5)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                classifier.fetch_cards()
+                classifier.fetch_locations()
+            location_ids = [loc["id"] for loc in world["locations"]]
+            bench.stage("collect_clan_deck_data", params, lambda: classifier.collect_clan_deck_data(
+                location_ids, clans, members, delay_between_requests=0.0, max_workers=workers))
+        finally:
+            classifier.close()
+
+
+def bench_analysis(bench: Benchmark, n_decks: int, regions: int, clans: int, dpi: int, figures: List[str],
+                   analysis_workers: Optional[int] = None):
+    params = {"decks": n_decks, "regions": regions, "clans": clans}
+    deck_data = synthetic_decks(n_decks, n_regions=regions, n_clans=clans)
+    classifier = ClanBasedStrategyClassifier("benchmark")
+    try:
+        bench.stage("analyze_clan_strategies", params, lambda: classifier.analyze_clan_strategies(deck_data))
+        with tempfile.TemporaryDirectory() as store_dir:
+            path = os.path.join(store_dir, "decks")
+            store = bench.stage("mmap_store_write", params, lambda: DeckStore.write(deck_data, path))
+            bench.stage("analyze_clan_strategies:mmap", dict(params, workers=analysis_workers),
+                        lambda: classifier.analyze_clan_strategies(store, workers=analysis_workers))
+    finally:
+        classifier.close()
+
+    cube = bench.stage("cube_build", params, lambda: DeckCube.build(deck_data))
+    bench.stage("cube_query", params, lambda: cube.query(["location_name", "clan_name"], n=10))
+    bench.stage("compute_chart_data:cube", params,
+                lambda: compute_chart_data(None, figures=CUBE_FIGURES, cube=cube))
+
+    chart_data = bench.stage("compute_chart_data", params, lambda: compute_chart_data(deck_data))
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name in figures:
+            path = os.path.join(out_dir, f"{FIGURES[name][0]}.png")
+            bench.stage(f"chart:{name}", dict(params, dpi=dpi),
+                        lambda: render_figure(name, chart_data[name], path, dpi))
+
+
+def _key(row: Dict) -> str:
+    return row["stage"] + json.dumps(row["params"], sort_keys=True)
+
+
+# Measure -> (unit, smallest increase worth reporting); memory below a few MiB is noise
+CHECKED = {"seconds": ("s", 0.0), "peak_mib": ("MiB", 4.0), "rss_mib": ("MiB", 4.0)}
+
+
+def check_regressions(results_path: str, current: List[Dict], tolerance: float = 0.2,
+                      history: int = 5) -> List[str]:
+    """
+    Stages slower, or with a higher memory peak, than tolerance x the median
+    of their last `history` runs on other commits
+
+    Only runs with the same stage, parameters and machine are compared.
+    """
+    past: Dict[str, Dict[str, List[float]]] = {}
+    if os.path.exists(results_path):
+        with open(results_path, encoding="utf-8") as fh:
+            for line in fh:
+                row = json.loads(line)
+                if row["commit"] == current[0]["commit"] or row["machine"] != current[0]["machine"]:
+                    continue
+                for measure_name in CHECKED:
+                    if row.get(measure_name) is not None:
+                        past.setdefault(_key(row), {}).setdefault(measure_name, []).append(row[measure_name])
+
+    regressions = []
+    for row in current:
+        for measure_name, (unit, min_increase) in CHECKED.items():
+            baseline = past.get(_key(row), {}).get(measure_name, [])[-history:]
+            value = row.get(measure_name)
+            if not baseline or value is None:
+                continue
+            median = statistics.median(baseline)
+            if value > median * (1 + tolerance) and value - median > min_increase:
+                regressions.append(f"{row['stage']} {json.dumps(row['params'], sort_keys=True)}: "
+                                   f"{measure_name} {value:.3f}{unit} vs median {median:.3f}{unit} "
+                                   f"over {len(baseline)} runs")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the collection, analysis and chart stages")
+    parser.add_argument("--decks", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--regions", type=int, default=5)
+    parser.add_argument("--clans", type=int, default=50, help="Clans in the synthetic deck data")
+    parser.add_argument("--figures", nargs="+", default=list(FIGURES), choices=list(FIGURES))
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--skip-collect", action="store_true")
+    parser.add_argument("--collect-locations", type=int, default=3)
+    parser.add_argument("--collect-clans", type=int, default=5)
+    parser.add_argument("--collect-members", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--analysis-workers", type=int, help="Map-reduce processes over the deck store")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock API latency per request (s)")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Mock API requests/s per key")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Fraction of mock requests refused with 429")
+    parser.add_argument("--results", default="benchmarks.jsonl")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Time only (tracemalloc slows allocation)")
+    parser.add_argument("--check", action="store_true", help="Exit 1 if a stage's time or memory regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    bench = Benchmark(args.results, trace_memory=not args.no_tracemalloc)
+    print(f"Benchmarking commit {bench.run_info['commit']}{' (dirty)' if bench.run_info['dirty'] else ''}")
+
+    if not args.skip_collect:
+        for workers in args.workers:
+            bench_collect(bench, args.collect_locations, args.collect_clans, args.collect_members, workers,
+                          args.latency, args.rate_limit, args.throttle)
+    for n_decks in args.decks:
+        bench_analysis(bench, n_decks, args.regions, args.clans, args.dpi, args.figures, args.analysis_workers)
+
+    print(f"\nAppended {len(bench.results)} results to {args.results}")
+    if args.check:
+        # History from this commit (including what was just appended) is excluded
+        regressions = check_regressions(args.results, bench.results, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print("No regressions")
@@ -0,0 +1,107 @@
+import json
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from deck_matrix import DeckMatrix
+
+
+class CardCatalog:
+    """
+    Dict- and array-backed lookups for cards and locations
+
+    Cards are kept sorted by ID and that order defines the dense column
+    index every deck encoding uses, so a DeckMatrix built by ID or by name
+    from the same catalog has identical columns. Parallel arrays hold the
+    per-card attributes (elixir, rarity) for vectorized use.
+    """
+
+    def __init__(self, cards: Iterable[Dict] = (), locations: Iterable[Dict] = ()):
+        self.set_cards(cards)
+        self.set_locations(locations)
+
+    def set_cards(self, cards: Iterable[Dict]):
+        """(Re)build the card indexes from /cards items"""
+        cards = sorted(cards, key=lambda card: card["id"])
+
+        self.card_ids = np.array([card["id"] for card in cards], dtype=np.int64)
+        self.card_names: List[str] = [card.get("name", str(card["id"])) for card in cards]
+        self.elixir = np.array([card.get("elixirCost", 0) or 0 for card in cards], dtype=np.int16)
+        self.rarity: List[Optional[str]] = [card.get("rarity") for card in cards]
+
+        self.id_to_name: Dict[int, str] = dict(zip(self.card_ids.tolist(), self.card_names))
+        self.name_to_id: Dict[str, int] = {name: card_id for card_id, name in self.id_to_name.items()}
+        self.id_to_index: Dict[int, int] = {card_id: i for i, card_id in enumerate(self.card_ids.tolist())}
+        self.name_to_index: Dict[str, int] = {name: i for i, name in enumerate(self.card_names)}
+
+    def set_locations(self, locations: Iterable[Dict]):
+        """(Re)build the location index from /locations items"""
+        self.location_names: Dict[int, str] = {loc["id"]: loc.get("name", "") for loc in locations}
+
+    @property
+    def n_cards(self) -> int:
+        return len(self.card_names)
+
+    def card_name(self, card: Hashable) -> str:
+        """Name for a card ID (names pass through unchanged)"""
+        return self.id_to_name.get(card, card)
+
+    def card_id(self, card: Hashable) -> Optional[int]:
+        """ID for a card name (IDs pass through unchanged)"""
+        if card in self.id_to_name:
+            return card
+        return self.name_to_id.get(card)
+
+    def card_index(self, card: Hashable) -> int:
+        """Dense column index of a card given its ID or name; -1 if unknown"""
+        index = self.id_to_index.get(card)
+        if index is None:
+            index = self.name_to_index.get(card, -1)
+        return index
+
+    def location_name(self, location_id: int) -> str:
+        return self.location_names.get(location_id, f"Location_{location_id}")
+
+    def encode(self, cards: Sequence[Hashable]) -> np.ndarray:
+        """Dense indices of one deck's cards (IDs or names)"""
+        return np.fromiter((self.card_index(card) for card in cards), dtype=np.int16, count=len(cards))
+
+    def deck_matrix(self, decks: Iterable[Sequence[Hashable]], by: str = "id") -> DeckMatrix:
+        """Encode decks given as card IDs (by="id") or names (by="name") on the catalog's columns"""
+        if by == "id":
+            vocabulary = self.card_ids.tolist()
+        elif by == "name":
+            vocabulary = self.card_names
+        else:
+            raise ValueError(f"by must be 'id' or 'name', not {by!r}")
+        return DeckMatrix.from_decks(decks, vocabulary)
+
+    @classmethod
+    def from_frame(cls, deck_data: pd.DataFrame) -> "CardCatalog":
+        """Recover the card ID <-> name pairs from a deck table holding both `cards` and `card_ids`"""
+        pairs = pd.DataFrame({
+            "name": deck_data["cards"].explode().to_numpy(),
+            "id": deck_data["card_ids"].explode().to_numpy(),
+        }).dropna().drop_duplicates("id")
+
+        locations = deck_data[["location_id", "location_name"]].drop_duplicates("location_id")
+        return cls(
+            cards=[{"id": int(row.id), "name": row.name} for row in pairs.itertuples(index=False)],
+            locations=[{"id": int(row.location_id), "name": row.location_name}
+                       for row in locations.itertuples(index=False)],
+        )
+
+    def save(self, path: str):
+        cards = [{"id": card_id, "name": name, "elixirCost": int(elixir), "rarity": rarity}
+                 for card_id, name, elixir, rarity
+                 in zip(self.card_ids.tolist(), self.card_names, self.elixir, self.rarity)]
+        locations = [{"id": loc_id, "name": name} for loc_id, name in self.location_names.items()]
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump({"cards": cards, "locations": locations}, fh, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "CardCatalog":
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(data.get("cards", []), data.get("locations", []))
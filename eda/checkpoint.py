@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+
+class CollectionCheckpoint:
+    """
+    Append-only JSON-lines journal of a crawl
+
+    Every fetched player profile is written as soon as it arrives, and every
+    clan is marked once all of its sampled members are in, so an interrupted
+    run can pick up from the last player it saw. Two kinds of lines are
+    written:
+
+        {"kind": "player", "tag": ..., "at": ..., "record": {...} | null}
+        {"kind": "clan", "location_id": ..., "clan_tag": ..., "at": ..., "members": [...]}
+
+    With max_age set (seconds) the checkpoint doubles as a delta refresh:
+    snapshots older than that are treated as missing and re-fetched, while
+    newer ones are reused without an API call.
+    """
+
+    def __init__(self, path: str = "collection_checkpoint.jsonl", max_age: Optional[float] = None):
+        self.path = path
+        self.max_age = max_age
+        self._players: Dict[str, Tuple[float, Optional[Dict]]] = {}
+        self._clans: Dict[Tuple[int, str], Tuple[float, List[Dict]]] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            self._load()
+        self._fh = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def _clean_tag(tag: str) -> str:
+        return tag.replace("#", "")
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves at most one torn line at the end
+                    continue
+
+                if entry.get("kind") == "player":
+                    self._players[entry["tag"]] = (entry["at"], entry.get("record"))
+                elif entry.get("kind") == "clan":
+                    key = (entry["location_id"], entry["clan_tag"])
+                    self._clans[key] = (entry["at"], entry.get("members", []))
+
+    def _is_fresh(self, at: float) -> bool:
+        return self.max_age is None or time.time() - at < self.max_age
+
+    def _append(self, entry: Dict, sync: bool = False):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._fh.write(line + "\n")
+            self._fh.flush()
+            if sync:
+                os.fsync(self._fh.fileno())
+
+    def lookup_player(self, player_tag: str) -> Tuple[bool, Optional[Dict]]:
+        """Return (found, record) for a fresh snapshot; record is None for players with no deck"""
+        snapshot = self._players.get(self._clean_tag(player_tag))
+        if snapshot is None or not self._is_fresh(snapshot[0]):
+            return False, None
+        return True, snapshot[1]
+
+    def record_player(self, player_tag: str, record: Optional[Dict]):
+        """Journal a fetched player; pass None when they had no deck or no profile"""
+        tag = self._clean_tag(player_tag)
+        at = time.time()
+        self._players[tag] = (at, record)
+        self._append({"kind": "player", "tag": tag, "at": at, "record": record})
+
+    def clan_members(self, location_id: int, clan_tag: str) -> Optional[List[Dict]]:
+        """Sampled roster of a clan completed within max_age, or None if it must be walked again"""
+        done = self._clans.get((location_id, self._clean_tag(clan_tag)))
+        if done is None or not self._is_fresh(done[0]):
+            return None
+        return done[1]
+
+    def mark_clan_done(self, location_id: int, clan_tag: str, members: List[Dict]):
+        """Journal that every sampled member of a clan has been recorded"""
+        tag = self._clean_tag(clan_tag)
+        roster = [{"tag": m.get("tag", ""), "name": m.get("name", "Unknown")} for m in members]
+        at = time.time()
+        self._clans[(location_id, tag)] = (at, roster)
+        self._append({"kind": "clan", "location_id": location_id, "clan_tag": tag,
+                      "at": at, "members": roster}, sync=True)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Latest snapshot of every player that had a deck"""
+        return pd.DataFrame([record for _, record in self._players.values() if record is not None])
+
+    def compact(self):
+        """Rewrite the journal keeping only the latest entry per player and clan"""
+        with self._lock:
+            self._fh.close()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                for tag, (at, record) in self._players.items():
+                    fh.write(json.dumps({"kind": "player", "tag": tag, "at": at, "record": record},
+                                        ensure_ascii=False, separators=(",", ":")) + "\n")
+                for (location_id, clan_tag), (at, members) in self._clans.items():
+                    fh.write(json.dumps({"kind": "clan", "location_id": location_id, "clan_tag": clan_tag,
+                                         "at": at, "members": members},
+                                        ensure_ascii=False, separators=(",", ":")) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_path, self.path)
+            self._fh = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
@@ -0,0 +1,474 @@
+"""
+Command-line entry point for the deck pipeline
+
+    python cli.py collect 57000000 57000001 --clans 5 --members 10 --store decks_parquet
+    python cli.py analyze --input decks_parquet --output-dir analysis
+    python cli.py render --input decks_parquet --output-dir visualizations --preview
+    python cli.py convert clan_based_deckss.csv decks_parquet
+    python cli.py convert clan_based_deckss.csv decks_mmap --format mmap
+    python cli.py analyze --input decks_mmap --workers 8
+    python cli.py analyze --battles battles_parquet --archetypes archetype_model.json
+    python cli.py query --by location_name --location-names Europe --min-clan-score 50000 --top 10
+    python cli.py history --store decks_parquet --archetypes archetype_model.json
+
+Only argparse is imported up front; each subcommand imports what it needs
+(convert never loads requests or matplotlib, collect never loads
+matplotlib), so small scheduled jobs start quickly.
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+
+def _snapshot_filter(snapshots: Optional[List[str]], available: List[str],
+                     all_snapshots: bool) -> Optional[List[str]]:
+    """
+    Snapshot dates to read: the requested ones, all of them, or the latest
+
+    Each crawl snapshot is a full copy of the decks at that date, so summing
+    several counts the same players once per snapshot.
+    """
+    if snapshots is not None or all_snapshots or not available:
+        return snapshots
+    return [max(available)]
+
+
+def _load_decks(path: str, locations: Optional[List[int]] = None, snapshots: Optional[List[str]] = None,
+                frame: bool = True, all_snapshots: bool = False):
+    """
+    Decks from a Parquet store directory, a memory-mapped deck store or a legacy CSV
+
+    Without `snapshots`, only the latest snapshot is read unless
+    all_snapshots is set. A memory-mapped store is returned as a DeckStore
+    when frame=False and no filter applies, so the analysis can map-reduce
+    over it directly.
+    """
+    from mmap_store import MANIFEST, DeckStore
+
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        import numpy as np
+
+        store = DeckStore(path)
+        rows = np.ones(len(store), dtype=bool)
+        if locations is not None:
+            rows &= np.isin(store.column("location_id"), locations)
+        if "snapshot_date" in store.columns:
+            dates = store.values("snapshot_date")
+            available = store.categories("snapshot_date") or np.unique(dates).tolist()
+            snapshots = _snapshot_filter(snapshots, available, all_snapshots)
+            if snapshots is not None:
+                rows &= np.isin(dates, snapshots)
+        if frame or not rows.all():
+            return store.to_frame(rows)
+        return store
+
+    from storage import list_snapshots, load_decks, read_deck_csv
+
+    if os.path.isdir(path):
+        return load_decks(path, locations, _snapshot_filter(snapshots, list_snapshots(path), all_snapshots))
+    deck_data = read_deck_csv(path)
+    if locations is not None:
+        deck_data = deck_data[deck_data["location_id"].isin(locations)].reset_index(drop=True)
+    return deck_data
+
+
+def _load_catalog(path: Optional[str], deck_data):
+    from catalog import CardCatalog
+
+    if path and os.path.exists(path):
+        return CardCatalog.load(path)
+    if "card_ids" in deck_data.columns:
+        return CardCatalog.from_frame(deck_data)
+    return None
+
+
+def _load_cube(path: str, locations: Optional[List[int]] = None, snapshots: Optional[List[str]] = None,
+               all_snapshots: bool = False):
+    """The aggregate cube at path, restricted to the given locations and snapshots (default: the latest)"""
+    from cube import DeckCube
+
+    cube = DeckCube.load(path, _snapshot_filter(snapshots, DeckCube.list_snapshots(path), all_snapshots))
+    return cube.filter(location_ids=locations) if locations is not None else cube
+
+
+def cmd_collect(args) -> int:
+    from eda import ClanBasedStrategyClassifier, load_api_key
+    from checkpoint import CollectionCheckpoint
+    from metrics import Metrics
+    from cube import DeckCube
+    from response_cache import ResponseCache
+    from storage import write_deck_snapshot
+    from timeseries import MetaHistory
+
+    api_key = load_api_key(args.api_key_env)
+    if not api_key and args.base_url is None:
+        print(f"No API key: set {args.api_key_env} in the environment or .env", file=sys.stderr)
+        return 2
+
+    metrics = Metrics(profile_dir=args.profile_dir, trace_memory=args.trace_memory)
+    options = {"base_url": args.base_url} if args.base_url else {}
+    classifier = ClanBasedStrategyClassifier(
+        api_key,
+        requests_per_second=args.rps,
+        cache=ResponseCache(args.cache) if args.cache else None,
+        checkpoint=CollectionCheckpoint(args.checkpoint, max_age=args.max_age) if args.checkpoint else None,
+        metrics=metrics,
+        quiet=args.quiet,
+        **options,
+    )
+    try:
+        classifier.fetch_cards()
+        classifier.fetch_locations()
+        deck_data = classifier.collect_clan_deck_data(
+            location_ids=args.locations,
+            clans_per_location=args.clans,
+            members_per_clan=args.members,
+            delay_between_requests=args.delay,
+            max_workers=args.workers,
+        )
+    finally:
+        classifier.close()
+
+    if deck_data.empty:
+        print("No data collected!")
+        return 1
+
+    if args.output:
+        deck_data.to_csv(args.output, index=False)
+        print(f"Saved {len(deck_data)} decks to {args.output}")
+    if args.store:
+        write_deck_snapshot(deck_data, args.store, args.snapshot_date)
+        print(f"Saved snapshot to {args.store}")
+    if args.cube:
+        cube = DeckCube.load_or_new(args.cube).update(DeckCube.build(deck_data, args.snapshot_date))
+        cube.save(args.cube)
+        print(f"Updated aggregate cube {args.cube} ({len(cube.snapshots)} snapshots)")
+    if args.history:
+        history = MetaHistory.load_or_new(args.history)
+        history.add_snapshot(deck_data, args.snapshot_date, replace=True)
+        history.save(args.history)
+        print(f"Updated snapshot history {args.history} ({len(history.snapshots)} snapshots)")
+    if args.catalog:
+        classifier.catalog.save(args.catalog)
+    if args.metrics:
+        metrics.write_jsonl(args.metrics)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+    return 0
+
+
+def cmd_analyze(args) -> int:
+    import pandas as pd
+    from eda import ClanBasedStrategyClassifier
+    from archetypes import archetype_shares
+    from cooccurrence import regional_synergy_tables
+    from mmap_store import DeckStore
+
+    # With a cube the clan statistics need no decks; synergies, archetypes and battle players still do
+    cube = _load_cube(args.cube, args.locations, args.snapshots, args.all_snapshots) if args.cube else None
+    if cube is None or not args.no_synergies or args.archetypes or args.battles:
+        deck_data = _load_decks(args.input, args.locations, args.snapshots, frame=False,
+                                all_snapshots=args.all_snapshots)
+    else:
+        deck_data = cube
+    if len(deck_data) == 0:
+        print("No data to analyze!")
+        return 1
+    store = deck_data if isinstance(deck_data, DeckStore) else None
+
+    classifier = ClanBasedStrategyClassifier(None, quiet=True)
+    catalog = _load_catalog(args.catalog, deck_data) if isinstance(deck_data, pd.DataFrame) else None
+    if catalog is not None:
+        classifier.catalog = catalog
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    try:
+        results = classifier.analyze_clan_strategies(
+            cube if cube is not None else deck_data,
+            top_cards_per_region=args.top_cards,
+            sample_clans=args.sample_clans,
+            top_cards_per_clan=args.top_cards_per_clan,
+            top_variance_cards=args.top_variance_cards,
+            workers=args.workers,
+        )
+        for name, frame in (results or {}).items():
+            frame.write_csv(os.path.join(args.output_dir, f"{name}.csv"))
+
+        if not args.no_synergies:
+            if store is not None:
+                synergies = regional_synergy_tables(store.matrix(), store.values("location_name"))
+            elif catalog is not None and "card_ids" in deck_data.columns:
+                synergies = regional_synergy_tables(catalog.deck_matrix(deck_data["card_ids"]),
+                                                    deck_data["location_name"])
+                synergies["card"] = synergies["card"].map(catalog.card_name)
+                synergies["partner"] = synergies["partner"].map(catalog.card_name)
+            else:
+                from deck_matrix import DeckMatrix
+                synergies = regional_synergy_tables(DeckMatrix.from_frame(deck_data), deck_data["location_name"])
+            synergies.to_csv(os.path.join(args.output_dir, "card_synergies.csv"), index=False)
+
+        if args.archetypes:
+            if store is not None:
+                deck_data = store.to_frame()
+                catalog = _load_catalog(args.catalog, deck_data)
+                if catalog is not None:
+                    classifier.catalog = catalog
+            deck_data["archetype"] = classifier.classify_decks(deck_data, model_path=args.archetypes,
+                                                               refit=args.refit_archetypes)
+            shares = archetype_shares(deck_data["archetype"], deck_data["location_name"])
+            shares.to_csv(os.path.join(args.output_dir, "archetype_shares.csv"), index=False)
+            print(f"{len(classifier.archetype_model)} archetypes; shares saved")
+
+        if args.battles:
+            from battles import scan_battles
+            from winrates import PLAYER_DIMENSIONS, win_rate_tables
+
+            if store is not None:
+                players = pd.DataFrame({name: store.values(name) for name in ("player_tag",) + PLAYER_DIMENSIONS
+                                        if name in store.columns})
+            else:
+                players = deck_data
+            if catalog is None:
+                catalog = _load_catalog(args.catalog, players)
+            battles = scan_battles(args.battles).collect()
+            tables = win_rate_tables(battles, players, catalog=catalog, model=classifier.archetype_model,
+                                     min_games=args.min_games)
+            for name, table in tables.items():
+                table.to_csv(os.path.join(args.output_dir, f"{name}.csv"), index=False)
+            print(f"Win rates from {len(battles)} battles saved")
+    finally:
+        classifier.close()
+
+    if args.metrics:
+        classifier.metrics.write_jsonl(args.metrics)
+    print(f"Wrote analysis tables to {args.output_dir}/")
+    return 0
+
+
+def cmd_render(args) -> int:
+    from metrics import Metrics
+    from timeseries import MetaHistory
+    from visual import CUBE_FIGURES, FIGURES, create_clash_royale_visualizations
+
+    unknown = [name for name in args.figures or [] if name not in FIGURES]
+    if unknown:
+        print(f"Unknown figures {unknown}; expected some of {list(FIGURES)}", file=sys.stderr)
+        return 2
+
+    cube = _load_cube(args.cube, args.locations, args.snapshots, args.all_snapshots) if args.cube else None
+    history = MetaHistory.load(args.history) if args.history else None
+    served = list(CUBE_FIGURES if cube is not None else []) + (["trend"] if history is not None else [])
+    if all(name in served for name in args.figures or FIGURES):
+        deck_data = None
+    else:
+        deck_data = _load_decks(args.input, args.locations, args.snapshots, all_snapshots=args.all_snapshots)
+    os.makedirs(args.output_dir, exist_ok=True)
+    metrics = Metrics(profile_dir=args.profile_dir, trace_memory=args.trace_memory)
+    paths = create_clash_royale_visualizations(
+        deck_data,
+        output_dir=args.output_dir,
+        figures=args.figures,
+        preview=args.preview,
+        fmt=args.fmt,
+        dpi=args.dpi,
+        workers=args.workers,
+        catalog=_load_catalog(args.catalog, deck_data) if deck_data is not None else None,
+        approximate=args.approximate,
+        metrics=metrics,
+        cube=cube,
+        history=history,
+    )
+    if args.metrics:
+        metrics.write_jsonl(args.metrics)
+    return 0 if paths else 1
+
+
+def cmd_query(args) -> int:
+    import polars as pl
+
+    # Grouping by snapshot_date asks for more than one snapshot
+    cube = _load_cube(args.cube, snapshots=args.snapshots,
+                      all_snapshots=args.all_snapshots or "snapshot_date" in args.by)
+    filters = {name: getattr(args, name) for name in
+               ("location_ids", "location_names", "clan_tags", "min_clan_score", "max_clan_score",
+                "min_trophies", "max_trophies")
+               if getattr(args, name) is not None}
+    result = cube.query(args.by, n=args.top, **filters)
+    if args.output:
+        result.write_csv(args.output)
+        print(f"Wrote {len(result)} rows to {args.output}")
+    else:
+        with pl.Config(tbl_rows=len(result), tbl_cols=-1):
+            print(result)
+    return 0
+
+
+def cmd_history(args) -> int:
+    import polars as pl
+    from archetypes import ArchetypeModel
+    from timeseries import MetaHistory
+
+    history = MetaHistory.load_or_new(args.history)
+    if args.store:
+        model = ArchetypeModel.load(args.archetypes) if args.archetypes else None
+        added = history.add_from_store(args.store, model)
+        if added:
+            history.save(args.history)
+        print(f"Added {len(added)} snapshots; {len(history.snapshots)} in {args.history}")
+
+    tables = {
+        "trajectories": history.trajectories(args.kind, args.locations),
+        "trends": history.trends(args.kind, args.locations, window=args.window,
+                                 min_snapshots=args.min_snapshots),
+        "change_points": history.change_points(args.kind, args.locations),
+    }
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for name, frame in tables.items():
+            frame.write_csv(os.path.join(args.output_dir, f"{args.kind}_{name}.csv"))
+        print(f"Wrote {args.kind} trajectories, trends and change points to {args.output_dir}/")
+
+    with pl.Config(tbl_rows=40, tbl_cols=-1):
+        print(tables["trends"].filter(pl.col("direction") != "flat"))
+        print(tables["change_points"])
+    return 0
+
+
+def cmd_convert(args) -> int:
+    from storage import convert_csv, read_deck_csv
+
+    if args.format == "mmap":
+        from mmap_store import DeckStore
+
+        DeckStore.write(read_deck_csv(args.csv_path), args.root)
+    else:
+        convert_csv(args.csv_path, args.root, args.snapshot_date)
+    print(f"Wrote {args.csv_path} to {args.root}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Clash Royale clan deck pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_input(sub):
+        sub.add_argument("--input", default="decks_parquet",
+                         help="Parquet deck store, memory-mapped deck store or legacy CSV")
+        sub.add_argument("--locations", type=int, nargs="+", help="Only these location IDs")
+        sub.add_argument("--snapshots", nargs="+", help="Only these snapshot dates (default: the latest)")
+        sub.add_argument("--all-snapshots", action="store_true",
+                         help="Aggregate over every snapshot (each counts its players again)")
+        sub.add_argument("--catalog", default="card_catalog.json",
+                         help="Card catalog JSON (recovered from the data if missing)")
+        sub.add_argument("--metrics", help="Append run metrics as a JSON line to this file")
+
+    def add_profiling(sub):
+        sub.add_argument("--profile-dir", help="Write a cProfile dump per stage here")
+        sub.add_argument("--trace-memory", action="store_true", help="Record tracemalloc peaks per stage")
+
+    collect = commands.add_parser("collect", help="Crawl top clans' member decks from the API")
+    collect.add_argument("locations", type=int, nargs="+", help="Location IDs to crawl")
+    collect.add_argument("--clans", type=int, default=10, help="Top clans per location")
+    collect.add_argument("--members", type=int, default=10, help="Members sampled per clan")
+    collect.add_argument("--workers", type=int, default=1)
+    collect.add_argument("--delay", type=float, default=0.2, help="Seconds between requests (serial crawl)")
+    collect.add_argument("--rps", type=float, help="Requests per second for the key")
+    collect.add_argument("--output", help="Also write the decks to this CSV")
+    collect.add_argument("--store", default="decks_parquet", help="Parquet deck store to add a snapshot to")
+    collect.add_argument("--snapshot-date", help="YYYY-MM-DD (defaults to today)")
+    collect.add_argument("--catalog", default="card_catalog.json")
+    collect.add_argument("--cube", default="deck_cube", help="Aggregate cube to fold the snapshot into ('' to skip)")
+    collect.add_argument("--history", default="meta_history", help="Snapshot history to add to ('' to skip)")
+    collect.add_argument("--cache", default="api_cache.sqlite", help="Response cache ('' to disable)")
+    collect.add_argument("--checkpoint", default="collection_checkpoint.jsonl", help="Crawl journal ('' to disable)")
+    collect.add_argument("--max-age", type=float, default=12 * 3600,
+                         help="Seconds before a journaled player is re-fetched")
+    collect.add_argument("--api-key-env", default="API_TOKEN")
+    collect.add_argument("--base-url", help="API base URL (e.g. a mock server)")
+    collect.add_argument("--quiet", action="store_true", help="No per-clan / per-player output")
+    collect.add_argument("--metrics", help="Append run metrics as a JSON line to this file")
+    collect.add_argument("--prometheus", help="Write metrics in Prometheus text format to this file")
+    add_profiling(collect)
+    collect.set_defaults(func=cmd_collect)
+
+    analyze = commands.add_parser("analyze", help="Regional / clan card statistics, synergies and archetypes")
+    add_input(analyze)
+    analyze.add_argument("--output-dir", default="analysis")
+    analyze.add_argument("--top-cards", type=int, default=10, help="Top cards per region")
+    analyze.add_argument("--sample-clans", type=int, default=5)
+    analyze.add_argument("--top-cards-per-clan", type=int, default=5)
+    analyze.add_argument("--top-variance-cards", type=int, default=10)
+    analyze.add_argument("--no-synergies", action="store_true")
+    analyze.add_argument("--archetypes", help="Archetype model JSON (fitted and saved there if missing)")
+    analyze.add_argument("--refit-archetypes", action="store_true")
+    analyze.add_argument("--workers", type=int, help="Map-reduce processes for a memory-mapped store")
+    analyze.add_argument("--battles", help="Battle store (battles.py) to compute card, pair, matchup and "
+                                           "archetype win rates from")
+    analyze.add_argument("--min-games", type=int, default=20, help="Fewest games for a win-rate row")
+    analyze.add_argument("--cube", help="Take the clan statistics from this aggregate cube instead of the decks")
+    analyze.set_defaults(func=cmd_analyze)
+
+    render = commands.add_parser("render", help="Render the EDA charts")
+    add_input(render)
+    add_profiling(render)
+    render.add_argument("--output-dir", default="visualizations")
+    render.add_argument("--figures", nargs="+", help="Subset of figures by name")
+    render.add_argument("--preview", action="store_true", help="72 dpi for quick iteration")
+    render.add_argument("--fmt", choices=["png", "svg", "pdf"])
+    render.add_argument("--dpi", type=int)
+    render.add_argument("--workers", type=int)
+    render.add_argument("--approximate", action="store_true", help="Sketch-based deck diversity")
+    render.add_argument("--cube", help="Draw the distribution and grouping charts from this aggregate cube")
+    render.add_argument("--history", help="Draw the trend chart from this snapshot history "
+                                          "(otherwise it needs --all-snapshots)")
+    render.set_defaults(func=cmd_render)
+
+    query = commands.add_parser("query", help="Card usage roll-ups from the aggregate cube")
+    query.add_argument("--cube", default="deck_cube")
+    query.add_argument("--by", nargs="*", default=["location_name"],
+                       help="Group columns: snapshot_date, location_id, location_name, clan_tag, clan_name, "
+                            "clan_score, trophy_bucket (none for everything)")
+    query.add_argument("--top", type=int, default=10, help="Top cards per group")
+    query.add_argument("--snapshots", nargs="+", help="Only these snapshot dates (default: the latest)")
+    query.add_argument("--all-snapshots", action="store_true",
+                       help="Aggregate over every snapshot (implied by --by snapshot_date)")
+    query.add_argument("--location-ids", type=int, nargs="+")
+    query.add_argument("--location-names", nargs="+")
+    query.add_argument("--clan-tags", nargs="+")
+    query.add_argument("--min-clan-score", type=int)
+    query.add_argument("--max-clan-score", type=int)
+    query.add_argument("--min-trophies", type=int)
+    query.add_argument("--max-trophies", type=int)
+    query.add_argument("--output", help="Write the result to this CSV instead of printing it")
+    query.set_defaults(func=cmd_query)
+
+    history = commands.add_parser("history", help="Card and archetype trends across crawl snapshots")
+    history.add_argument("--history", default="meta_history", help="Snapshot history directory")
+    history.add_argument("--store", help="Parquet deck store to add missing snapshots from")
+    history.add_argument("--archetypes", help="Archetype model JSON to label snapshots lacking archetype shares")
+    history.add_argument("--kind", choices=["card", "archetype"], default="card")
+    history.add_argument("--locations", nargs="+", help="Only these regions (by name)")
+    history.add_argument("--window", type=int, help="Fit trends over the last N snapshots only")
+    history.add_argument("--min-snapshots", type=int, default=3)
+    history.add_argument("--output-dir", help="Write trajectories, trends and change points as CSVs here")
+    history.set_defaults(func=cmd_history)
+
+    convert = commands.add_parser("convert", help="Convert a legacy deck CSV into a deck store")
+    convert.add_argument("csv_path")
+    convert.add_argument("root")
+    convert.add_argument("--format", choices=["parquet", "mmap"], default="parquet",
+                         help="Partitioned Parquet dataset or fixed-width memory-mapped store")
+    convert.add_argument("--snapshot-date", help="YYYY-MM-DD (defaults to the CSV's modification date)")
+    convert.set_defaults(func=cmd_convert)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from deck_matrix import DeckMatrix
+
+
+METRICS = ("count", "conditional", "lift", "pmi", "npmi")
+
+
+class CooccurrenceEngine:
+    """
+    Full card x card co-occurrence counts plus the synergy measures derived from them
+
+    counts[i, j] is the number of decks holding both card i and card j, so
+    the diagonal holds the per-card deck counts. Counts are accumulated with
+    update(), one DeckMatrix (or chunk of one) at a time, so a dataset that
+    doesn't fit in memory can be streamed through in batches; engines built
+    on separate shards combine with merge().
+
+    Derived measures, all card x card:
+        conditional  P(j | i)                    = C_ij / C_ii
+        lift         P(i, j) / (P(i) P(j))       = C_ij N / (C_ii C_jj)
+        pmi          log2(lift)
+        npmi         pmi / -log2 P(i, j), in [-1, 1]
+    """
+
+    def __init__(self, vocabulary: Sequence[Hashable]):
+        self.vocabulary = list(vocabulary)
+        self.index: Dict[Hashable, int] = {card: i for i, card in enumerate(self.vocabulary)}
+        self.n_decks = 0
+        self.counts = np.zeros((len(self.vocabulary), len(self.vocabulary)), dtype=np.int64)
+
+    @classmethod
+    def from_deck_matrix(cls, matrix: DeckMatrix) -> "CooccurrenceEngine":
+        engine = cls(matrix.vocabulary)
+        engine.update(matrix)
+        return engine
+
+    def update(self, matrix: DeckMatrix):
+        """Fold a batch of encoded decks into the counts"""
+        if matrix.vocabulary != self.vocabulary:
+            raise ValueError("DeckMatrix vocabulary does not match the engine's")
+        self.counts += matrix.cooccurrence()
+        self.n_decks += len(matrix)
+
+    def update_decks(self, decks: Iterable[Sequence[Hashable]]):
+        """Encode a batch of card lists against the engine's vocabulary and fold it in"""
+        self.update(DeckMatrix.from_decks(decks, self.vocabulary))
+
+    def merge(self, other: "CooccurrenceEngine") -> "CooccurrenceEngine":
+        """Add another engine's counts (same vocabulary) into this one"""
+        if other.vocabulary != self.vocabulary:
+            raise ValueError("Cannot merge engines with different vocabularies")
+        self.counts += other.counts
+        self.n_decks += other.n_decks
+        return self
+
+    @property
+    def card_counts(self) -> np.ndarray:
+        return np.diag(self.counts).copy()
+
+    def conditional(self) -> np.ndarray:
+        """P(card j | card i), rows indexed by i"""
+        singles = self.card_counts.astype(float)[:, None]
+        return np.divide(self.counts, singles, out=np.zeros(self.counts.shape), where=singles > 0)
+
+    def lift(self) -> np.ndarray:
+        """How much more often two cards share a deck than independence predicts"""
+        singles = self.card_counts.astype(float)
+        expected = np.outer(singles, singles)
+        return np.divide(self.counts * float(self.n_decks), expected,
+                         out=np.zeros(self.counts.shape), where=expected > 0)
+
+    def pmi(self, normalized: bool = False) -> np.ndarray:
+        """Pointwise mutual information in bits; -inf for pairs never seen together"""
+        lift = self.lift()
+        with np.errstate(divide="ignore"):
+            pmi = np.log2(lift)
+        if not normalized:
+            return pmi
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            joint = self.counts / max(self.n_decks, 1)
+            npmi = pmi / -np.log2(joint)
+        # Pairs always seen together have P(i, j) = 1 and are perfectly associated
+        npmi[joint >= 1] = 1.0
+        npmi[self.counts == 0] = -1.0
+        return npmi
+
+    def metric(self, name: str) -> np.ndarray:
+        if name == "count":
+            return self.counts.astype(float)
+        if name == "conditional":
+            return self.conditional()
+        if name == "lift":
+            return self.lift()
+        if name == "pmi":
+            return self.pmi()
+        if name == "npmi":
+            return self.pmi(normalized=True)
+        raise ValueError(f"Unknown metric {name!r}; expected one of {METRICS}")
+
+    def top_partners(self, card: Hashable, n: int = 5, metric: str = "lift",
+                     min_support: int = 1) -> List[Tuple[Hashable, float, int]]:
+        """Best n synergy partners of a card as (partner, metric value, decks together)"""
+        i = self.index[card]
+        scores = self.metric(metric)[i].copy()
+        eligible = self.counts[i] >= min_support
+        eligible[i] = False
+        scores[~eligible] = -np.inf
+
+        order = np.argsort(-scores, kind="stable")[:min(n, int(eligible.sum()))]
+        return [(self.vocabulary[j], float(scores[j]), int(self.counts[i, j])) for j in order]
+
+    def synergy_table(self, n: int = 5, metric: str = "lift", min_support: int = 1) -> pd.DataFrame:
+        """Top n partners for every card, as one long DataFrame with all measures"""
+        scores = self.metric(metric)
+        eligible = self.counts >= min_support
+        np.fill_diagonal(eligible, False)
+        ranked = np.where(eligible, scores, -np.inf)
+
+        # argsort once over the whole matrix instead of once per card
+        order = np.argsort(-ranked, axis=1, kind="stable")[:, :n]
+        rows = np.repeat(np.arange(len(self.vocabulary)), order.shape[1])
+        cols = order.ravel()
+        keep = eligible[rows, cols]
+        rows, cols = rows[keep], cols[keep]
+
+        conditional = self.conditional()
+        lift = self.lift()
+        pmi = self.pmi()
+        vocabulary = np.asarray(self.vocabulary, dtype=object)
+        return pd.DataFrame({
+            "card": vocabulary[rows],
+            "partner": vocabulary[cols],
+            "decks_together": self.counts[rows, cols],
+            "conditional": conditional[rows, cols],
+            "lift": lift[rows, cols],
+            "pmi": pmi[rows, cols],
+        })
+
+
+def regional_synergy_tables(matrix: DeckMatrix, labels: Sequence[Hashable], n: int = 5,
+                            metric: str = "lift", min_support: int = 2,
+                            overall_label: str = "All regions") -> pd.DataFrame:
+    """Synergy tables for the whole dataset and for each label (e.g. location_name)"""
+    codes, groups = pd.factorize(np.asarray(labels))
+
+    tables = []
+    overall = CooccurrenceEngine.from_deck_matrix(matrix)
+    tables.append(overall.synergy_table(n, metric, min_support).assign(group=overall_label))
+    for g, group in enumerate(groups):
+        engine = CooccurrenceEngine.from_deck_matrix(matrix.subset(codes == g))
+        tables.append(engine.synergy_table(n, metric, min_support).assign(group=group))
+
+    return pd.concat(tables, ignore_index=True)
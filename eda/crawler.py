@@ -0,0 +1,316 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import requests
+
+from eda import ClanBasedStrategyClassifier
+
+
+# Deeper work first, so decks flow out early and the queue stays small
+PRIORITY = {"player": 0, "clan": 1, "location": 2}
+
+
+class WorkQueue:
+    """
+    Durable SQLite work queue shared by crawler processes
+
+    Items are locations, clans and players; each is keyed so enqueueing the
+    same work twice is a no-op. Workers claim items atomically, and claims
+    older than claim_timeout (a crashed worker) become claimable again until
+    the item has been tried max_attempts times, after which it fails.
+    Deck results live in the same file, keyed by player_tag, so a player
+    reached twice is stored once.
+    """
+
+    def __init__(self, path: str, claim_timeout: float = 120.0, max_attempts: int = 5):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                kind TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                claimed_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_pending ON tasks (status, priority, id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS decks (
+                player_tag TEXT PRIMARY KEY,
+                sort_key TEXT NOT NULL,
+                record TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+
+    def put(self, kind: str, key: str, payload: Dict) -> bool:
+        """Enqueue a work item; returns False if the key was already queued"""
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO tasks (key, kind, priority, payload) VALUES (?, ?, ?, ?)",
+            (key, kind, PRIORITY[kind], json.dumps(payload)))
+        return cur.rowcount > 0
+
+    def claim(self, worker_id: str) -> Optional[Tuple[int, str, Dict]]:
+        """Atomically take the next pending item as (id, kind, payload)"""
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # An item whose claims keep going stale may be what kills its workers
+            self._conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                "claimed_by = NULL WHERE status = 'claimed' AND claimed_at < ?",
+                (self.max_attempts, now - self.claim_timeout))
+            row = self._conn.execute(
+                "SELECT id, kind, payload FROM tasks WHERE status = 'pending' "
+                "ORDER BY priority, id LIMIT 1").fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE tasks SET status = 'claimed', claimed_by = ?, claimed_at = ?, "
+                    "attempts = attempts + 1 WHERE id = ?", (worker_id, now, row[0]))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def complete(self, task_id: int):
+        self._conn.execute("UPDATE tasks SET status = 'done' WHERE id = ?", (task_id,))
+
+    def release(self, task_id: int):
+        """Hand an item back (e.g. still rate limited); it fails for good after max_attempts"""
+        self._conn.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "claimed_by = NULL WHERE id = ?", (self.max_attempts, task_id))
+
+    def fail(self, task_id: int):
+        self._conn.execute("UPDATE tasks SET status = 'failed' WHERE id = ?", (task_id,))
+
+    def store_deck(self, record: Dict, sort_key: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO decks VALUES (?, ?, ?, ?)",
+            (record["player_tag"], sort_key, json.dumps(record, ensure_ascii=False), time.time()))
+
+    def has_open_work(self) -> bool:
+        row = self._conn.execute(
+            "SELECT 1 FROM tasks WHERE status IN ('pending', 'claimed') LIMIT 1").fetchone()
+        return row is not None
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        counts = dict(rows)
+        counts["decks"] = self._conn.execute("SELECT COUNT(*) FROM decks").fetchone()[0]
+        return counts
+
+    def results(self) -> pd.DataFrame:
+        """Deduplicated decks in crawl order (location, clan rank, member rank)"""
+        rows = self._conn.execute("SELECT record FROM decks ORDER BY sort_key").fetchall()
+        return pd.DataFrame([json.loads(row[0]) for row in rows])
+
+    def close(self):
+        self._conn.close()
+
+
+def _sort_key(*ranks: int) -> str:
+    return ".".join(f"{rank:06d}" for rank in ranks)
+
+
+def process_task(classifier: ClanBasedStrategyClassifier, queue: WorkQueue, kind: str, payload: Dict):
+    """Run one work item, enqueueing the items it fans out to"""
+    if kind == "location":
+        clans = classifier.fetch_top_clans_by_location(payload["location_id"], payload["clans_per_location"])
+        for clan_rank, clan in enumerate(clans):
+            queue.put("clan", f"clan:{payload['location_id']}:{clan.get('tag', '')}",
+                      dict(payload, clan=clan, ranks=payload["ranks"] + [clan_rank]))
+
+    elif kind == "clan":
+        members = classifier.fetch_clan_members(payload["clan"].get("tag", ""))
+        for member_rank, member in enumerate(members[:payload["members_per_clan"]]):
+            queue.put("player", f"player:{member.get('tag', '')}",
+                      dict(payload, member=member, ranks=payload["ranks"] + [member_rank]))
+
+    elif kind == "player":
+        player_details = classifier.fetch_player_details(payload["member"].get("tag", ""))
+        record = classifier._deck_record(payload["member"], payload["clan"], payload["location_id"],
+                                         payload["location_name"], player_details)
+        if record is not None:
+            queue.store_deck(record, _sort_key(*payload["ranks"]))
+
+    else:
+        raise ValueError(f"Unknown task kind {kind!r}")
+
+
+def crawl_worker(queue_path: str, api_key: str, worker_id: str,
+                 requests_per_second: Optional[float] = None,
+                 base_url: str = "https://api.clashroyale.com/v1",
+                 poll_interval: float = 0.2):
+    """Worker process body: its own key, rate limiter and session, draining the shared queue"""
+    queue = WorkQueue(queue_path)
+    classifier = ClanBasedStrategyClassifier(api_key, requests_per_second=requests_per_second,
+                                             base_url=base_url)
+    try:
+        while True:
+            task = queue.claim(worker_id)
+            if task is None:
+                # Other workers may still fan out more items from what they hold
+                if not queue.has_open_work():
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            task_id, kind, payload = task
+            try:
+                process_task(classifier, queue, kind, payload)
+                queue.complete(task_id)
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status == 404:
+                    queue.complete(task_id)
+                elif status == 429 or (status is not None and status >= 500):
+                    queue.release(task_id)
+                else:
+                    queue.fail(task_id)
+            except requests.exceptions.RequestException:
+                queue.release(task_id)
+            except Exception as e:
+                # A bad payload or a local error must not take the worker (and its claim) down
+                print(f"{worker_id}: {kind} task {task_id} failed: {e!r}")
+                queue.release(task_id)
+    finally:
+        classifier.close()
+        queue.close()
+
+
+class DistributedCrawler:
+    """
+    Multi-key, multi-process version of collect_clan_deck_data
+
+    Seeds a WorkQueue with one item per location and starts one worker
+    process per API key, each with its own token bucket sized to that key's
+    quota, so throughput scales with the number of keys. The queue file is
+    durable: re-running with the same path resumes where it stopped.
+    """
+
+    def __init__(self, queue_path: str, api_keys: List[str],
+                 requests_per_second: Optional[float] = None,
+                 base_url: str = "https://api.clashroyale.com/v1"):
+        if not api_keys:
+            raise ValueError("At least one API key is required")
+        self.queue_path = queue_path
+        self.api_keys = list(api_keys)
+        self.requests_per_second = requests_per_second
+        self.base_url = base_url
+
+    def fetch_location_names(self) -> Dict[int, str]:
+        """Location names from /locations, as collect_clan_deck_data resolves them"""
+        classifier = ClanBasedStrategyClassifier(self.api_keys[0], requests_per_second=self.requests_per_second,
+                                                 base_url=self.base_url)
+        try:
+            classifier.fetch_locations()
+            return dict(classifier.catalog.location_names)
+        finally:
+            classifier.close()
+
+    def seed(self, location_ids: List[int], clans_per_location: int = 10, members_per_clan: int = 10,
+             location_names: Optional[Dict[int, str]] = None):
+        """Enqueue the locations to crawl; names are fetched from /locations unless given"""
+        if location_names is None:
+            location_names = self.fetch_location_names()
+        queue = WorkQueue(self.queue_path)
+        try:
+            for location_rank, loc_id in enumerate(location_ids):
+                queue.put("location", f"location:{loc_id}", {
+                    "location_id": loc_id,
+                    "location_name": location_names.get(loc_id, f"Location_{loc_id}"),
+                    "clans_per_location": clans_per_location,
+                    "members_per_clan": members_per_clan,
+                    "ranks": [location_rank],
+                })
+        finally:
+            queue.close()
+
+    def run(self) -> pd.DataFrame:
+        """Run one worker per API key until the queue is drained, then return the decks"""
+        workers = []
+        for i, api_key in enumerate(self.api_keys):
+            process = multiprocessing.Process(
+                target=crawl_worker,
+                args=(self.queue_path, api_key, f"worker-{i}-{os.getpid()}",
+                      self.requests_per_second, self.base_url),
+                daemon=True,
+            )
+            process.start()
+            workers.append(process)
+
+        for process in workers:
+            process.join()
+
+        queue = WorkQueue(self.queue_path)
+        try:
+            counts = queue.counts()
+            crashed = [process.exitcode for process in workers if process.exitcode != 0]
+            state = "stopped early" if crashed or queue.has_open_work() else "finished"
+            print(f"Crawl {state}: {counts.get('done', 0)} items done, "
+                  f"{counts.get('failed', 0)} failed, {counts['decks']} decks")
+            if state != "finished":
+                print(f"{len(crashed)} worker(s) exited abnormally and "
+                      f"{counts.get('pending', 0) + counts.get('claimed', 0)} items are still open; "
+                      f"re-run with the same queue to resume")
+            return queue.results()
+        finally:
+            queue.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Crawl clan decks with several API keys in parallel")
+    parser.add_argument("locations", type=int, nargs="+")
+    parser.add_argument("--keys", required=True, help="Comma-separated API keys, one worker each")
+    parser.add_argument("--queue", default="crawl_queue.sqlite")
+    parser.add_argument("--clans", type=int, default=10)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--rps", type=float, default=None, help="Requests per second per key")
+    parser.add_argument("--base-url", default="https://api.clashroyale.com/v1")
+    parser.add_argument("--output", default="clan_based_deckss.csv")
+    parser.add_argument("--mock", action="store_true", help="Crawl a local mock API instead")
+    args = parser.parse_args()
+
+    mock = None
+    if args.mock:
+        from mock_api import MockClashRoyaleAPI, build_world
+
+        mock = MockClashRoyaleAPI(build_world(n_locations=len(args.locations), clans_per_location=args.clans,
+                                              members_per_clan=args.members)).start()
+        args.base_url = mock.base_url
+        args.locations = [loc["id"] for loc in mock.world["locations"]]
+
+    try:
+        crawler = DistributedCrawler(args.queue, args.keys.split(","), args.rps, args.base_url)
+        crawler.seed(args.locations, args.clans, args.members)
+        deck_data = crawler.run()
+        if mock is not None:
+            print(f"Requests per key: {dict(mock.requests_by_key)}")
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    deck_data.to_csv(args.output, index=False)
+    print(f"Saved {len(deck_data)} decks to {args.output}")
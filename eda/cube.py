@@ -0,0 +1,265 @@
+import json
+import os
+from datetime import date
+from typing import List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import polars as pl
+
+from storage import as_polars_decks
+
+
+# Width of a trophy bucket; a deck's bucket is the lower bound of its range
+TROPHY_BUCKET = 500
+
+# The group key; cells add card_id
+KEY_COLUMNS = ["snapshot_date", "location_id", "clan_tag", "trophy_bucket"]
+
+TABLES = ("cells", "totals", "clans", "locations", "cards")
+
+META_FILE = "cube.json"
+
+
+class DeckCube:
+    """
+    Materialized deck counts keyed by (snapshot_date, location_id, clan_tag, trophy_bucket, card_id)
+
+    cells holds how many decks of each key group hold each card and totals
+    how many decks each group has, so any roll-up of usage % is a sum over
+    a few thousand rows instead of a pass over the raw decks. Dimension
+    tables give the clans (name and score per snapshot), locations and card
+    names, so queries can filter and group by them too.
+
+    build() summarizes one crawl's decks, update() folds it into the cube
+    (replacing any snapshot it re-crawls) and save()/load() keep it as one
+    Parquet file per table next to the deck store.
+    """
+
+    def __init__(self, cells: pl.DataFrame, totals: pl.DataFrame, clans: pl.DataFrame,
+                 locations: pl.DataFrame, cards: pl.DataFrame, bucket_width: int = TROPHY_BUCKET):
+        self.cells = cells
+        self.totals = totals
+        self.clans = clans
+        self.locations = locations
+        self.cards = cards
+        self.bucket_width = bucket_width
+
+    @classmethod
+    def empty(cls, bucket_width: int = TROPHY_BUCKET) -> "DeckCube":
+        keys = {"snapshot_date": pl.Utf8, "location_id": pl.Int64, "clan_tag": pl.Utf8, "trophy_bucket": pl.Int64}
+        return cls(
+            pl.DataFrame(schema={**keys, "card_id": pl.Int64, "decks": pl.Int64}),
+            pl.DataFrame(schema={**keys, "decks": pl.Int64}),
+            pl.DataFrame(schema={"snapshot_date": pl.Utf8, "clan_tag": pl.Utf8, "clan_name": pl.Utf8,
+                                 "clan_score": pl.Int64}),
+            pl.DataFrame(schema={"location_id": pl.Int64, "location_name": pl.Utf8}),
+            pl.DataFrame(schema={"card_id": pl.Int64, "card": pl.Utf8}),
+            bucket_width,
+        )
+
+    @classmethod
+    def build(cls, deck_data: Union[pd.DataFrame, pl.DataFrame], snapshot_date: Optional[str] = None,
+              bucket_width: int = TROPHY_BUCKET) -> "DeckCube":
+        """
+        Summarize a deck table (collector layout, with card_ids)
+
+        Decks loaded from the Parquet store keep their own snapshot_date;
+        otherwise they are stamped with snapshot_date (default today).
+        """
+        decks = as_polars_decks(deck_data)
+        if "card_ids" not in decks.columns:
+            raise ValueError("The cube is keyed by card ID; deck_data needs a card_ids column")
+        if "snapshot_date" not in decks.columns:
+            decks = decks.with_columns(pl.lit(snapshot_date or date.today().isoformat()).alias("snapshot_date"))
+        for column in ("clan_score", "trophies"):
+            if column not in decks.columns:
+                decks = decks.with_columns(pl.lit(None, dtype=pl.Int64).alias(column))
+
+        decks = decks.with_columns(
+            pl.col("snapshot_date").cast(pl.Utf8),
+            pl.col("location_id").cast(pl.Int64),
+            pl.col("clan_tag").cast(pl.Utf8),
+            (pl.col("trophies").cast(pl.Int64) // bucket_width * bucket_width).alias("trophy_bucket"),
+        ).with_row_index("deck")
+
+        totals = decks.group_by(KEY_COLUMNS).agg(pl.len().cast(pl.Int64).alias("decks"))
+        cells = (
+            decks.select(KEY_COLUMNS + ["deck", "card_ids"])
+            .explode("card_ids").rename({"card_ids": "card_id"})
+            .drop_nulls("card_id").unique(["deck", "card_id"])
+            .group_by(KEY_COLUMNS + ["card_id"]).agg(pl.len().cast(pl.Int64).alias("decks"))
+            .with_columns(pl.col("card_id").cast(pl.Int64))
+        )
+
+        clans = decks.group_by(["snapshot_date", "clan_tag"]).agg(
+            pl.col("clan_name").cast(pl.Utf8).first(), pl.col("clan_score").cast(pl.Int64).max())
+        locations = decks.select(pl.col("location_id"), pl.col("location_name").cast(pl.Utf8)).unique("location_id")
+        if "cards" in decks.columns:
+            cards = (decks.select(pl.col("card_ids").alias("card_id"), pl.col("cards").alias("card"))
+                     .explode(["card_id", "card"]).drop_nulls("card_id").unique("card_id")
+                     .with_columns(pl.col("card_id").cast(pl.Int64), pl.col("card").cast(pl.Utf8)))
+        else:
+            cards = cells.select("card_id").unique().with_columns(pl.col("card_id").cast(pl.Utf8).alias("card"))
+
+        return cls(cells.sort(KEY_COLUMNS + ["card_id"]), totals.sort(KEY_COLUMNS),
+                   clans.sort(["snapshot_date", "clan_tag"]), locations.sort("location_id"),
+                   cards.sort("card_id"), bucket_width)
+
+    def __len__(self) -> int:
+        """Number of decks summarized"""
+        return int(self.totals["decks"].sum() or 0)
+
+    @property
+    def snapshots(self) -> List[str]:
+        return sorted(self.totals["snapshot_date"].unique().to_list())
+
+    def update(self, other: "DeckCube") -> "DeckCube":
+        """Fold in another cube in place; snapshots it holds replace ours"""
+        if other.bucket_width != self.bucket_width:
+            raise ValueError(f"Trophy buckets differ: {self.bucket_width} vs {other.bucket_width}")
+        replaced = other.snapshots
+        keep = ~pl.col("snapshot_date").is_in(replaced)
+        self.cells = pl.concat([self.cells.filter(keep), other.cells]).sort(KEY_COLUMNS + ["card_id"])
+        self.totals = pl.concat([self.totals.filter(keep), other.totals]).sort(KEY_COLUMNS)
+        self.clans = pl.concat([self.clans.filter(keep), other.clans]).sort(["snapshot_date", "clan_tag"])
+        # Names from the newer cube win
+        self.locations = pl.concat([other.locations, self.locations]).unique("location_id", keep="first").sort(
+            "location_id")
+        self.cards = pl.concat([other.cards, self.cards]).unique("card_id", keep="first").sort("card_id")
+        return self
+
+    def save(self, root: str):
+        os.makedirs(root, exist_ok=True)
+        for name in TABLES:
+            path = os.path.join(root, f"{name}.parquet")
+            getattr(self, name).write_parquet(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        with open(os.path.join(root, META_FILE), "w", encoding="utf-8") as fh:
+            json.dump({"bucket_width": self.bucket_width}, fh)
+
+    @classmethod
+    def load(cls, root: str, snapshot_dates: Optional[Sequence[str]] = None) -> "DeckCube":
+        with open(os.path.join(root, META_FILE), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        tables = {}
+        for name in TABLES:
+            frame = pl.scan_parquet(os.path.join(root, f"{name}.parquet"))
+            if snapshot_dates is not None and name in ("cells", "totals", "clans"):
+                frame = frame.filter(pl.col("snapshot_date").is_in(list(snapshot_dates)))
+            tables[name] = frame.collect()
+        return cls(**tables, bucket_width=meta["bucket_width"])
+
+    @staticmethod
+    def list_snapshots(root: str) -> List[str]:
+        """Snapshot dates held by the cube saved at root, oldest first, without loading it"""
+        dates = pl.scan_parquet(os.path.join(root, "totals.parquet")).select(pl.col("snapshot_date").unique())
+        return sorted(dates.collect()["snapshot_date"].to_list())
+
+    @classmethod
+    def load_or_new(cls, root: str, bucket_width: int = TROPHY_BUCKET) -> "DeckCube":
+        if os.path.exists(os.path.join(root, META_FILE)):
+            return cls.load(root)
+        return cls.empty(bucket_width)
+
+    def filter(self, snapshot_dates: Optional[Sequence[str]] = None,
+               location_ids: Optional[Sequence[int]] = None,
+               location_names: Optional[Sequence[str]] = None,
+               clan_tags: Optional[Sequence[str]] = None,
+               min_clan_score: Optional[int] = None, max_clan_score: Optional[int] = None,
+               min_trophies: Optional[int] = None, max_trophies: Optional[int] = None) -> "DeckCube":
+        """
+        Sub-cube of the matching groups
+
+        Trophy bounds select whole buckets (those overlapping the range);
+        clan score bounds apply to each clan's score in that snapshot.
+        """
+        conditions = []
+        if snapshot_dates is not None:
+            conditions.append(pl.col("snapshot_date").is_in(list(snapshot_dates)))
+        if location_names is not None:
+            ids = self.locations.filter(pl.col("location_name").is_in(list(location_names)))["location_id"]
+            location_ids = list(location_ids or []) + ids.to_list()
+        if location_ids is not None:
+            conditions.append(pl.col("location_id").is_in(list(location_ids)))
+        if clan_tags is not None:
+            conditions.append(pl.col("clan_tag").is_in(list(clan_tags)))
+        if min_trophies is not None:
+            conditions.append(pl.col("trophy_bucket") + self.bucket_width > min_trophies)
+        if max_trophies is not None:
+            conditions.append(pl.col("trophy_bucket") <= max_trophies)
+
+        cells, totals, clans = self.cells, self.totals, self.clans
+        if conditions:
+            predicate = pl.all_horizontal(conditions)
+            cells, totals = cells.filter(predicate), totals.filter(predicate)
+        if min_clan_score is not None or max_clan_score is not None:
+            scored = clans
+            if min_clan_score is not None:
+                scored = scored.filter(pl.col("clan_score") >= min_clan_score)
+            if max_clan_score is not None:
+                scored = scored.filter(pl.col("clan_score") <= max_clan_score)
+            keys = scored.select(["snapshot_date", "clan_tag"])
+            cells = cells.join(keys, on=["snapshot_date", "clan_tag"], how="semi")
+            totals = totals.join(keys, on=["snapshot_date", "clan_tag"], how="semi")
+        clans = clans.join(totals.select(["snapshot_date", "clan_tag"]).unique(), on=["snapshot_date", "clan_tag"],
+                           how="semi")
+        return DeckCube(cells, totals, clans, self.locations, self.cards, self.bucket_width)
+
+    def _with_dimensions(self, frame: pl.DataFrame, by: Sequence[str]) -> pl.DataFrame:
+        """Join in the dimension attributes named in `by`"""
+        if "location_name" in by:
+            frame = frame.join(self.locations, on="location_id", how="left")
+        clan_columns = [column for column in ("clan_name", "clan_score") if column in by]
+        if clan_columns:
+            frame = frame.join(self.clans.select(["snapshot_date", "clan_tag"] + clan_columns),
+                               on=["snapshot_date", "clan_tag"], how="left")
+        return frame
+
+    def group_totals(self, by: Sequence[str] = ()) -> pl.DataFrame:
+        """Decks per group (`by` columns plus total_decks)"""
+        by = list(by)
+        totals = self._with_dimensions(self.totals, by)
+        if not by:
+            return totals.select(pl.col("decks").sum().alias("total_decks"))
+        return totals.group_by(by).agg(pl.col("decks").sum().alias("total_decks")).sort(by)
+
+    def rollup(self, by: Sequence[str] = ()) -> pl.DataFrame:
+        """
+        Card usage per group
+
+        `by` may name key columns (snapshot_date, location_id, clan_tag,
+        trophy_bucket) and dimension attributes (location_name, clan_name,
+        clan_score); an empty `by` rolls up everything. Returns the `by`
+        columns plus card_id, card, decks, total_decks and usage_pct, the
+        most used cards of each group first.
+        """
+        by = list(by)
+        cells = self._with_dimensions(self.cells, by).group_by(by + ["card_id"]).agg(pl.col("decks").sum())
+        totals = self.group_totals(by)
+        usage = cells.join(totals, on=by, how="left") if by else cells.join(totals, how="cross")
+        return (
+            usage.join(self.cards, on="card_id", how="left")
+            .with_columns(pl.col("card").fill_null(pl.col("card_id").cast(pl.Utf8)),
+                          (pl.col("decks") / pl.col("total_decks") * 100).alias("usage_pct"))
+            .select(by + ["card_id", "card", "decks", "total_decks", "usage_pct"])
+            .sort(by + ["decks", "card"], descending=[False] * len(by) + [True, False])
+        )
+
+    def top_cards(self, n: int = 10, by: Sequence[str] = ()) -> pl.DataFrame:
+        """The n most used cards of each group"""
+        usage = self.rollup(by)
+        return usage.group_by(list(by), maintain_order=True).head(n) if by else usage.head(n)
+
+    def query(self, by: Sequence[str] = (), n: Optional[int] = None, **filters) -> pl.DataFrame:
+        """
+        filter(**filters) then rollup(by), keeping the top n cards per group when n is given
+
+            cube.query(["location_name"], n=10, location_names=["Europe"], min_clan_score=50000)
+        """
+        cube = self.filter(**filters) if filters else self
+        return cube.top_cards(n, by) if n is not None else cube.rollup(by)
+
+    def clan_counts(self) -> Tuple[pl.DataFrame, pl.DataFrame]:
+        """The (location, clan, card) counts and (location, clan) deck totals analyze_clan_strategies rolls up"""
+        by = ["location_name", "clan_name"]
+        return self.rollup(by).select(by + ["card", "decks"]), self.group_totals(by)
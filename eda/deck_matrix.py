@@ -0,0 +1,248 @@
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Set bits in every byte value; indexing it with packed rows gives popcounts
+# without unpacking the decks
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Bit j of every byte value, (256, 8); a histogram of byte values times it
+# gives how many of the bytes have each bit set
+BIT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1, bitorder="little").astype(np.int64)
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+# Rows per float32 block in the dense co-occurrence fallback: keeps the cast
+# copy at a few MB and every partial count exact in float32 (< 2 ** 24)
+DENSE_BLOCK_SIZE = 65_536
+
+
+def popcount(bits: np.ndarray) -> np.ndarray:
+    """Number of set bits along the last axis of a packed uint8 array"""
+    return POPCOUNT_TABLE[bits].sum(axis=-1, dtype=np.int64)
+
+
+def jaccard(bits: np.ndarray, other_bits: np.ndarray, max_bytes: int = 64 * 1024 * 1024) -> np.ndarray:
+    """
+    Exact Jaccard similarity of every packed row of `bits` with every row of
+    `other_bits`, as |A & B| / |A | B| from byte popcounts; (n, m) float32
+
+    Rows of `bits` are processed in chunks whose AND intermediate stays under
+    max_bytes.
+    """
+    out = np.empty((len(bits), len(other_bits)), dtype=np.float32)
+    sizes = popcount(other_bits)
+    chunk_size = max(1, max_bytes // max(1, other_bits.shape[0] * other_bits.shape[1]))
+    for start in range(0, len(bits), chunk_size):
+        chunk = bits[start:start + chunk_size]
+        both = popcount(chunk[:, None, :] & other_bits[None, :, :])
+        either = popcount(chunk)[:, None] + sizes[None, :] - both
+        out[start:start + len(chunk)] = np.divide(both, either, out=np.zeros(both.shape), where=either > 0)
+    return out
+
+
+class DeckMatrix:
+    """
+    Decks encoded once as packed bitsets over a fixed card vocabulary
+
+    Row i is deck i and bit j is set when the deck holds vocabulary[j]; with
+    ~120 cards a deck takes 16 bytes (a uint128). The vocabulary is usually
+    the card IDs from fetch_cards, but any hashable card key works (the
+    legacy CSV stores names). Cards missing from the vocabulary are ignored.
+
+    The packed bits take n_decks x ceil(n_cards / 8) bytes. Statistics
+    unpack chunk_size decks at a time as uint8, so their working memory is
+    about chunk_size x n_cards bytes (~120 MB at the default) on top of the
+    bits, however many decks are held.
+    """
+
+    def __init__(self, bits: np.ndarray, vocabulary: Sequence[Hashable],
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.bits = bits
+        self.vocabulary = list(vocabulary)
+        self.index: Dict[Hashable, int] = {card: i for i, card in enumerate(self.vocabulary)}
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_decks(cls, decks: Iterable[Sequence[Hashable]],
+                   vocabulary: Optional[Sequence[Hashable]] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> "DeckMatrix":
+        """Encode an iterable of card lists"""
+        decks = list(decks)
+        if vocabulary is None:
+            vocabulary = sorted({card for deck in decks for card in deck}, key=str)
+        index = {card: i for i, card in enumerate(vocabulary)}
+
+        n_bytes = (len(vocabulary) + 7) // 8
+        bits = np.zeros((len(decks), n_bytes), dtype=np.uint8)
+
+        for start in range(0, len(decks), chunk_size):
+            chunk = decks[start:start + chunk_size]
+            lengths = np.fromiter((len(deck) for deck in chunk), dtype=np.int64, count=len(chunk))
+            cols = np.fromiter((index.get(card, -1) for deck in chunk for card in deck),
+                               dtype=np.int64, count=int(lengths.sum()))
+            rows = np.repeat(np.arange(len(chunk)), lengths)
+            known = cols >= 0
+
+            one_hot = np.zeros((len(chunk), len(vocabulary)), dtype=bool)
+            one_hot[rows[known], cols[known]] = True
+            bits[start:start + len(chunk)] = np.packbits(one_hot, axis=1, bitorder="little")
+
+        return cls(bits, vocabulary, chunk_size)
+
+    @classmethod
+    def from_flat(cls, lengths: np.ndarray, cards: np.ndarray, vocabulary: Sequence[Hashable],
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> "DeckMatrix":
+        """
+        Encode decks given as one flat array of card keys plus each deck's length
+
+        The vectorized counterpart of from_decks for list columns held in
+        polars or Arrow: the keys are looked up in one pass, with no
+        per-deck Python objects.
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        cols = pd.Index(vocabulary).get_indexer(np.asarray(cards))
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+
+        bits = np.zeros((len(lengths), (len(vocabulary) + 7) // 8), dtype=np.uint8)
+        for start in range(0, len(lengths), chunk_size):
+            stop = min(start + chunk_size, len(lengths))
+            low, high = np.searchsorted(rows, [start, stop])
+            chunk_rows, chunk_cols = rows[low:high] - start, cols[low:high]
+            known = chunk_cols >= 0
+
+            one_hot = np.zeros((stop - start, len(vocabulary)), dtype=bool)
+            one_hot[chunk_rows[known], chunk_cols[known]] = True
+            bits[start:stop] = np.packbits(one_hot, axis=1, bitorder="little")
+
+        return cls(bits, vocabulary, chunk_size)
+
+    @classmethod
+    def from_frame(cls, deck_data: pd.DataFrame, column: str = "cards",
+                   vocabulary: Optional[Sequence[Hashable]] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> "DeckMatrix":
+        """Encode the card-list column of a deck DataFrame"""
+        return cls.from_decks(deck_data[column], vocabulary, chunk_size)
+
+    def __len__(self) -> int:
+        return self.bits.shape[0]
+
+    @property
+    def n_cards(self) -> int:
+        return len(self.vocabulary)
+
+    def _unpack(self, bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits, axis=1, count=self.n_cards, bitorder="little")
+
+    def dense(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Unpacked 0/1 uint8 rows [start, stop)"""
+        return self._unpack(self.bits[start:stop])
+
+    def iter_chunks(self) -> Iterator[np.ndarray]:
+        """Unpacked 0/1 uint8 rows, chunk_size decks at a time"""
+        for start in range(0, len(self), self.chunk_size):
+            yield self.dense(start, start + self.chunk_size)
+
+    def subset(self, rows) -> "DeckMatrix":
+        """Decks selected by a boolean mask or index array"""
+        return DeckMatrix(self.bits[rows], self.vocabulary, self.chunk_size)
+
+    def decode(self, row: int) -> List[Hashable]:
+        """Card keys of one deck"""
+        return [self.vocabulary[j] for j in np.flatnonzero(self.dense(row, row + 1)[0])]
+
+    def card_counts(self) -> np.ndarray:
+        """Number of decks holding each card"""
+        counts = np.zeros(self.n_cards, dtype=np.int64)
+        for chunk in self.iter_chunks():
+            counts += chunk.sum(axis=0, dtype=np.int64)
+        return counts
+
+    def cooccurrence(self) -> np.ndarray:
+        """
+        Card x card matrix of how many decks hold both cards (diagonal = card counts)
+
+        One X^T X product per chunk: sparse when scipy is installed (decks hold
+        8 of ~120 cards), otherwise dense float32 matmuls over DENSE_BLOCK_SIZE
+        rows of the chunk at a time.
+        """
+        try:
+            from scipy import sparse
+        except ImportError:
+            sparse = None
+
+        total = np.zeros((self.n_cards, self.n_cards), dtype=np.int64)
+        for chunk in self.iter_chunks():
+            if sparse is not None:
+                x = sparse.csr_matrix(chunk, dtype=np.int32)
+                total += (x.T @ x).toarray()
+            else:
+                for start in range(0, len(chunk), DENSE_BLOCK_SIZE):
+                    x = chunk[start:start + DENSE_BLOCK_SIZE].astype(np.float32)
+                    total += np.rint(x.T @ x).astype(np.int64)
+        return total
+
+    def group_counts(self, labels: Sequence[Hashable]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Per-group card counts
+
+        Returns (groups, counts, deck_totals) where groups are the distinct
+        labels in first-appearance order, counts[g, j] is the number of decks
+        in group g holding card j and deck_totals[g] the group's deck count.
+        """
+        codes, groups = pd.factorize(np.asarray(labels))
+        deck_totals = np.bincount(codes, minlength=len(groups))
+        return np.asarray(groups), self.code_counts(codes, len(groups)), deck_totals
+
+    def code_counts(self, codes: np.ndarray, n_codes: int) -> np.ndarray:
+        """
+        (n_codes, n_cards) number of decks with each integer code holding each card
+
+        Decks with a negative code are skipped. Works on the packed bytes: one
+        bincount of (code, byte position, byte value) keys, then BIT_TABLE
+        turns each byte-value histogram into per-card counts. Nothing is
+        unpacked or sorted, and the cost does not grow with the number of
+        codes.
+        """
+        codes = np.asarray(codes)
+        n_bytes = self.bits.shape[1]
+        positions = np.arange(n_bytes, dtype=np.int64) * 256
+        histogram = np.zeros(n_codes * n_bytes * 256, dtype=np.int64)
+        for start in range(0, len(self), self.chunk_size):
+            chunk_codes = codes[start:start + self.chunk_size]
+            valid = chunk_codes >= 0
+            keys = (chunk_codes[valid, None].astype(np.int64) * (n_bytes * 256) + positions
+                    + self.bits[start:start + self.chunk_size][valid])
+            histogram += np.bincount(keys.ravel(), minlength=len(histogram))
+
+        counts = histogram.reshape(n_codes * n_bytes, 256) @ BIT_TABLE
+        return counts.reshape(n_codes, n_bytes * 8)[:, :self.n_cards]
+
+    def deck_keys(self) -> np.ndarray:
+        """One hashable fixed-width key per deck (its packed bytes), equal for equal card sets"""
+        bits = np.ascontiguousarray(self.bits)
+        return bits.view(np.dtype((np.void, bits.shape[1]))).ravel()
+
+    def unique_deck_counts(self, labels: Optional[Sequence[Hashable]] = None):
+        """Distinct card sets overall, or (groups, distinct counts) per label"""
+        distinct, deck_codes = np.unique(self.deck_keys(), return_inverse=True)
+        deck_codes = deck_codes.ravel().astype(np.int64)
+        if labels is None:
+            return len(distinct)
+
+        # Pair each deck with its group in one integer and count distinct pairs per group
+        group_codes, groups = pd.factorize(np.asarray(labels))
+        pairs = np.unique(group_codes.astype(np.int64) * max(len(distinct), 1) + deck_codes)
+        per_group = np.bincount(pairs // max(len(distinct), 1), minlength=len(groups))
+        return np.asarray(groups), per_group
+
+    def to_csr(self):
+        """Same decks as a scipy.sparse CSR matrix (requires scipy)"""
+        from scipy import sparse
+
+        blocks = [sparse.csr_matrix(chunk) for chunk in self.iter_chunks()]
+        if not blocks:
+            return sparse.csr_matrix((0, self.n_cards), dtype=np.uint8)
+        return sparse.vstack(blocks, format="csr")
@@ -1,71 +1,201 @@
 import polars as pl
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional, Iterator, AsyncIterator
 import time
-import numpy as np
-from collections import Counter
-from dotenv import load_dotenv
+import asyncio
+import threading
+import random
+from email.utils import parsedate_to_datetime
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 import os
 
+from rate_limit import TokenBucket
+from response_cache import ResponseCache
+from checkpoint import CollectionCheckpoint
+from storage import write_deck_snapshot
+from cooccurrence import regional_synergy_tables
+from catalog import CardCatalog
+from deck_matrix import DeckMatrix
+from archetypes import ArchetypeModel, archetype_shares
+from metrics import Metrics, timed_stage
+from mmap_store import DeckStore, group_card_counts
+from cube import DeckCube
+from timeseries import MetaHistory
 
 
-load_dotenv()
-API_KEY = os.getenv("API_TOKEN")
+def load_api_key(env_var: str = "API_TOKEN") -> Optional[str]:
+    """Read the API key from the environment, loading .env first (dotenv is imported only here)"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return os.getenv(env_var)
+
+
+# Responses worth retrying: rate limiting plus transient server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
 
 class ClanBasedStrategyClassifier:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, requests_per_second: Optional[float] = None,
+                 burst: Optional[float] = None, pool_size: int = 10,
+                 max_retries: int = 5, backoff_base: float = 0.5,
+                 backoff_max: float = 60.0, requeue_rounds: int = 3,
+                 cache: Optional[ResponseCache] = None,
+                 checkpoint: Optional[CollectionCheckpoint] = None,
+                 base_url: str = "https://api.clashroyale.com/v1",
+                 metrics: Optional[Metrics] = None, quiet: bool = False):
         self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Accept": "application/json"
         }
-        self.base_url = "https://api.clashroyale.com/v1"
+        self.base_url = base_url.rstrip("/")
         self.cards_df = None
         self.locations_df = None
 
+        # ID/name/index lookups shared by the collector, the analysis and visual.py
+        self.catalog = CardCatalog()
+        self.archetype_model: Optional[ArchetypeModel] = None
+
+        # Shared across every fetch_* call (and every worker thread) so the
+        # key's quota is respected no matter how the requests are scheduled
+        self.rate_limiter = TokenBucket(requests_per_second, burst) if requests_per_second else None
+
+        # One keep-alive session for every call; size the pool to at least the
+        # number of worker threads so concurrent fetches don't open new sockets
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requeue_rounds = requeue_rounds
+
+        # Optional on-disk response cache sitting underneath every fetch_* call
+        self.cache = cache
+
+        # Optional crawl journal used to resume interrupted or refresh stale collections
+        self.checkpoint = checkpoint
+
+        # Request, cache, throughput and stage numbers; quiet drops the per-clan/per-player lines
+        self.metrics = metrics or Metrics()
+        self.quiet = quiet
+
+    def close(self):
+        """Close the pooled HTTP connections"""
+        self.session.close()
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Exponential backoff with jitter, never shorter than the server's Retry-After"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                try:
+                    wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    wait = 0.0
+            delay = max(delay, min(wait, self.backoff_max))
+
+        return delay
+
+    def _get(self, url: str, endpoint: str, params: Optional[Dict] = None) -> Dict:
+        """
+        GET an API endpoint and return its JSON payload
+
+        Fresh cache entries are returned without touching the network; stale
+        ones are revalidated with If-None-Match when the API supplied an ETag.
+        """
+        if self.cache is None:
+            return self._request(url, params, endpoint=endpoint).json()
+
+        key = self.cache.key(url, params)
+        cached = self.cache.get(key, endpoint)
+        if cached is not None and cached.fresh:
+            self.metrics.record_cache(endpoint, "hit")
+            return cached.payload
+
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+
+        resp = self._request(url, params, headers, endpoint)
+        if resp.status_code == 304 and cached is not None:
+            self.cache.touch(key)
+            self.metrics.record_cache(endpoint, "revalidated")
+            return cached.payload
+
+        self.metrics.record_cache(endpoint, "miss")
+        payload = resp.json()
+        self.cache.put(key, endpoint, payload, resp.headers.get("ETag"))
+        return payload
+
+    def _request(self, url: str, params: Optional[Dict] = None,
+                 headers: Optional[Dict] = None, endpoint: str = "other") -> requests.Response:
+        """GET through the pooled session, retrying transient failures"""
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            start = time.perf_counter()
+            try:
+                resp = self.session.get(url, params=params, headers=headers, timeout=10)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.metrics.record_request(endpoint, "error", time.perf_counter() - start)
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                continue
+            self.metrics.record_request(endpoint, resp.status_code, time.perf_counter() - start)
+
+            if resp.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                time.sleep(self._backoff_delay(attempt, resp.headers.get("Retry-After")))
+                continue
+
+            resp.raise_for_status()
+            return resp
+
     def fetch_cards(self):
         """Fetch all cards data"""
         url = f"{self.base_url}/cards"
-        resp = requests.get(url, headers=self.headers, timeout=10)
-        resp.raise_for_status()
-        cards = resp.json().get("items", [])
+        cards = self._get(url, "cards").get("items", [])
         self.cards_df = pl.DataFrame(cards)
+        self.catalog.set_cards(cards)
         print(f"Fetched {len(cards)} cards")
         return self.cards_df
 
     def fetch_locations(self):
         """Fetch all locations/regions"""
         url = f"{self.base_url}/locations"
-        resp = requests.get(url, headers=self.headers, timeout=10)
-        resp.raise_for_status()
-        locations = resp.json().get("items", [])
+        locations = self._get(url, "locations").get("items", [])
         self.locations_df = pl.DataFrame(locations)
+        self.catalog.set_locations(locations)
         print(f"Fetched {len(locations)} locations")
         return self.locations_df
 
     def get_location_name(self, location_id: int) -> str:
         """Get location name from ID"""
-        if self.locations_df is not None:
-            match = self.locations_df.filter(pl.col("id") == location_id)
-            if len(match) > 0:
-                return match.select("name").item()
-        return f"Location_{location_id}"
+        return self.catalog.location_name(location_id)
 
     def fetch_top_clans_by_location(self, location_id: int, limit: int = 20) -> List[Dict]:
         """Fetch top clans from a specific location"""
         url = f"{self.base_url}/locations/{location_id}/rankings/clans"
         params = {"limit": limit}
 
-        print(f"  Fetching top {limit} clans from location {location_id}...")
-        resp = requests.get(url, params=params, headers=self.headers, timeout=10)
-        resp.raise_for_status()
-
-        clans = resp.json().get("items", [])
-        print(f" Found {len(clans)} clans")
+        self._progress(f"  Fetching top {limit} clans from location {location_id}...")
+        clans = self._get(url, "rankings", params=params).get("items", [])
+        self._progress(f" Found {len(clans)} clans")
         return clans
 
     def fetch_clan_members(self, clan_tag: str) -> List[Dict]:
@@ -73,10 +203,7 @@ class ClanBasedStrategyClassifier:
         clan_tag_clean = clan_tag.replace("#", "")
         url = f"{self.base_url}/clans/%23{clan_tag_clean}/members"
 
-        resp = requests.get(url, headers=self.headers, timeout=10)
-        resp.raise_for_status()
-
-        members = resp.json().get("items", [])
+        members = self._get(url, "members").get("items", [])
         return members
 
     def fetch_player_details(self, player_tag: str) -> Dict:
@@ -84,15 +211,223 @@ class ClanBasedStrategyClassifier:
         player_tag_clean = player_tag.replace("#", "")
         url = f"{self.base_url}/players/%23{player_tag_clean}"
 
-        resp = requests.get(url, headers=self.headers, timeout=10)
-        resp.raise_for_status()
+        return self._get(url, "players")
+
+    def fetch_player_battlelog(self, player_tag: str) -> List[Dict]:
+        """Fetch a player's recent battles (the API keeps the last 25 or so), newest first"""
+        player_tag_clean = player_tag.replace("#", "")
+        url = f"{self.base_url}/players/%23{player_tag_clean}/battlelog"
+
+        return self._get(url, "battlelog")
+
+    def _deck_record(self, member: Dict, clan: Dict, location_id: int, location_name: str,
+                     player_details: Dict) -> Optional[Dict]:
+        """Build one deck row from a player profile, or None if they have no deck"""
+        current_deck = player_details.get("currentDeck", [])
+        if not current_deck:
+            return None
+
+        card_ids = [card.get("id") for card in current_deck]
+        card_names = [card.get("name") or self.catalog.card_name(card.get("id")) for card in current_deck]
+
+        return {
+            "player_tag": member.get("tag", "").replace("#", ""),
+            "player_name": member.get("name", "Unknown"),
+            "clan_tag": clan.get("tag", "").replace("#", ""),
+            "clan_name": clan.get("name", "Unknown"),
+            "location_id": location_id,
+            "location_name": location_name,
+            "cards": card_names,
+            "card_ids": card_ids,
+            "trophies": player_details.get("trophies", 0),
+            "clan_score": clan.get("clanScore", 0)
+        }
+
+    def _progress(self, *args, **kwargs):
+        """Console progress for the crawl loops; silenced in quiet mode"""
+        if not self.quiet:
+            print(*args, **kwargs)
+
+    def _fetch_member_deck(self, member: Dict, clan: Dict, location_id: int,
+                           location_name: str) -> Tuple[Optional[Dict], str, bool, bool]:
+        """Fetch one clan member's deck, returning (record, status message, rate limited, from checkpoint)"""
+        player_tag = member.get("tag", "")
+
+        if self.checkpoint is not None:
+            found, record = self.checkpoint.lookup_player(player_tag)
+            if found:
+                if record is None:
+                    return None, " No deck (checkpoint)", False, True
+                # The snapshot is reused, but the clan context is today's
+                record = dict(record,
+                              player_name=member.get("name", "Unknown"),
+                              clan_tag=clan.get("tag", "").replace("#", ""),
+                              clan_name=clan.get("name", "Unknown"),
+                              location_id=location_id,
+                              location_name=location_name,
+                              clan_score=clan.get("clanScore", 0))
+                return record, f" {len(record['cards'])} cards (checkpoint)", False, True
+
+        try:
+            player_details = self.fetch_player_details(player_tag)
+            record = self._deck_record(member, clan, location_id, location_name, player_details)
+
+            if self.checkpoint is not None:
+                self.checkpoint.record_player(player_tag, record)
+
+            if record is None:
+                return None, " No deck", False, False
+            return record, f" {len(record['cards'])} cards", False, False
+
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 404:
+                if self.checkpoint is not None:
+                    self.checkpoint.record_player(player_tag, None)
+                return None, " Not found", False, False
+            elif e.response.status_code == 429:
+                return None, " Rate limited, re-queued", True, False
+            else:
+                return None, f" HTTP {e.response.status_code}", False, False
+        except Exception as e:
+            return None, " Error", False, False
+
+    def _clan_roster(self, location_id: int, clan: Dict) -> Tuple[List[Dict], bool]:
+        """Members of a clan, or its sampled roster if the checkpoint already finished it"""
+        if self.checkpoint is not None:
+            members = self.checkpoint.clan_members(location_id, clan.get("tag", ""))
+            if members is not None:
+                return members, True
+        return self.fetch_clan_members(clan.get("tag", "")), False
+
+    def _mark_clans_done(self, clans: List[Tuple[int, Dict, List[Dict]]], leftover: List[Tuple]):
+        """Checkpoint every (location id, clan, sampled members) whose players all came through"""
+        if self.checkpoint is None:
+            return
+
+        unfinished = {(job[3], job[2].get("tag", "")) for job in leftover}
+        for loc_id, clan, sampled_members in clans:
+            if (loc_id, clan.get("tag", "")) not in unfinished:
+                self.checkpoint.mark_clan_done(loc_id, clan.get("tag", ""), sampled_members)
+
+    def _drain_requeued(self, requeued: List[Tuple], pool: Optional[ThreadPoolExecutor] = None):
+        """
+        Retry players that were still rate limited after backoff
+
+        Each job is (slot index, member, clan, location id, location name).
+        Yields (slot, record) for each retry that came through; the slot lets
+        callers put the row back where it would have been had the first
+        request succeeded. Returns the jobs given up on.
+        """
+        for round_idx in range(1, self.requeue_rounds + 1):
+            if not requeued:
+                return requeued
+
+            self._progress(f"\n  Re-queue round {round_idx}: {len(requeued)} rate-limited players")
+            if pool is not None:
+                results = pool.map(lambda job: self._fetch_member_deck(*job[1:]), requeued)
+            else:
+                results = (self._fetch_member_deck(*job[1:]) for job in requeued)
+
+            still_limited = []
+            for job, (record, _, rate_limited, _) in zip(requeued, results):
+                if rate_limited:
+                    still_limited.append(job)
+                elif record is not None:
+                    yield job[0], record
+            requeued = still_limited
+
+        if requeued:
+            self._progress(f"  Gave up on {len(requeued)} players after {self.requeue_rounds} re-queue rounds")
+        return requeued
+
+    def _iter_slotted_decks(self, location_ids: List[int], clans_per_location: int,
+                            members_per_clan: int, delay_between_requests: float,
+                            max_workers: int) -> Iterator[Tuple[int, Dict]]:
+        previous_limiter = self.rate_limiter
+        if max_workers > 1:
+            # A bucket derived from the delay paces this crawl only
+            if self.rate_limiter is None and delay_between_requests > 0:
+                self.rate_limiter = TokenBucket(1.0 / delay_between_requests)
+            slotted = self._iter_concurrently(location_ids, clans_per_location, members_per_clan, max_workers)
+        else:
+            slotted = self._iter_serially(location_ids, clans_per_location, members_per_clan,
+                                          delay_between_requests)
+        try:
+            for item in slotted:
+                self.metrics.record_records()
+                yield item
+        finally:
+            self.rate_limiter = previous_limiter
+
+    def iter_clan_decks(self, location_ids: List[int],
+                        clans_per_location: int = 10,
+                        members_per_clan: int = 10,
+                        delay_between_requests: float = 0.2,
+                        max_workers: int = 1) -> Iterator[Dict]:
+        """
+        Yield deck records as they arrive
+
+        Same crawl (and arguments) as collect_clan_deck_data, but nothing is
+        held back: downstream sinks can write while the network
+        I/O is still going, and memory stays flat. Players recovered from the
+        re-queue are yielded at the end, after the main walk.
+        """
+        for _, record in self._iter_slotted_decks(location_ids, clans_per_location, members_per_clan,
+                                                  delay_between_requests, max_workers):
+            yield record
 
-        return resp.json()
+    async def aiter_clan_decks(self, location_ids: List[int],
+                               clans_per_location: int = 10,
+                               members_per_clan: int = 10,
+                               delay_between_requests: float = 0.2,
+                               max_workers: int = 1,
+                               buffer_size: int = 1000) -> AsyncIterator[Dict]:
+        """
+        Async variant of iter_clan_decks
+
+        The crawl runs on a background thread and hands records over through
+        a bounded asyncio.Queue, so a slow consumer applies backpressure.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=buffer_size)
+        stop = threading.Event()
+        finished = object()
 
+        def produce():
+            try:
+                for record in self.iter_clan_decks(location_ids, clans_per_location, members_per_clan,
+                                                   delay_between_requests, max_workers):
+                    if stop.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(queue.put((record, None)), loop).result()
+            except Exception as e:
+                asyncio.run_coroutine_threadsafe(queue.put((finished, e)), loop).result()
+            else:
+                asyncio.run_coroutine_threadsafe(queue.put((finished, None)), loop).result()
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                record, error = await queue.get()
+                if error is not None:
+                    raise error
+                if record is finished:
+                    break
+                yield record
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop.set()
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0.05)
+
+    @timed_stage("collect_clan_deck_data")
     def collect_clan_deck_data(self, location_ids: List[int],
                                clans_per_location: int = 10,
                                members_per_clan: int = 10,
-                               delay_between_requests: float = 0.2) -> pd.DataFrame:
+                               delay_between_requests: float = 0.2,
+                               max_workers: int = 1) -> pd.DataFrame:
         """
         Collect deck data from clan members across regions
 
@@ -102,14 +437,46 @@ class ClanBasedStrategyClassifier:
         3. Get deck data from each member
 
         This gives us regional strategy patterns through clan composition
+
+        With max_workers > 1 the clan rosters and player profiles are fetched
+        concurrently on a thread pool. Pacing then comes from the shared token
+        bucket instead of fixed sleeps; if the classifier was built without
+        requests_per_second, one is derived from delay_between_requests. The
+        returned DataFrame has the same rows in the same order either way.
+
+        Players still rate limited after _get's backoff are re-queued and
+        retried after the main walk rather than dropped.
+
+        When the classifier has a checkpoint, each player is journaled as it
+        arrives and each clan once it is complete; a re-run resumes from there
+        and only fetches players missing from (or stale in) the journal.
+
+        See iter_clan_decks for a streaming version.
         """
-        deck_data = []
+        slotted = sorted(self._iter_slotted_decks(location_ids, clans_per_location, members_per_clan,
+                                                  delay_between_requests, max_workers),
+                         key=lambda item: item[0])
+        deck_data = [record for _, record in slotted]
+
+        print(f"\n{'=' * 60}")
+        print(f"TOTAL DECKS COLLECTED: {len(deck_data)}")
+        print(f"{'=' * 60}")
+
+        return pd.DataFrame(deck_data)
+
+    def _iter_serially(self, location_ids: List[int], clans_per_location: int,
+                       members_per_clan: int, delay_between_requests: float) -> Iterator[Tuple[int, Dict]]:
+        # One slot per sampled member keeps re-queued players in their original position
+        slot = 0
+        requeued = []
+        waiting_clans = []
 
         for loc_id in location_ids:
             location_name = self.get_location_name(loc_id)
-            print(f"\n{'=' * 60}")
-            print(f"Region: {location_name} (ID: {loc_id})")
-            print(f"{'=' * 60}")
+            decks_from_location = 0
+            self._progress(f"\n{'=' * 60}")
+            self._progress(f"Region: {location_name} (ID: {loc_id})")
+            self._progress(f"{'=' * 60}")
 
             try:
                 # Get top clans from this region
@@ -120,168 +487,283 @@ class ClanBasedStrategyClassifier:
                     clan_name = clan.get("name", "Unknown")
                     clan_score = clan.get("clanScore", 0)
 
-                    print(f"\n  [{clan_idx}/{len(top_clans)}] Clan: {clan_name} ({clan_tag}) - Score: {clan_score}")
+                    self._progress(f"\n  [{clan_idx}/{len(top_clans)}] Clan: {clan_name} ({clan_tag}) - Score: {clan_score}")
 
                     try:
                         # Get clan members
-                        members = self.fetch_clan_members(clan_tag)
-                        print(f"    Found {len(members)} members")
+                        members, resumed = self._clan_roster(loc_id, clan)
+                        if resumed:
+                            self._progress(f"    Resuming {len(members)} members from checkpoint")
+                        else:
+                            self._progress(f"    Found {len(members)} members")
 
                         # Sample members (don't fetch all 50 to save API calls)
                         sampled_members = members[:members_per_clan]
+                        requeued_before = len(requeued)
 
                         for member_idx, member in enumerate(sampled_members, 1):
-                            player_tag = member.get("tag", "")
                             player_name = member.get("name", "Unknown")
 
-                            print(f"      [{member_idx}/{len(sampled_members)}] {player_name}...", end=" ")
-
-                            try:
-                                player_details = self.fetch_player_details(player_tag)
-                                current_deck = player_details.get("currentDeck", [])
-
-                                if current_deck:
-                                    card_ids = [card.get("id") or card.get("name") for card in current_deck]
-
-                                    deck_data.append({
-                                        "player_tag": player_tag.replace("#", ""),
-                                        "player_name": player_name,
-                                        "clan_tag": clan_tag.replace("#", ""),
-                                        "clan_name": clan_name,
-                                        "location_id": loc_id,
-                                        "location_name": location_name,
-                                        "cards": card_ids,
-                                        "trophies": player_details.get("trophies", 0),
-                                        "clan_score": clan_score
-                                    })
-                                    print(f" {len(card_ids)} cards")
-                                else:
-                                    print(" No deck")
-
+                            record, status, rate_limited, from_checkpoint = self._fetch_member_deck(
+                                member, clan, loc_id, location_name)
+                            self._progress(f"      [{member_idx}/{len(sampled_members)}] {player_name}... {status}")
+                            if rate_limited:
+                                requeued.append((slot, member, clan, loc_id, location_name))
+                            elif record is not None:
+                                decks_from_location += 1
+                                yield slot, record
+                            slot += 1
+
+                            if not from_checkpoint:
                                 time.sleep(delay_between_requests)
 
-                            except requests.exceptions.HTTPError as e:
-                                if e.response.status_code == 404:
-                                    print(" Not found")
-                                elif e.response.status_code == 429:
-                                    print(" Rate limited! Waiting...")
-                                    time.sleep(5)
-                                else:
-                                    print(f" HTTP {e.response.status_code}")
-                            except Exception as e:
-                                print(f" Error")
-                                continue
+                        if len(requeued) == requeued_before:
+                            self._mark_clans_done([(loc_id, clan, sampled_members)], [])
+                        else:
+                            waiting_clans.append((loc_id, clan, sampled_members))
 
-                        time.sleep(delay_between_requests)
+                        if not resumed:
+                            time.sleep(delay_between_requests)
 
                     except Exception as e:
                         print(f"     Error getting clan members: {str(e)[:50]}")
                         continue
 
-                decks_from_location = len([d for d in deck_data if d['location_id'] == loc_id])
-                print(f"\n   Total decks from {location_name}: {decks_from_location}")
+                self._progress(f"\n   Total decks from {location_name}: {decks_from_location}")
 
             except Exception as e:
                 print(f"   Error: {e}")
                 continue
 
-        print(f"\n{'=' * 60}")
-        print(f"TOTAL DECKS COLLECTED: {len(deck_data)}")
-        print(f"{'=' * 60}")
+        leftover = yield from self._drain_requeued(requeued)
+        self._mark_clans_done(waiting_clans, leftover)
+
+    def _iter_concurrently(self, location_ids: List[int], clans_per_location: int,
+                           members_per_clan: int, max_workers: int) -> Iterator[Tuple[int, Dict]]:
+        # Futures are resolved in submission order, so rows come out in the order
+        # the serial walk would produce them. At most `window` player fetches are
+        # in flight ahead of the consumer, which keeps memory flat.
+        window = max_workers * 4
+        decks_per_location = Counter()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            ranking_jobs = [
+                (loc_id, pool.submit(self.fetch_top_clans_by_location, loc_id, clans_per_location))
+                for loc_id in location_ids
+            ]
+
+            roster_jobs = []
+            for loc_id, future in ranking_jobs:
+                location_name = self.get_location_name(loc_id)
+                try:
+                    top_clans = future.result()
+                except Exception as e:
+                    print(f"   Error in {location_name}: {e}")
+                    continue
+
+                for clan in top_clans:
+                    roster_jobs.append((loc_id, location_name, clan,
+                                        pool.submit(self._clan_roster, loc_id, clan)))
+
+            in_flight = deque()
+            requeued = []
+            sampled_clans = []
+            slot = 0
+
+            def resolve(job, future):
+                record, _, rate_limited, _ = future.result()
+                if rate_limited:
+                    requeued.append(job)
+                elif record is not None:
+                    decks_per_location[job[3]] += 1
+                    yield job[0], record
+
+            for loc_id, location_name, clan, future in roster_jobs:
+                try:
+                    members, _ = future.result()
+                except Exception as e:
+                    print(f"     Error getting members of {clan.get('name', 'Unknown')}: {str(e)[:50]}")
+                    continue
+
+                sampled_clans.append((loc_id, clan, members[:members_per_clan]))
+                for member in members[:members_per_clan]:
+                    job = (slot, member, clan, loc_id, location_name)
+                    slot += 1
+                    in_flight.append((job, pool.submit(self._fetch_member_deck, *job[1:])))
+                    while len(in_flight) > window:
+                        yield from resolve(*in_flight.popleft())
+
+            while in_flight:
+                yield from resolve(*in_flight.popleft())
+
+            leftover = yield from self._drain_requeued(requeued, pool)
+            self._mark_clans_done(sampled_clans, leftover)
 
-        return pd.DataFrame(deck_data)
+        for loc_id in location_ids:
+            self._progress(f"   Total decks from {self.get_location_name(loc_id)}: {decks_per_location[loc_id]}")
 
-    def analyze_clan_strategies(self, deck_data: pd.DataFrame):
-        """Analyze strategy differences between clans and regions"""
+    @timed_stage("classify_decks")
+    def classify_decks(self, deck_data: pd.DataFrame, model_path: Optional[str] = None,
+                       refit: bool = False, **fit_options) -> pd.Series:
+        """
+        Label every deck with its archetype
+
+        The archetype model is loaded from model_path when it exists (so new
+        crawls are labelled without re-clustering), otherwise fitted on these
+        decks and saved there. A new model is keyed by card ID on the
+        catalog's columns when both are available, else by card name; decks
+        are then labelled from whichever column the model is keyed on.
+        """
+        if model_path is not None and os.path.exists(model_path) and not refit:
+            self.archetype_model = ArchetypeModel.load(model_path)
+        else:
+            by_id = self.catalog.n_cards > 0 and 'card_ids' in deck_data.columns
+            matrix = (self.catalog.deck_matrix(deck_data['card_ids']) if by_id
+                      else DeckMatrix.from_frame(deck_data, 'cards'))
+            card_label = self.catalog.card_name if by_id else str
+            self.archetype_model = ArchetypeModel.fit(matrix, card_label=card_label, **fit_options)
+            if model_path is not None:
+                self.archetype_model.save(model_path)
+
+        column = self.archetype_model.deck_column
+        if column not in deck_data.columns:
+            raise ValueError(f"The archetype model is keyed by {column!r}, which the decks lack")
+        labels = self.archetype_model.predict_many(deck_data[column])
+        return pd.Series(labels, index=deck_data.index, name='archetype')
+
+    @timed_stage("analyze_clan_strategies")
+    def analyze_clan_strategies(self, deck_data: pd.DataFrame, top_cards_per_region: int = 10,
+                                sample_clans: int = 5, top_cards_per_clan: int = 5,
+                                top_variance_cards: int = 10,
+                                workers: Optional[int] = None) -> Optional[Dict[str, pl.DataFrame]]:
+        """
+        Analyze strategy differences between clans and regions
+
+        Every statistic comes from one explode + group-by pass over a long
+        (deck, card, location, clan) table; the rest are roll-ups of that
+        small count table. deck_data may also be a memory-mapped DeckStore,
+        in which case the counts are map-reduced over `workers` processes
+        (one task per group of locations), or a DeckCube, whose counts are
+        already materialized. Returns polars DataFrames:
+
+            region_top_cards   top cards per region with usage %
+            clan_top_cards     top cards of the largest clans
+            regional_usage     usage % of every card in every region (0 when absent)
+            regional_variance  cross-region variance of usage % per card
+        """
         print("\n" + "=" * 60)
         print("CLAN STRATEGY ANALYSIS")
         print("=" * 60)
 
-        if deck_data.empty:
+        if len(deck_data) == 0:
             print("No data to analyze!")
-            return
+            return None
+
+        if isinstance(deck_data, DeckStore):
+            counts, group_totals = (pl.from_pandas(frame) for frame in group_card_counts(
+                deck_data, ["location_name", "clan_name"], workers=workers))
+        elif isinstance(deck_data, DeckCube):
+            counts, group_totals = deck_data.clan_counts()
+        else:
+            decks = deck_data if isinstance(deck_data, pl.DataFrame) else pl.from_pandas(
+                deck_data[["location_name", "clan_name", "cards"]])
+            decks = decks.select(["location_name", "clan_name", "cards"]).with_row_index("deck")
+
+            # The single pass: one row per (deck, card), counted per (location, clan, card)
+            long = decks.explode("cards").rename({"cards": "card"}).unique(["deck", "card"])
+            counts = long.group_by(["location_name", "clan_name", "card"]).agg(pl.len().alias("decks"))
+            group_totals = decks.group_by(["location_name", "clan_name"], maintain_order=True).agg(
+                pl.len().alias("total_decks"))
+
+        # Roll-ups of the count table
+        region_totals = group_totals.group_by("location_name", maintain_order=True).agg(
+            pl.col("total_decks").sum())
+        region_counts = (
+            counts.group_by(["location_name", "card"]).agg(pl.col("decks").sum())
+            .join(region_totals, on="location_name")
+            .with_columns((pl.col("decks") / pl.col("total_decks") * 100).alias("usage_pct"))
+        )
+        region_top = (
+            region_counts.sort(["decks", "card"], descending=[True, False])
+            .group_by("location_name", maintain_order=True).head(top_cards_per_region)
+        )
+
+        clan_totals = (
+            group_totals.group_by("clan_name", maintain_order=True)
+            .agg(pl.col("total_decks").sum(), pl.col("location_name").first())
+            .sort("total_decks", descending=True, maintain_order=True)
+            .head(sample_clans)
+        )
+        clan_top = (
+            counts.join(clan_totals.select("clan_name"), on="clan_name")
+            .group_by(["clan_name", "card"]).agg(pl.col("decks").sum())
+            .join(clan_totals, on="clan_name")
+            .with_columns((pl.col("decks") / pl.col("total_decks") * 100).alias("usage_pct"))
+            .sort(["decks", "card"], descending=[True, False])
+            .group_by("clan_name", maintain_order=True).head(top_cards_per_clan)
+        )
+
+        # Variance over the regions where each card appears, as before
+        regional_variance = (
+            region_counts.group_by("card")
+            .agg(pl.col("usage_pct").var(ddof=0).alias("variance"), pl.len().alias("n_regions"))
+            .filter(pl.col("n_regions") > 1)
+            .sort(["variance", "card"], descending=[True, False])
+        )
+        regional_usage = (
+            region_totals.select("location_name")
+            .join(region_counts.select("card").unique(), how="cross")
+            .join(region_counts.select(["location_name", "card", "usage_pct"]),
+                  on=["location_name", "card"], how="left")
+            .with_columns(pl.col("usage_pct").fill_null(0.0))
+        )
 
         # 1. Cards by region
         print("\n1. Top Cards by Region:")
-        for location in deck_data['location_name'].unique():
-            location_data = deck_data[deck_data['location_name'] == location]
-
-            # Flatten all cards from this region
-            all_cards = []
-            for cards in location_data['cards']:
-                all_cards.extend(cards)
-
-            card_freq = Counter(all_cards)
-            print(f"\n  {location} (n={len(location_data)} decks):")
-            for card, count in card_freq.most_common(10):
-                percentage = (count / len(location_data)) * 100
-                print(f"    {card}: {percentage:.1f}%")
+        for location, total in region_totals.iter_rows():
+            print(f"\n  {location} (n={total} decks):")
+            for card, pct in region_top.filter(pl.col("location_name") == location).select(
+                    ["card", "usage_pct"]).iter_rows():
+                print(f"    {card}: {pct:.1f}%")
 
         # 2. Cards by clan
         print("\n2. Sample Clan Strategies:")
-        clans_sample = deck_data.groupby('clan_name').size().sort_values(ascending=False).head(5)
-
-        for clan_name in clans_sample.index:
-            clan_data = deck_data[deck_data['clan_name'] == clan_name]
-
-            # Get most common cards in this clan
-            all_cards = []
-            for cards in clan_data['cards']:
-                all_cards.extend(cards)
-
-            card_freq = Counter(all_cards)
-            location = clan_data.iloc[0]['location_name']
-
-            print(f"\n  {clan_name} ({location}) - {len(clan_data)} decks:")
-            for card, count in card_freq.most_common(5):
-                percentage = (count / len(clan_data)) * 100
-                print(f"    {card}: {percentage:.1f}%")
+        for clan_name, total, location in clan_totals.iter_rows():
+            print(f"\n  {clan_name} ({location}) - {total} decks:")
+            for card, pct in clan_top.filter(pl.col("clan_name") == clan_name).select(
+                    ["card", "usage_pct"]).iter_rows():
+                print(f"    {card}: {pct:.1f}%")
 
         # 3. Regional differences
         print("\n3. Cards with Regional Preferences:")
-
-        # Build card frequency matrix
-        card_location_freq = {}
-
-        for _, row in deck_data.iterrows():
-            location = row['location_name']
-            for card in row['cards']:
-                if card not in card_location_freq:
-                    card_location_freq[card] = {}
-                if location not in card_location_freq[card]:
-                    card_location_freq[card][location] = 0
-                card_location_freq[card][location] += 1
-
-        # Calculate variance
-        location_counts = deck_data.groupby('location_name').size().to_dict()
-        card_variance = {}
-
-        for card, loc_counts in card_location_freq.items():
-            percentages = []
-            for loc, count in loc_counts.items():
-                pct = (count / location_counts[loc]) * 100
-                percentages.append(pct)
-
-            if len(percentages) > 1:
-                card_variance[card] = np.var(percentages)
-
-        # Show cards with high variance
-        sorted_variance = sorted(card_variance.items(), key=lambda x: x[1], reverse=True)
-
         print("\n  Cards showing regional strategy differences:")
-        for card, variance in sorted_variance[:10]:
+        top_variance = regional_variance.head(top_variance_cards)
+        shown_usage = regional_usage.join(top_variance.select("card"), on="card")
+        for card, variance, _ in top_variance.iter_rows():
             print(f"\n    {card} (variance: {variance:.2f}):")
-            for loc in deck_data['location_name'].unique():
-                loc_data = deck_data[deck_data['location_name'] == loc]
-                card_count = sum(1 for cards in loc_data['cards'] if card in cards)
-                pct = (card_count / len(loc_data)) * 100 if len(loc_data) > 0 else 0
-                print(f"      {loc}: {pct:.1f}%")
+            for location, pct in shown_usage.filter(pl.col("card") == card).select(
+                    ["location_name", "usage_pct"]).iter_rows():
+                print(f"      {location}: {pct:.1f}%")
+
+        return {
+            "region_top_cards": region_top,
+            "clan_top_cards": clan_top,
+            "regional_usage": regional_usage,
+            "regional_variance": regional_variance,
+        }
 
 
 def main():
 
 
-    classifier = ClanBasedStrategyClassifier(API_KEY)
+    # Cards, locations and rosters are served from disk on re-runs, and an
+    # interrupted crawl resumes from its journal. Snapshots older than 12h are
+    # refreshed, so the nightly run only re-fetches what went stale.
+    classifier = ClanBasedStrategyClassifier(
+        load_api_key(),
+        cache=ResponseCache("api_cache.sqlite"),
+        checkpoint=CollectionCheckpoint("collection_checkpoint.jsonl", max_age=12 * 3600)
+    )
 
     # Fetch basic data
     print("=" * 60)
@@ -315,6 +797,10 @@ def main():
         delay_between_requests=0.2  # Rate limiting
     )
 
+    stats = classifier.cache.stats()
+    print(f"\nCache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_ratio']:.0%} hit ratio), {stats['revalidated']} revalidated")
+
     if len(deck_data) > 0:
         print("\n Data collection successful!")
         print(f"Collected {len(deck_data)} decks")
@@ -324,16 +810,73 @@ def main():
         # Save raw data
         deck_data.to_csv("clan_based_deckss.csv", index=False)
         print("\n Saved to: clan_based_deckss.csv")
+        write_deck_snapshot(deck_data, "decks_parquet")
+        print(" Saved snapshot to: decks_parquet/")
+        cube = DeckCube.load_or_new("deck_cube").update(DeckCube.build(deck_data))
+        cube.save("deck_cube")
+        print(f" Updated aggregate cube ({len(cube.snapshots)} snapshots): deck_cube/")
+        classifier.catalog.save("card_catalog.json")
+
+        # Top synergy partners of every card, overall and per region
+        synergies = regional_synergy_tables(classifier.catalog.deck_matrix(deck_data['card_ids']),
+                                            deck_data['location_name'])
+        synergies['card'] = synergies['card'].map(classifier.catalog.card_name)
+        synergies['partner'] = synergies['partner'].map(classifier.catalog.card_name)
+        synergies.to_csv("card_synergies.csv", index=False)
+        print("\n Saved synergy tables to: card_synergies.csv")
+
+        # Classify decks into archetypes and report each region's archetype mix
+        print("\n" + "=" * 60)
+        print("ARCHETYPE CLASSIFICATION")
+        print("=" * 60)
+
+        deck_data['archetype'] = classifier.classify_decks(deck_data, model_path="archetype_model.json")
+        model = classifier.archetype_model
+        print(f"\n{len(model)} archetypes; "
+              f"{(deck_data['archetype'] != 'Other').mean():.0%} of decks assigned")
 
-        # Analyze strategies
-        classifier.analyze_clan_strategies(deck_data)
+        shares = archetype_shares(deck_data['archetype'], deck_data['location_name'])
+        for location, region in shares.groupby('location_name', sort=False):
+            print(f"\n  {location} (n={region['decks'].sum()} decks):")
+            for row in region.head(5).itertuples(index=False):
+                print(f"    {row.archetype}: {row.share_pct:.1f}%")
+        shares.to_csv("archetype_shares.csv", index=False)
+        print("\n Saved archetype shares to: archetype_shares.csv")
 
-        # Now you can build your classifier
+        # Fold today's summary into the snapshot history; earlier days are not re-read
         print("\n" + "=" * 60)
-        print("READY FOR CLASSIFICATION")
+        print("META SHIFTS ACROSS SNAPSHOTS")
         print("=" * 60)
-        print("\nNext steps:")
 
+        history = MetaHistory.load_or_new("meta_history")
+        history.add_snapshot(deck_data, archetypes=deck_data['archetype'], replace=True)
+        history.save("meta_history")
+        print(f"\n{len(history.snapshots)} snapshots in meta_history/")
+
+        trends = history.trends("card")
+        movers = trends.filter(pl.col("direction") != "flat").sort(
+            ["location_name", pl.col("change").abs()], descending=[False, True])
+        for (location,), region in movers.group_by(["location_name"], maintain_order=True):
+            print(f"\n  {location}:")
+            for card, change, direction in region.select(["card", "change", "direction"]).head(5).iter_rows():
+                print(f"    {direction:<8}{card}: {change:+.1f} points")
+        shifts = history.change_points("card")
+        if shifts.height:
+            print("\n  Largest level shifts:")
+            for location, card, when, before, after in shifts.select(
+                    ["location_name", "card", "change_date", "before", "after"]).head(10).iter_rows():
+                print(f"    {location} / {card}: {before:.1f}% -> {after:.1f}% from {when}")
+        if len(history.snapshots) < 3:
+            print("  (trends need at least 3 snapshots)")
+
+        # Structured run metrics: one JSON line per run, plus a Prometheus textfile
+        summary = classifier.metrics.summary()
+        rate = summary['records_per_second']
+        print(f"\n{summary['records']:.0f} records" + (f" at {rate:.1f}/s" if rate else "") + "; stages: " +
+              ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in summary['stages'].items()))
+        classifier.metrics.write_jsonl("metrics.jsonl")
+        classifier.metrics.write_prometheus("metrics.prom")
+        print(" Saved metrics to: metrics.jsonl, metrics.prom")
 
         return deck_data
     else:
@@ -0,0 +1,98 @@
+from typing import Optional
+
+import numpy as np
+
+from sketches import mix64
+
+
+def card_slots(bits: np.ndarray, n_cards: int, width: Optional[int] = None) -> np.ndarray:
+    """
+    Column indices of each packed deck's cards, padded with n_cards
+
+    (n, width) int64; width defaults to the largest deck. Built from the
+    nonzero entries, so the cost is proportional to cards held, not to
+    decks x vocabulary.
+    """
+    dense = np.unpackbits(bits, axis=1, count=n_cards, bitorder="little")
+    rows, cols = np.nonzero(dense)
+    sizes = np.bincount(rows, minlength=len(bits))
+    width = width or int(sizes.max(initial=0))
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    position = np.arange(len(rows)) - starts[rows]
+
+    slots = np.full((len(bits), max(width, 1)), n_cards, dtype=np.int64)
+    keep = position < width
+    slots[rows[keep], position[keep]] = cols[keep]
+    return slots
+
+
+class MinHasher:
+    """
+    MinHash signatures of bitset-encoded decks
+
+    Each of num_perm random permutations of the card columns gives one
+    signature value: the smallest permuted rank among the deck's cards. Two
+    decks agree on a value with probability equal to their Jaccard
+    similarity.
+    """
+
+    def __init__(self, n_cards: int, num_perm: int = 64, seed: int = 0, chunk_size: int = 100_000):
+        rng = np.random.default_rng(seed)
+        self.n_cards = n_cards
+        self.num_perm = num_perm
+        self.seed = seed
+        self.chunk_size = chunk_size
+        # Extra last column: the padding slot ranks after every real card
+        self.ranks = np.full((num_perm, n_cards + 1), n_cards, dtype=np.int16)
+        for p in range(num_perm):
+            self.ranks[p, :n_cards] = rng.permutation(n_cards)
+
+    def signatures(self, bits: np.ndarray) -> np.ndarray:
+        """(n, num_perm) int16 signatures of packed decks"""
+        out = np.empty((len(bits), self.num_perm), dtype=np.int16)
+        for start in range(0, len(bits), self.chunk_size):
+            slots = card_slots(bits[start:start + self.chunk_size], self.n_cards)
+            out[start:start + len(slots)] = self.ranks[:, slots].min(axis=2).T
+        return out
+
+
+def band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """
+    One 64-bit bucket key per (deck, band)
+
+    The signature is cut into `bands` bands of num_perm / bands rows; decks
+    with Jaccard similarity s share at least one band key with probability
+    1 - (1 - s ** rows) ** bands.
+    """
+    n, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    rows = num_perm // bands
+    banded = signatures.reshape(n, bands, rows).astype(np.uint64)
+    multipliers = mix64(np.arange(1, rows + 1, dtype=np.uint64))
+    with np.errstate(over="ignore"):
+        keys = (banded * multipliers).sum(axis=2, dtype=np.uint64)
+        keys += np.arange(bands, dtype=np.uint64) << np.uint64(56)
+    return mix64(keys)
+
+
+def candidate_pairs(keys: np.ndarray) -> np.ndarray:
+    """
+    Candidate (head, member) row pairs sharing a bucket in some band
+
+    Every member of a bucket is paired with the bucket's first row rather
+    than with every other member, so the number of pairs grows linearly
+    with the number of decks. Ordering rows by frequency beforehand makes
+    the most common deck of each bucket its head.
+    """
+    pairs = []
+    for band in range(keys.shape[1]):
+        order = np.argsort(keys[:, band], kind="stable")
+        sorted_keys = keys[order, band]
+        run_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        heads = order[np.flatnonzero(run_start)][np.cumsum(run_start) - 1]
+        members = ~run_start
+        pairs.append(np.stack([heads[members], order[members]], axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
@@ -0,0 +1,244 @@
+import bisect
+import cProfile
+import functools
+import json
+import math
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+
+# Upper bounds (seconds) of the request-latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+PROMETHEUS_PREFIX = "cr_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """Fixed-bucket histogram (per-bucket counts, sum and count)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return math.nan
+        target, seen = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Counters, latency histograms and stage timings for one pipeline run
+
+    The classifier records every HTTP attempt (endpoint, status, latency),
+    every cache lookup and every deck record; analysis and rendering stages
+    are timed with stage(). Thread-safe, so the concurrent crawl can share
+    one instance. Export with to_json()/write_jsonl() or to_prometheus().
+
+    With profile_dir set, each stage also runs under cProfile and dumps
+    <profile_dir>/<stage>.prof; with trace_memory, each stage's tracemalloc
+    peak is recorded.
+    """
+
+    def __init__(self, profile_dir: Optional[str] = None, trace_memory: bool = False):
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.started = time.time()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._first_record: Optional[float] = None
+        self._last_record: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def record_request(self, endpoint: str, status, seconds: float):
+        """One HTTP attempt; status is the HTTP code or "error" for connection failures and timeouts"""
+        self.inc("api_requests_total", endpoint=endpoint, status=status)
+        self.observe("api_request_seconds", seconds, endpoint=endpoint)
+
+    def record_cache(self, endpoint: str, result: str):
+        """result is "hit", "miss" or "revalidated" (a 304 on a stale entry)"""
+        self.inc("cache_lookups_total", endpoint=endpoint, result=result)
+
+    def record_records(self, n: int = 1):
+        now = time.time()
+        with self._lock:
+            self.counters[("records_total", ())] = self.counters.get(("records_total", ()), 0) + n
+            if self._first_record is None:
+                self._first_record = now
+            self._last_record = now
+
+    def record_stage(self, stage: str, seconds: float):
+        self.inc("stage_seconds_total", seconds, stage=stage)
+        self.inc("stage_runs_total", stage=stage)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block (and profile it, if enabled) as one run of stage `name`"""
+        profiler = cProfile.Profile() if self.profile_dir else None
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name.replace(':', '_')}.prof"))
+            if tracing:
+                self.set("stage_peak_bytes", tracemalloc.get_traced_memory()[1], stage=name)
+                tracemalloc.stop()
+            self.record_stage(name, seconds)
+
+    def _by_label(self, name: str, label: str) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for (metric, labels), value in self.counters.items():
+            if metric == name:
+                key = dict(labels).get(label, "")
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def summary(self) -> Dict:
+        """The headline numbers: per-endpoint traffic, error rates, cache hit ratio, throughput, stages"""
+        with self._lock:
+            endpoints = {}
+            for (metric, labels), value in self.counters.items():
+                if metric != "api_requests_total":
+                    continue
+                labels = dict(labels)
+                entry = endpoints.setdefault(labels["endpoint"], {"requests": 0, "status": {}})
+                entry["requests"] += value
+                entry["status"][labels["status"]] = entry["status"].get(labels["status"], 0) + value
+            for endpoint, entry in endpoints.items():
+                histogram = self.histograms.get(("api_request_seconds", _labels({"endpoint": endpoint})))
+                entry["rate_429"] = entry["status"].get("429", 0) / entry["requests"]
+                entry["rate_404"] = entry["status"].get("404", 0) / entry["requests"]
+                if histogram is not None:
+                    entry["mean_seconds"] = histogram.sum / histogram.count
+                    entry["p95_seconds_le"] = histogram.quantile(0.95)
+
+            cache = self._by_label("cache_lookups_total", "result")
+            lookups = sum(cache.values())
+            records = self.counters.get(("records_total", ()), 0)
+            span = (self._last_record - self._first_record) if self._first_record is not None else 0.0
+
+            return {
+                "uptime_seconds": time.time() - self.started,
+                "endpoints": endpoints,
+                "cache": dict(cache, hit_ratio=(cache.get("hit", 0) + cache.get("revalidated", 0)) / lookups
+                              if lookups else None),
+                "records": records,
+                "records_per_second": records / span if span > 0 else None,
+                "stages": self._by_label("stage_seconds_total", "stage"),
+                "stage_peak_bytes": {dict(labels)["stage"]: value for (metric, labels), value in self.gauges.items()
+                                     if metric == "stage_peak_bytes"},
+            }
+
+    def to_json(self) -> Dict:
+        with self._lock:
+            histograms = [{"name": name, "labels": dict(labels), "buckets": list(h.buckets[:-1]) + ["+Inf"],
+                           "counts": h.counts, "sum": h.sum, "count": h.count}
+                          for (name, labels), h in self.histograms.items()]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+        return {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "summary": self.summary(), "counters": counters, "histograms": histograms}
+
+    def write_jsonl(self, path: str):
+        """Append one JSON line with the current state"""
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(self.to_json()) + "\n")
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        def fmt(labels: Labels, extra: Tuple = ()) -> str:
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {kind}")
+                    for (metric, labels), value in sorted(metrics.items()):
+                        if metric == name:
+                            lines.append(f"{PROMETHEUS_PREFIX}{name}{fmt(labels)} {value:g}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} histogram")
+                for (metric, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        le = "+Inf" if math.isinf(bound) else f"{bound:g}"
+                        lines.append(f"{PROMETHEUS_PREFIX}{name}_bucket{fmt(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{PROMETHEUS_PREFIX}{name}_sum{fmt(labels)} {h.sum:g}")
+                    lines.append(f"{PROMETHEUS_PREFIX}{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+def timed_stage(name: str):
+    """Method decorator: run the method as stage `name` of self.metrics"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,345 @@
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from deck_matrix import DeckMatrix
+
+
+MANIFEST = "manifest.json"
+
+# Columns holding one list of cards per deck (as in storage.DECK_LIST_COLUMNS)
+DECK_LIST_COLUMNS = ("cards", "card_ids")
+
+# Rows are stored sorted by these, so every location and every clan within it is one contiguous range
+SORT_COLUMNS = ("location_name", "clan_name")
+
+Range = Tuple[int, int]
+
+
+def _plain(value):
+    """JSON-friendly Python scalar for a NumPy scalar"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def card_dtype(n_cards: int) -> np.dtype:
+    """Narrowest unsigned dtype for card indices; its maximum value marks an empty slot"""
+    for dtype in (np.uint8, np.uint16):
+        if n_cards < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f"{n_cards} cards do not fit a uint16 deck store")
+
+
+def encode_decks(decks: pd.Series, vocabulary: Sequence[Hashable]) -> np.ndarray:
+    """
+    (n_decks, width) card indices into vocabulary, one deck per row
+
+    Each row holds the deck's distinct known cards in the deck's own order,
+    padded with the dtype's maximum; width is the longest deck (8 for ladder
+    decks). Keeping the order keeps parallel columns (cards and card_ids)
+    aligned position by position, as CardCatalog.from_frame expects.
+    """
+    dtype = card_dtype(len(vocabulary))
+    empty = np.iinfo(dtype).max
+
+    lengths = decks.map(len).to_numpy(dtype=np.int64)
+    flat = decks.explode().dropna().to_numpy()
+    cols = pd.Index(vocabulary).get_indexer(flat)
+
+    starts = np.cumsum(lengths) - lengths
+    rows = np.repeat(np.arange(len(decks)), lengths)
+    positions = np.arange(len(flat)) - np.repeat(starts, lengths)
+
+    width = int(lengths.max()) if len(decks) else 0
+    out = np.full((len(decks), width), empty, dtype=dtype)
+    out[rows, positions] = np.where(cols >= 0, cols, empty)
+
+    # Blank repeated cards (found in a sorted view of each row), then move
+    # the blanks last without reordering the cards
+    if width > 1:
+        order = np.argsort(out, axis=1, kind="stable")
+        ranked = np.take_along_axis(out, order, axis=1)
+        repeated = np.zeros(out.shape, dtype=bool)
+        np.put_along_axis(repeated, order[:, 1:], ranked[:, 1:] == ranked[:, :-1], axis=1)
+        out[repeated] = empty
+        out = np.take_along_axis(out, np.argsort(out == empty, axis=1, kind="stable"), axis=1)
+    return out
+
+
+def _encode_column(values: pd.Series) -> Tuple[np.ndarray, Optional[List]]:
+    """Numeric columns as they are; anything else as int32 codes into sorted categories (-1 = missing)"""
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+        array = values.to_numpy()
+        if array.dtype != object:
+            return array, None
+    codes, categories = pd.factorize(values.astype("string"), sort=True)
+    return codes.astype(np.int32), [str(c) for c in categories]
+
+
+class DeckStore:
+    """
+    Fixed-width, memory-mapped deck table
+
+    Each card-list column is an (n_decks, width) uint8 (uint16 past 254
+    cards) matrix of indices into its vocabulary, and every other column a
+    flat array: numbers as stored, text as int32 dictionary codes. All of
+    them are raw files opened with np.memmap, so any number of processes
+    can open the store and share the same page-cache pages instead of each
+    parsing the CSV into its own frame of Python lists.
+
+    Rows are sorted by location and clan, which makes every location (and
+    every clan within it) a contiguous range - the unit map_reduce hands to
+    worker processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), encoding="utf-8") as fh:
+            manifest = json.load(fh)
+        self.n_decks: int = manifest["n_decks"]
+        self.sort_by: List[str] = manifest["sort_by"]
+        self._decks: Dict[str, Dict] = manifest["decks"]
+        self._columns: Dict[str, Dict] = manifest["columns"]
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def write(cls, deck_data: pd.DataFrame, path: str,
+              vocabularies: Optional[Dict[str, Sequence[Hashable]]] = None,
+              sort_by: Sequence[str] = SORT_COLUMNS) -> "DeckStore":
+        """
+        Write a deck table (pandas or polars) to a store directory, replacing any store there
+
+        vocabularies maps a card-list column to its card order (e.g. the
+        catalog's card IDs); by default the distinct cards sorted by str.
+        """
+        if not isinstance(deck_data, pd.DataFrame):
+            deck_data = deck_data.to_pandas()
+        vocabularies = dict(vocabularies or {})
+
+        columns = {}
+        for name in deck_data.columns:
+            if name not in DECK_LIST_COLUMNS:
+                columns[name] = _encode_column(deck_data[name])
+
+        sort_by = [name for name in sort_by if name in columns]
+        order = np.lexsort([columns[name][0] for name in reversed(sort_by)]) if sort_by else None
+
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        manifest = {"n_decks": len(deck_data), "sort_by": sort_by, "decks": {}, "columns": {}}
+
+        for name in DECK_LIST_COLUMNS:
+            if name not in deck_data.columns:
+                continue
+            vocabulary = vocabularies.get(name)
+            if vocabulary is None:
+                vocabulary = sorted(pd.unique(deck_data[name].explode().dropna()), key=str)
+            encoded = encode_decks(deck_data[name], vocabulary)
+            if order is not None:
+                encoded = encoded[order]
+            encoded.tofile(os.path.join(tmp_path, f"{name}.bin"))
+            manifest["decks"][name] = {"dtype": encoded.dtype.str, "width": encoded.shape[1],
+                                       "vocabulary": [_plain(card) for card in vocabulary]}
+
+        for name, (array, categories) in columns.items():
+            if order is not None:
+                array = array[order]
+            np.ascontiguousarray(array).tofile(os.path.join(tmp_path, f"{name}.bin"))
+            manifest["columns"][name] = {"dtype": array.dtype.str, "categories": categories}
+
+        with open(os.path.join(tmp_path, MANIFEST), "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self.n_decks
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def _map(self, name: str, dtype: str, shape: Tuple[int, ...]) -> np.ndarray:
+        array = self._arrays.get(name)
+        if array is None:
+            if self.n_decks == 0 or 0 in shape:
+                array = np.zeros(shape, dtype=dtype)  # mmap cannot map an empty file
+            else:
+                array = np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=dtype, mode="r", shape=shape)
+            self._arrays[name] = array
+        return array
+
+    def decks(self, column: str = "cards") -> np.ndarray:
+        """The (n_decks, width) read-only card-index matrix of a card-list column"""
+        spec = self._decks[column]
+        return self._map(column, spec["dtype"], (self.n_decks, spec["width"]))
+
+    def vocabulary(self, column: str = "cards") -> List[Hashable]:
+        return self._decks[column]["vocabulary"]
+
+    def column(self, name: str) -> np.ndarray:
+        """Raw read-only values of a metadata column (dictionary codes for text)"""
+        return self._map(name, self._columns[name]["dtype"], (self.n_decks,))
+
+    def categories(self, name: str) -> Optional[List[str]]:
+        """Dictionary of a text column (None for numeric columns)"""
+        return self._columns[name]["categories"]
+
+    def values(self, name: str, rows=slice(None)) -> np.ndarray:
+        """Decoded values of a metadata column for the selected rows"""
+        raw = self.column(name)[rows]
+        categories = self.categories(name)
+        if categories is None:
+            return np.asarray(raw)
+        return np.append(np.asarray(categories, dtype=object), None)[raw]
+
+    def matrix(self, column: str = "cards", rows=slice(None), chunk_size: int = 200_000) -> DeckMatrix:
+        """Selected decks as a packed DeckMatrix over the column's vocabulary"""
+        indices = self.decks(column)[rows]
+        n_cards = len(self.vocabulary(column))
+        bits = np.empty((len(indices), (n_cards + 7) // 8), dtype=np.uint8)
+        for start in range(0, len(indices), chunk_size):
+            chunk = np.minimum(indices[start:start + chunk_size], n_cards).astype(np.intp)
+            one_hot = np.zeros((len(chunk), n_cards + 1), dtype=bool)
+            np.put_along_axis(one_hot, chunk, True, axis=1)
+            bits[start:start + len(chunk)] = np.packbits(one_hot[:, :n_cards], axis=1, bitorder="little")
+        return DeckMatrix(bits, self.vocabulary(column))
+
+    def to_frame(self, rows=slice(None)) -> pd.DataFrame:
+        """Selected rows back in the collector's layout (card-list columns as lists)"""
+        frame = {name: self.values(name, rows) for name in self._columns}
+        for column in self._decks:
+            vocabulary = np.asarray(self.vocabulary(column), dtype=object)
+            frame[column] = [vocabulary[deck[deck < len(vocabulary)]].tolist()
+                             for deck in np.asarray(self.decks(column)[rows])]
+        return pd.DataFrame(frame)
+
+    def partitions(self, by: Sequence[str] = ("location_name",)) -> List[Range]:
+        """
+        Row ranges over which the `by` columns are constant, in store order
+
+        For a prefix of sort_by each value gets exactly one range; for other
+        columns a value may span several.
+        """
+        if self.n_decks == 0:
+            return []
+        change = np.zeros(self.n_decks - 1, dtype=bool)
+        for name in by:
+            values = self.column(name)
+            change |= values[1:] != values[:-1]
+        bounds = np.r_[0, np.flatnonzero(change) + 1, self.n_decks]
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def balance_ranges(ranges: List[Range], n_tasks: int) -> List[Range]:
+    """Merge adjacent ranges into about n_tasks ranges of similar size, never splitting one"""
+    if not ranges:
+        return []
+    target = max(1, (ranges[-1][1] - ranges[0][0]) // max(n_tasks, 1))
+    merged = [list(ranges[0])]
+    for start, stop in ranges[1:]:
+        if merged[-1][1] - merged[-1][0] >= target:
+            merged.append([start, stop])
+        else:
+            merged[-1][1] = stop
+    return [tuple(r) for r in merged]
+
+
+_worker_store: Optional[DeckStore] = None
+
+
+def _open_worker_store(path: str):
+    global _worker_store
+    _worker_store = DeckStore(path)
+
+
+def _run_mapper(mapper: Callable, start: int, stop: int):
+    return mapper(_worker_store, start, stop)
+
+
+def map_reduce(store: DeckStore, mapper: Callable[[DeckStore, int, int], object],
+               reducer: Callable[[List], object] = list, by: Sequence[str] = ("location_name",),
+               workers: Optional[int] = None, tasks_per_worker: int = 4):
+    """
+    reducer([mapper(store, start, stop) for each task]) over a process pool
+
+    Tasks are contiguous row ranges that never split a group of the `by`
+    columns (several small groups may share a task). Each worker opens the
+    store once by path, so only (start, stop) pairs and the mapper's partial
+    results cross process boundaries. The mapper must be picklable (a
+    module-level function or a functools.partial of one). workers=1 runs in
+    this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = balance_ranges(store.partitions(by), workers * tasks_per_worker)
+
+    if workers <= 1 or len(ranges) <= 1:
+        return reducer([mapper(store, start, stop) for start, stop in ranges])
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), initializer=_open_worker_store,
+                             initargs=(store.path,)) as pool:
+        futures = [pool.submit(_run_mapper, mapper, start, stop) for start, stop in ranges]
+        return reducer([future.result() for future in futures])
+
+
+def _group_card_counts_part(store: DeckStore, start: int, stop: int, by: Sequence[str], column: str):
+    """Per-group card counts of rows [start, stop): (group codes, counts, deck totals)"""
+    codes = np.stack([np.asarray(store.column(name)[start:stop], dtype=np.int64) for name in by], axis=1)
+    groups, inverse = np.unique(codes, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    n_cards = len(store.vocabulary(column))
+    cards = np.minimum(store.decks(column)[start:stop], n_cards).astype(np.int64)  # empty slots -> n_cards
+    keys = inverse[:, None] * (n_cards + 1) + cards
+    counts = np.bincount(keys.ravel(), minlength=len(groups) * (n_cards + 1)).reshape(len(groups), n_cards + 1)
+    return groups, counts[:, :n_cards], np.bincount(inverse, minlength=len(groups))
+
+
+def _sum_group_card_counts(parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+    groups = np.concatenate([part[0] for part in parts])
+    distinct, inverse = np.unique(groups, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.zeros((len(distinct), parts[0][1].shape[1]), dtype=np.int64)
+    np.add.at(counts, inverse, np.concatenate([part[1] for part in parts]))
+    totals = np.bincount(inverse, weights=np.concatenate([part[2] for part in parts]), minlength=len(distinct))
+    return distinct, counts, totals.astype(np.int64)
+
+
+def group_card_counts(store: DeckStore, by: Sequence[str] = SORT_COLUMNS, column: str = "cards",
+                      workers: Optional[int] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Decks holding each card per group, map-reduced over the store
+
+    Returns (counts, totals): counts has the `by` columns plus `card` and
+    `decks` (non-zero cells only), totals the `by` columns plus
+    `total_decks`. These are the (location, clan, card) counts
+    analyze_clan_strategies rolls up.
+    """
+    by = list(by)
+    if len(store) == 0:
+        return (pd.DataFrame(columns=by + ["card", "decks"]), pd.DataFrame(columns=by + ["total_decks"]))
+
+    groups, counts, totals = map_reduce(store, partial(_group_card_counts_part, by=by, column=column),
+                                        _sum_group_card_counts, by=by, workers=workers)
+
+    labels = {}
+    for i, name in enumerate(by):
+        categories = store.categories(name)
+        labels[name] = (np.append(np.asarray(categories, dtype=object), None)[groups[:, i]]
+                        if categories is not None else groups[:, i])
+
+    group_index, card_index = np.nonzero(counts)
+    vocabulary = np.asarray(store.vocabulary(column), dtype=object)
+    counts_frame = pd.DataFrame({name: values[group_index] for name, values in labels.items()})
+    counts_frame["card"] = vocabulary[card_index]
+    counts_frame["decks"] = counts[group_index, card_index]
+
+    totals_frame = pd.DataFrame(labels)
+    totals_frame["total_decks"] = totals
+    return counts_frame, totals_frame
@@ -0,0 +1,233 @@
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from rate_limit import TokenBucket
+
+
+def build_world(n_locations: int = 3, clans_per_location: int = 5, members_per_clan: int = 10,
+                n_cards: int = 110, seed: int = 0, battles_per_player: int = 0) -> Dict:
+    """Deterministic fake cards, locations, clans, players and battles shaped like the real API's"""
+    rng = random.Random(seed)
+
+    cards = [{"id": 26000000 + i, "name": f"Card {i}", "elixirCost": rng.randint(1, 9),
+              "rarity": rng.choice(["common", "rare", "epic", "legendary"])}
+             for i in range(n_cards)]
+    locations = [{"id": 57000000 + i, "name": f"Region {i}", "isCountry": False}
+                 for i in range(n_locations)]
+
+    clans: Dict[int, List[Dict]] = {}
+    members: Dict[str, List[Dict]] = {}
+    players: Dict[str, Dict] = {}
+    for loc in locations:
+        clans[loc["id"]] = []
+        for c in range(clans_per_location):
+            clan_tag = f"C{loc['id'] % 1000:03d}{c:04d}"
+            clans[loc["id"]].append({"tag": f"#{clan_tag}", "name": f"Clan {loc['id'] % 1000}-{c}",
+                                     "clanScore": 100000 - c * 10})
+            members[clan_tag] = []
+            for m in range(members_per_clan):
+                player_tag = f"P{clan_tag}{m:03d}"
+                members[clan_tag].append({"tag": f"#{player_tag}", "name": f"Player {player_tag}"})
+                deck = rng.sample(cards, 8)
+                players[player_tag] = {
+                    "tag": f"#{player_tag}",
+                    "name": f"Player {player_tag}",
+                    "trophies": rng.randint(7000, 10000),
+                    "currentDeck": [{"id": card["id"], "name": card["name"]} for card in deck],
+                }
+
+    battles = _build_battles(players, battles_per_player, seed)
+    return {"cards": cards, "locations": locations, "clans": clans, "members": members, "players": players,
+            "battles": battles}
+
+
+def _build_battles(players: Dict[str, Dict], battles_per_player: int, seed: int) -> Dict[str, List[Dict]]:
+    """1v1 ladder battles, each listed under both participants, newest first"""
+    rng = random.Random(seed + 1)
+    tags = list(players)
+    battles: Dict[str, List[Dict]] = {tag: [] for tag in tags}
+    if len(tags) < 2:
+        return battles
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i, tag in enumerate(tags):
+        for _ in range(battles_per_player):
+            j = rng.randrange(len(tags) - 1)
+            opponent = tags[j + (j >= i)]
+            when = start + timedelta(seconds=rng.randint(0, 30 * 24 * 3600))
+            battle = {
+                "type": "PvP",
+                "battleTime": when.strftime("%Y%m%dT%H%M%S.000Z"),
+                "gameMode": {"id": 72000006, "name": "Ladder"},
+                "sides": [_battle_side(players[t], rng.randint(0, 3)) for t in (tag, opponent)],
+            }
+            battles[tag].append(battle)
+            battles[opponent].append(battle)
+
+    for log in battles.values():
+        log.sort(key=lambda battle: battle["battleTime"], reverse=True)
+    return battles
+
+
+def _battle_side(player: Dict, crowns: int) -> Dict:
+    return {"tag": player["tag"], "name": player["name"], "crowns": crowns,
+            "startingTrophies": player["trophies"], "cards": player["currentDeck"]}
+
+
+class MockClashRoyaleAPI:
+    """
+    Local HTTP stand-in for the Clash Royale API
+
+    Serves /cards, /locations, /locations/{id}/rankings/clans,
+    /clans/{tag}/members, /players/{tag} and /players/{tag}/battlelog under
+    /v1 from a generated world,
+    and counts requests per endpoint and per API key so multi-key crawls can
+    be checked. Use as a context manager; base_url points a classifier at it.
+
+    For benchmarks it can behave like a loaded production API: every request
+    waits `latency` seconds (plus up to `latency_jitter`), each key is held
+    to `rate_limit` requests per second, and `throttle_probability` of the
+    remaining requests are refused; refusals are 429s carrying Retry-After.
+    """
+
+    ROUTES = [
+        ("cards", re.compile(r"^/v1/cards$")),
+        ("locations", re.compile(r"^/v1/locations$")),
+        ("rankings", re.compile(r"^/v1/locations/(\d+)/rankings/clans$")),
+        ("members", re.compile(r"^/v1/clans/#([^/]+)/members$")),
+        ("players", re.compile(r"^/v1/players/#([^/]+)$")),
+        ("battlelog", re.compile(r"^/v1/players/#([^/]+)/battlelog$")),
+    ]
+
+    def __init__(self, world: Optional[Dict] = None, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, latency_jitter: float = 0.0, rate_limit: Optional[float] = None,
+                 throttle_probability: float = 0.0, retry_after: float = 1.0, seed: int = 0):
+        self.world = world or build_world()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit = rate_limit
+        self.throttle_probability = throttle_probability
+        self.retry_after = retry_after
+        self.requests_by_endpoint = Counter()
+        self.requests_by_key = Counter()
+        self.throttled_by_key = Counter()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockClashRoyaleAPI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockClashRoyaleAPI":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, path: str, api_key: str) -> Tuple[int, Dict, Dict[str, str]]:
+        """Route one GET; returns (status, JSON payload, extra headers)"""
+        parts = urlsplit(path)
+        route_path = unquote(parts.path)
+        query = parse_qs(parts.query)
+
+        for endpoint, pattern in self.ROUTES:
+            match = pattern.match(route_path)
+            if match is None:
+                continue
+
+            with self._lock:
+                self.requests_by_endpoint[endpoint] += 1
+                self.requests_by_key[api_key] += 1
+                jitter = self._rng.random() * self.latency_jitter
+                throttled = self._rng.random() < self.throttle_probability
+                if self.rate_limit is not None:
+                    bucket = self._buckets.setdefault(api_key, TokenBucket(self.rate_limit))
+                    throttled = not bucket.try_acquire() or throttled
+                if throttled:
+                    self.throttled_by_key[api_key] += 1
+
+            if self.latency or jitter:
+                time.sleep(self.latency + jitter)
+            if throttled:
+                return 429, {"reason": "requestThrottled"}, {"Retry-After": f"{self.retry_after:g}"}
+            return self._respond(endpoint, match.groups(), query)
+
+        return 404, {"reason": "notFound"}, {}
+
+    def _respond(self, endpoint: str, args: Tuple, query: Dict) -> Tuple[int, Dict, Dict[str, str]]:
+        world = self.world
+        if endpoint == "cards":
+            return 200, {"items": world["cards"]}, {}
+        if endpoint == "locations":
+            return 200, {"items": world["locations"]}, {}
+        if endpoint == "rankings":
+            clans = world["clans"].get(int(args[0]))
+            if clans is None:
+                return 404, {"reason": "notFound"}, {}
+            limit = int(query.get("limit", [len(clans)])[0])
+            return 200, {"items": clans[:limit]}, {}
+        if endpoint == "members":
+            members = world["members"].get(args[0])
+            if members is None:
+                return 404, {"reason": "notFound"}, {}
+            return 200, {"items": members}, {}
+        player = world["players"].get(args[0])
+        if player is None:
+            return 404, {"reason": "notFound"}, {}
+        if endpoint == "battlelog":
+            return 200, [self._battle_view(battle, player["tag"]) for battle in world["battles"][args[0]][:25]], {}
+        return 200, player, {}
+
+    @staticmethod
+    def _battle_view(battle: Dict, player_tag: str) -> Dict:
+        """A stored battle as it appears in one participant's log (they are the 'team')"""
+        team = [side for side in battle["sides"] if side["tag"] == player_tag]
+        opponent = [side for side in battle["sides"] if side["tag"] != player_tag]
+        view = {key: value for key, value in battle.items() if key != "sides"}
+        view.update(team=team, opponent=opponent)
+        return view
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        auth = self.headers.get("Authorization", "")
+        api_key = auth[len("Bearer "):] if auth.startswith("Bearer ") else auth
+        status, payload, headers = self.server.api.handle(self.path, api_key)
+
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,25 @@
+import json
+import os
+from typing import Dict
+
+
+class Persistent:
+    """JSON save/load on top of to_dict/from_dict"""
+
+    def to_dict(self) -> Dict:
+        raise NotImplementedError
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        raise NotImplementedError
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(self.to_dict(), fh, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, encoding="utf-8") as fh:
+            return cls.from_dict(json.load(fh))
@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every request a classifier makes
+
+    `rate` is the sustained number of requests per second the API key allows,
+    `capacity` is how many requests may burst through after an idle period.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(self.rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until `tokens` are available, then take them"""
+        if tokens > self.capacity:
+            raise ValueError("cannot acquire more tokens than the bucket holds")
+
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take `tokens` if they are available right now, without blocking"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+
+# Seconds a cached response stays fresh, per endpoint. Cards and locations
+# only change with game updates; rankings and rosters drift over hours.
+DEFAULT_TTLS = {
+    "cards": 7 * 24 * 3600,
+    "locations": 7 * 24 * 3600,
+    "rankings": 6 * 3600,
+    "members": 3 * 3600,
+    "players": 3600,
+    "battlelog": 15 * 60,
+}
+
+
+class CachedResponse(NamedTuple):
+    payload: Dict
+    etag: Optional[str]
+    fetched_at: float
+    fresh: bool
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache for API responses
+
+    Entries are keyed by URL + query parameters and expire per endpoint (see
+    DEFAULT_TTLS). Stale entries are kept with their ETag so the caller can
+    revalidate them with a conditional request. The store is bounded to
+    `max_bytes` of payload and evicts least-recently-used entries past that.
+    """
+
+    def __init__(self, path: str = "api_cache.sqlite", ttls: Optional[Dict[str, float]] = None,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body TEXT NOT NULL,
+                etag TEXT,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict] = None) -> str:
+        """Stable cache key for a request"""
+        raw = url + "?" + json.dumps(params or {}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, endpoint: str) -> Optional[CachedResponse]:
+        """Look up a response; counts a hit only when the entry is still fresh"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            body, etag, fetched_at = row
+            now = time.time()
+            fresh = now - fetched_at < self.ttls.get(endpoint, 0)
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+        return CachedResponse(json.loads(body), etag, fetched_at, fresh)
+
+    def put(self, key: str, endpoint: str, payload: Dict, etag: Optional[str] = None):
+        """Store a response and evict old entries if the cache is over budget"""
+        body = json.dumps(payload, separators=(",", ":"))
+        size = len(body)
+        now = time.time()
+
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._total_bytes -= old[0]
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, body, etag, size, now, now))
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, key: str):
+        """Mark a stale entry fresh again after the server answered 304 Not Modified"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE responses SET fetched_at = ?, last_access = ? WHERE key = ?", (now, now, key))
+            self._conn.commit()
+            self.revalidated += 1
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def clear(self, endpoint: Optional[str] = None):
+        """Drop every entry, or only those of one endpoint"""
+        with self._lock:
+            if endpoint is None:
+                self._conn.execute("DELETE FROM responses")
+            else:
+                self._conn.execute("DELETE FROM responses WHERE endpoint = ?", (endpoint,))
+            self._conn.commit()
+            self._total_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters plus current size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "revalidated": self.revalidated,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self._total_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
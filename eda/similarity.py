@@ -0,0 +1,176 @@
+from typing import Hashable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from deck_matrix import DeckMatrix, jaccard, popcount
+from lsh import MinHasher, band_keys
+from catalog import CardCatalog
+
+
+# Deck table columns returned alongside each match
+METADATA_COLUMNS = ("player_tag", "player_name", "clan_tag", "clan_name", "location_name", "trophies")
+
+# Corpora with at least this many distinct decks are searched through LSH by default
+LSH_MIN_DECKS = 200_000
+
+
+class DeckSimilarityIndex:
+    """
+    Nearest-deck search over packed deck bitsets
+
+    Identical decks are stored once, so scoring cost follows the number of
+    distinct card sets. Exact search computes popcount Jaccard against every
+    distinct deck; LSH search scores only decks sharing a MinHash band with
+    the query, and falls back to exact search when that yields fewer than k
+    decks. Results carry the player, clan and region of each matching row.
+    """
+
+    def __init__(self, matrix: DeckMatrix, metadata: Optional[pd.DataFrame] = None,
+                 lsh: Optional[bool] = None, num_perm: int = 64, bands: int = 16, seed: int = 0,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.matrix = matrix
+        self.max_bytes = max_bytes
+        self.metadata = metadata.reset_index(drop=True) if metadata is not None else None
+
+        _, first, inverse = np.unique(matrix.deck_keys(), return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        self.bits = matrix.bits[first]
+        # Rows of each distinct deck, CSR style: rows[offsets[d]:offsets[d + 1]]
+        self.rows = np.argsort(inverse, kind="stable")
+        self.offsets = np.r_[0, np.cumsum(np.bincount(inverse, minlength=len(first)))]
+
+        self.lsh = len(self.bits) >= LSH_MIN_DECKS if lsh is None else lsh
+        self.hasher = None
+        if self.lsh:
+            self.hasher = MinHasher(matrix.n_cards, num_perm, seed)
+            keys = band_keys(self.hasher.signatures(self.bits), bands)
+            self.bands = bands
+            self._band_order = np.argsort(keys, axis=0, kind="stable")
+            self._band_keys = np.take_along_axis(keys, self._band_order, axis=0)
+
+    @classmethod
+    def from_frame(cls, deck_data: pd.DataFrame, column: str = "cards",
+                   catalog: Optional[CardCatalog] = None, **options) -> "DeckSimilarityIndex":
+        """Index a deck table; with a catalog, `card_ids` are encoded on its columns"""
+        if catalog is not None and "card_ids" in deck_data.columns:
+            matrix = catalog.deck_matrix(deck_data["card_ids"])
+        else:
+            matrix = DeckMatrix.from_frame(deck_data, column)
+        metadata = deck_data[[c for c in METADATA_COLUMNS if c in deck_data.columns]]
+        return cls(matrix, metadata, **options)
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    def _candidates(self, query_bits: np.ndarray) -> List[np.ndarray]:
+        """Distinct decks sharing at least one MinHash band with each packed query"""
+        found = []
+        for keys in band_keys(self.hasher.signatures(query_bits), self.bands):
+            matches = []
+            for band, key in enumerate(keys):
+                column = self._band_keys[:, band]
+                lo, hi = np.searchsorted(column, key, side="left"), np.searchsorted(column, key, side="right")
+                matches.append(self._band_order[lo:hi, band])
+            found.append(np.unique(np.concatenate(matches)) if matches else np.zeros(0, dtype=np.int64))
+        return found
+
+    def _top(self, distinct: np.ndarray, similarity: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the best-scoring distinct decks, expanded until k rows are covered"""
+        top = np.argsort(-similarity, kind="stable")
+        covered = np.cumsum(self.offsets[distinct[top] + 1] - self.offsets[distinct[top]])
+        top = top[:int(np.searchsorted(covered, k)) + 1]
+
+        rows, scores = [], []
+        for d, score in zip(distinct[top], similarity[top]):
+            members = self.rows[self.offsets[d]:self.offsets[d + 1]]
+            rows.append(members)
+            scores.append(np.full(len(members), score, dtype=np.float32))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(rows)[:k], np.concatenate(scores)[:k]
+
+    def _scored(self, query_bits: np.ndarray, distinct: np.ndarray) -> Iterator[np.ndarray]:
+        """
+        Jaccard of each packed query against the distinct decks `distinct`
+
+        One jaccard call per block of queries, with blocks sized so the
+        (queries x decks) float32 scores stay under max_bytes.
+        """
+        bits = self.bits[distinct]
+        block = max(1, self.max_bytes // max(1, 4 * len(distinct)))
+        for start in range(0, len(query_bits), block):
+            yield from jaccard(query_bits[start:start + block], bits)
+
+    def _pair_scores(self, query_bits: np.ndarray, queries: np.ndarray, distinct: np.ndarray) -> np.ndarray:
+        """Jaccard of query queries[i] with distinct deck distinct[i], for every i"""
+        out = np.empty(len(distinct), dtype=np.float32)
+        chunk_size = max(1, self.max_bytes // max(1, self.bits.shape[1]))
+        for start in range(0, len(distinct), chunk_size):
+            chunk = query_bits[queries[start:start + chunk_size]]
+            decks = self.bits[distinct[start:start + chunk_size]]
+            both = popcount(chunk & decks)
+            either = popcount(chunk) + popcount(decks) - both
+            out[start:start + len(both)] = np.divide(both, either, out=np.zeros(len(both)), where=either > 0)
+        return out
+
+    def _search(self, query_bits: np.ndarray, k: int, exact: bool) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top-k rows and similarities for each packed query
+
+        Queries scored against every distinct deck share one jaccard call per
+        block. LSH queries are flattened into (query, candidate) pairs and
+        scored in one vectorized pass, so each pays only for its own
+        candidates. Queries whose candidates cover fewer than k rows fall back
+        to exact.
+        """
+        candidates: List[Optional[np.ndarray]] = [None] * len(query_bits)
+        if self.lsh and not exact:
+            for i, distinct in enumerate(self._candidates(query_bits)):
+                if self.offsets[distinct + 1].sum() - self.offsets[distinct].sum() >= k:
+                    candidates[i] = distinct
+
+        results: List[Optional[Tuple[np.ndarray, np.ndarray]]] = [None] * len(query_bits)
+        full = [i for i, distinct in enumerate(candidates) if distinct is None]
+        if full:
+            everything = np.arange(len(self.bits))
+            for i, similarity in zip(full, self._scored(query_bits[full], everything)):
+                results[i] = self._top(everything, similarity, k)
+
+        pooled = [i for i, distinct in enumerate(candidates) if distinct is not None]
+        if pooled:
+            lengths = [len(candidates[i]) for i in pooled]
+            similarity = self._pair_scores(query_bits, np.repeat(pooled, lengths),
+                                           np.concatenate([candidates[i] for i in pooled]))
+            for i, scores in zip(pooled, np.split(similarity, np.cumsum(lengths)[:-1])):
+                results[i] = self._top(candidates[i], scores, k)
+        return results
+
+    def _result(self, rows: np.ndarray, scores: np.ndarray, ranks: Optional[np.ndarray] = None) -> pd.DataFrame:
+        ranks = np.arange(1, len(rows) + 1) if ranks is None else ranks
+        result = pd.DataFrame({"rank": ranks, "similarity": scores, "row": rows})
+        if self.metadata is not None:
+            result = pd.concat([result, self.metadata.iloc[rows].reset_index(drop=True)], axis=1)
+        result["cards"] = [self.matrix.decode(int(row)) for row in rows]
+        return result
+
+    def query(self, deck: Sequence[Hashable], k: int = 10, exact: bool = False) -> pd.DataFrame:
+        """The k decks most similar to `deck` (card keys in the index's vocabulary)"""
+        query_bits = DeckMatrix.from_decks([deck], self.matrix.vocabulary).bits
+        return self._result(*self._search(query_bits, k, exact)[0])
+
+    def query_many(self, decks: Sequence[Sequence[Hashable]], k: int = 10, exact: bool = False) -> pd.DataFrame:
+        """
+        Batch query; one block of k results per input deck, tagged with its position in `query`
+
+        The whole batch is scored in one pass (see _search), not one query at a time.
+        """
+        query_bits = DeckMatrix.from_decks(decks, self.matrix.vocabulary).bits
+        found = self._search(query_bits, k, exact)
+        if not found:
+            return pd.DataFrame(columns=["query", "rank", "similarity", "row"])
+        result = self._result(np.concatenate([rows for rows, _ in found]),
+                              np.concatenate([scores for _, scores in found]),
+                              np.concatenate([np.arange(1, len(rows) + 1) for rows, _ in found]))
+        result.insert(0, "query", np.repeat(np.arange(len(found)), [len(rows) for rows, _ in found]))
+        return result
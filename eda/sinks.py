@@ -0,0 +1,98 @@
+import os
+from typing import Dict, Iterable, List
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from storage import as_polars_decks
+
+
+class BatchSink:
+    """
+    Collects streamed deck records and hands them on in batches
+
+    Subclasses implement write_batch(); records are buffered until
+    batch_size is reached, and close() flushes whatever is left.
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.records_written = 0
+        self._buffer: List[Dict] = []
+
+    def write(self, record: Dict):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            batch = pd.DataFrame(self._buffer)
+            self._buffer = []
+            self.write_batch(batch)
+            self.records_written += len(batch)
+
+    def write_batch(self, batch: pd.DataFrame):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvSink(BatchSink):
+    """Appends batches to a CSV in the legacy clan_based_deckss.csv layout"""
+
+    def __init__(self, path: str, batch_size: int = 1000, overwrite: bool = True):
+        super().__init__(batch_size)
+        self.path = path
+        self._header = overwrite or not os.path.exists(path)
+        if overwrite and os.path.exists(path):
+            os.remove(path)
+
+    def write_batch(self, batch: pd.DataFrame):
+        batch.to_csv(self.path, mode="a", header=self._header, index=False)
+        self._header = False
+
+
+class ParquetSink(BatchSink):
+    """Writes each batch as one row group of a single Parquet file, using the deck store's dtypes"""
+
+    def __init__(self, path: str, batch_size: int = 10000, compression: str = "zstd"):
+        super().__init__(batch_size)
+        self.path = path
+        self.compression = compression
+        self._writer = None
+
+    def write_batch(self, batch: pd.DataFrame):
+        table = as_polars_decks(batch).to_arrow()
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+        else:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def consume(records: Iterable[Dict], *sinks: BatchSink) -> int:
+    """Drain a record stream (e.g. iter_clan_decks) into every sink, closing them at the end"""
+    count = 0
+    try:
+        for record in records:
+            for sink in sinks:
+                sink.write(record)
+            count += 1
+    finally:
+        for sink in sinks:
+            sink.close()
+    return count
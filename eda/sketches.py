@@ -0,0 +1,350 @@
+import base64
+import hashlib
+import math
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from deck_matrix import DeckMatrix
+from persistence import Persistent
+
+
+def mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, elementwise on uint64 (wraps mod 2**64)"""
+    z = np.asarray(values, dtype=np.uint64).copy()
+    with np.errstate(over="ignore"):
+        z += np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def key_hashes(keys: Iterable[Hashable]) -> np.ndarray:
+    """Stable 64-bit hash per key (card name or ID), the same in every process and run"""
+    return np.array([int.from_bytes(hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest(), "little")
+                     for key in keys], dtype=np.uint64)
+
+
+def deck_hashes(matrix: DeckMatrix) -> np.ndarray:
+    """
+    One 64-bit hash per deck, equal for equal card sets
+
+    Each deck's hash is the mixed sum of its cards' key hashes, so it does not
+    depend on the matrix's column order and sketches built from batches with
+    different vocabularies can be merged.
+    """
+    card_hashes = key_hashes(matrix.vocabulary)
+    out = np.empty(len(matrix), dtype=np.uint64)
+    start = 0
+    with np.errstate(over="ignore"):
+        for chunk in matrix.iter_chunks():
+            out[start:start + len(chunk)] = chunk.astype(np.uint64) @ card_hashes
+            start += len(chunk)
+    return mix64(out)
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    x = x.copy()
+    n = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = x >= (np.uint64(1) << np.uint64(shift))
+        n[high] += shift
+        x[high] >>= np.uint64(shift)
+    return n + (x > 0)
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch with 2**precision one-byte registers
+
+    Relative standard error is about 1.04 / sqrt(2**precision): 0.8% at the
+    default precision 14, in 16 KiB regardless of how many items are added.
+    Merging two sketches (register-wise max) equals sketching the union.
+    """
+
+    def __init__(self, precision: int = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @classmethod
+    def for_error(cls, relative_error: float) -> "HyperLogLog":
+        """Smallest sketch whose standard error is at most relative_error"""
+        return cls(min(max(math.ceil(2 * math.log2(1.04 / relative_error)), 4), 18))
+
+    @property
+    def standard_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add_hashes(self, hashes: np.ndarray):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashes << p
+        rank = np.minimum(64 - _bit_length(rest) + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return float(estimate)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def to_dict(self) -> Dict:
+        return {"precision": self.precision, "registers": base64.b64encode(self.registers.tobytes()).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HyperLogLog":
+        sketch = cls(data["precision"])
+        sketch.registers = np.frombuffer(base64.b64decode(data["registers"]), dtype=np.uint8).copy()
+        return sketch
+
+
+class CountMinSketch:
+    """
+    Frequency sketch: depth rows of width counters
+
+    Estimates never undercount, and overcount by at most epsilon * total with
+    probability 1 - delta, where width = ceil(e / epsilon) and
+    depth = ceil(ln(1 / delta)). Sketches of the same shape merge by addition.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 5):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self._seeds = mix64(np.arange(1, depth + 1, dtype=np.uint64))
+
+    @classmethod
+    def for_error(cls, epsilon: float = 0.001, delta: float = 0.01) -> "CountMinSketch":
+        return cls(math.ceil(math.e / epsilon), math.ceil(math.log(1 / delta)))
+
+    @property
+    def epsilon(self) -> float:
+        return math.e / self.width
+
+    @property
+    def delta(self) -> float:
+        return math.exp(-self.depth)
+
+    def _columns(self, hashes: np.ndarray) -> np.ndarray:
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        return (mix64(hashes[None, :] ^ self._seeds[:, None]) % np.uint64(self.width)).astype(np.int64)
+
+    def add_hashes(self, hashes: np.ndarray, counts=1):
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.int64), np.shape(hashes))
+        columns = self._columns(hashes)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        columns = self._columns(hashes)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge Count-Min sketches of different shape")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def to_dict(self) -> Dict:
+        return {"width": self.width, "depth": self.depth, "total": self.total,
+                "table": base64.b64encode(self.table.tobytes()).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CountMinSketch":
+        sketch = cls(data["width"], data["depth"])
+        sketch.table = np.frombuffer(base64.b64decode(data["table"]), dtype=np.int64).reshape(
+            sketch.depth, sketch.width).copy()
+        sketch.total = data["total"]
+        return sketch
+
+
+class HeavyHitters:
+    """
+    Approximate top-k items over a stream: a Count-Min sketch plus k candidates
+
+    Each batch is pre-aggregated, added to the sketch, and the candidate set
+    is refreshed from sketch estimates, so memory is the sketch plus k labels
+    however many distinct items pass through.
+    """
+
+    def __init__(self, k: int = 20, epsilon: float = 0.001, delta: float = 0.01):
+        self.k = k
+        self.sketch = CountMinSketch.for_error(epsilon, delta)
+        self.candidates: Dict[int, Hashable] = {}
+
+    def add(self, hashes: np.ndarray, labels: Union[Sequence[Hashable], Callable[[int], Hashable]],
+            counts=None):
+        """
+        Add items by hash; labels[i] (or labels(i)) names hashes[i]
+
+        Labels are looked up only for items entering the top k, so costly
+        ones (decoded decks) are built k times per batch at most.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        distinct, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        weights = np.ones(len(hashes), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.sketch.add_hashes(distinct, np.bincount(inverse.ravel(), weights=weights,
+                                                     minlength=len(distinct)).astype(np.int64))
+
+        label = labels if callable(labels) else labels.__getitem__
+        known = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        pool = np.union1d(known, distinct)
+        keep = pool[np.argsort(-self.sketch.estimate(pool), kind="stable")[:self.k]]
+        positions = np.searchsorted(distinct, keep).clip(max=max(len(distinct) - 1, 0))
+        self.candidates = {h: self.candidates[h] if h in self.candidates else label(int(first[p]))
+                           for h, p in zip(keep.tolist(), positions.tolist())}
+
+    def _prune(self):
+        if len(self.candidates) <= self.k:
+            return
+        hashes = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        keep = np.argsort(-self.sketch.estimate(hashes), kind="stable")[:self.k]
+        self.candidates = {int(hashes[i]): self.candidates[int(hashes[i])] for i in keep}
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[Hashable, int]]:
+        """(label, estimated count) pairs, most frequent first"""
+        if not self.candidates:
+            return []
+        hashes = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        estimates = self.sketch.estimate(hashes)
+        order = np.argsort(-estimates, kind="stable")[:n or self.k]
+        return [(self.candidates[int(hashes[i])], int(estimates[i])) for i in order]
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        self.sketch.merge(other.sketch)
+        for h, label in other.candidates.items():
+            self.candidates.setdefault(h, label)
+        self._prune()
+        return self
+
+    def to_dict(self) -> Dict:
+        return {"k": self.k, "sketch": self.sketch.to_dict(),
+                "candidates": [[str(h), label] for h, label in self.candidates.items()]}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HeavyHitters":
+        hitters = cls(data["k"])
+        hitters.sketch = CountMinSketch.from_dict(data["sketch"])
+        hitters.candidates = {int(h): tuple(label) if isinstance(label, list) else label
+                              for h, label in data["candidates"]}
+        return hitters
+
+
+def approximate_unique_deck_counts(matrix: DeckMatrix, labels: Optional[Sequence[Hashable]] = None,
+                                   precision: int = 14):
+    """HyperLogLog counterpart of DeckMatrix.unique_deck_counts"""
+    hashes = deck_hashes(matrix)
+    if labels is None:
+        sketch = HyperLogLog(precision)
+        sketch.add_hashes(hashes)
+        return sketch.count()
+
+    codes, groups = pd.factorize(np.asarray(labels))
+    counts = np.empty(len(groups))
+    for g in range(len(groups)):
+        sketch = HyperLogLog(precision)
+        sketch.add_hashes(hashes[codes == g])
+        counts[g] = sketch.count()
+    return np.asarray(groups), counts
+
+
+class ApproximateDeckAggregates(Persistent):
+    """
+    Bounded-memory stand-in for the exact unique-deck and frequency aggregates
+
+    Per-region HyperLogLogs replace the per-region deck sets, and heavy
+    hitters track the top cards and top decks. update() takes deck rows,
+    update_matrix() decks already encoded (the chart pass feeds it one batch
+    at a time), and merge() combines shards.
+    """
+
+    def __init__(self, column: str = "cards", group_by: str = "location_name", precision: int = 14,
+                 k: int = 20, epsilon: float = 0.001, delta: float = 0.01):
+        self.column = column
+        self.group_by = group_by
+        self.precision = precision
+        self.k = k
+        self.epsilon = epsilon
+        self.delta = delta
+        self.unique_decks: Dict[Hashable, HyperLogLog] = {}
+        self.deck_totals: Dict[Hashable, int] = {}
+        self.top_cards = HeavyHitters(k, epsilon, delta)
+        self.top_decks = HeavyHitters(k, epsilon, delta)
+
+    def update(self, batch: pd.DataFrame):
+        if batch.empty:
+            return
+        self.update_matrix(DeckMatrix.from_frame(batch, self.column), batch[self.group_by].to_numpy())
+
+    def update_matrix(self, matrix: DeckMatrix, labels: Sequence[Hashable]):
+        """Fold in encoded decks; labels[i] is deck i's group"""
+        hashes = deck_hashes(matrix)
+        codes, groups = pd.factorize(np.asarray(labels))
+        for g, group in enumerate(groups):
+            group = group.item() if isinstance(group, np.generic) else group
+            in_group = codes == g
+            sketch = self.unique_decks.setdefault(group, HyperLogLog(self.precision))
+            sketch.add_hashes(hashes[in_group])
+            self.deck_totals[group] = self.deck_totals.get(group, 0) + int(in_group.sum())
+
+        self.top_cards.add(key_hashes(matrix.vocabulary), list(matrix.vocabulary), matrix.card_counts())
+        self.top_decks.add(hashes, lambda i: tuple(sorted(matrix.decode(i), key=str)))
+
+    def merge(self, other: "ApproximateDeckAggregates") -> "ApproximateDeckAggregates":
+        for group, sketch in other.unique_decks.items():
+            if group in self.unique_decks:
+                self.unique_decks[group].merge(sketch)
+            else:
+                self.unique_decks[group] = HyperLogLog.from_dict(sketch.to_dict())
+        for group, total in other.deck_totals.items():
+            self.deck_totals[group] = self.deck_totals.get(group, 0) + total
+        self.top_cards.merge(other.top_cards)
+        self.top_decks.merge(other.top_decks)
+        return self
+
+    def snapshot(self) -> Dict:
+        diversity = pd.DataFrame(
+            [{self.group_by: group, "total_decks": total,
+              "unique_decks": min(self.unique_decks[group].count(), total),
+              "diversity_rate": min(self.unique_decks[group].count(), total) / total * 100 if total else 0.0}
+             for group, total in self.deck_totals.items()],
+            columns=[self.group_by, "total_decks", "unique_decks", "diversity_rate"])
+        return {
+            "unique_decks": diversity,
+            "top_cards": pd.DataFrame(self.top_cards.top(), columns=["card", "estimated_decks"]),
+            "top_decks": pd.DataFrame(self.top_decks.top(), columns=["deck", "estimated_decks"]),
+        }
+
+    def to_dict(self) -> Dict:
+        return {"column": self.column, "group_by": self.group_by, "precision": self.precision,
+                "k": self.k, "epsilon": self.epsilon, "delta": self.delta,
+                "groups": list(self.deck_totals),
+                "unique_decks": [self.unique_decks[g].to_dict() for g in self.deck_totals],
+                "deck_totals": list(self.deck_totals.values()),
+                "top_cards": self.top_cards.to_dict(), "top_decks": self.top_decks.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ApproximateDeckAggregates":
+        aggregates = cls(data["column"], data["group_by"], data["precision"],
+                         data["k"], data["epsilon"], data["delta"])
+        aggregates.unique_decks = {g: HyperLogLog.from_dict(s) for g, s in zip(data["groups"], data["unique_decks"])}
+        aggregates.deck_totals = dict(zip(data["groups"], data["deck_totals"]))
+        aggregates.top_cards = HeavyHitters.from_dict(data["top_cards"])
+        aggregates.top_decks = HeavyHitters.from_dict(data["top_decks"])
+        return aggregates
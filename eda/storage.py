@@ -0,0 +1,126 @@
+import argparse
+import ast
+import glob
+import os
+from datetime import date
+from typing import List, Optional, Union
+
+import pandas as pd
+import polars as pl
+import pyarrow.dataset as ds
+
+
+# Columns holding one list of cards per deck
+DECK_LIST_COLUMNS = ("cards", "card_ids")
+
+# Low-cardinality text columns stored dictionary-encoded
+CATEGORICAL_COLUMNS = ("player_name", "clan_tag", "clan_name", "location_name")
+
+PARTITION_COLUMNS = ["location_id", "snapshot_date"]
+
+
+def read_deck_csv(path: str) -> pd.DataFrame:
+    """Read a legacy deck CSV, parsing the stringified card lists once"""
+    deck_data = pd.read_csv(path)
+    for column in DECK_LIST_COLUMNS:
+        if column in deck_data.columns and isinstance(deck_data[column].iloc[0], str):
+            deck_data[column] = deck_data[column].apply(ast.literal_eval)
+    return deck_data
+
+
+def as_polars_decks(deck_data: Union[pd.DataFrame, pl.DataFrame]) -> pl.DataFrame:
+    """Polars deck frame with the storage dtypes (list<int32> IDs, categorical names)"""
+    frame = pl.from_pandas(deck_data) if isinstance(deck_data, pd.DataFrame) else deck_data
+
+    casts = []
+    for column in DECK_LIST_COLUMNS:
+        if column not in frame.columns:
+            continue
+        inner = frame.schema[column].inner
+        if inner.is_integer():
+            casts.append(pl.col(column).cast(pl.List(pl.Int32)))
+        else:
+            casts.append(pl.col(column).cast(pl.List(pl.Utf8)))
+    for column in CATEGORICAL_COLUMNS:
+        if column in frame.columns:
+            casts.append(pl.col(column).cast(pl.Utf8).cast(pl.Categorical))
+
+    return frame.with_columns(casts)
+
+
+def write_deck_snapshot(deck_data: Union[pd.DataFrame, pl.DataFrame], root: str,
+                        snapshot_date: Optional[str] = None) -> str:
+    """
+    Write one crawl's decks to a Parquet dataset partitioned by location and snapshot date
+
+    Card-ID lists are stored as list<int32> and names dictionary-encoded, so
+    loading needs no per-row parsing. Re-writing a snapshot date replaces the
+    partitions it touches rather than duplicating rows.
+    """
+    snapshot_date = snapshot_date or date.today().isoformat()
+    frame = as_polars_decks(deck_data).with_columns(pl.lit(snapshot_date).alias("snapshot_date"))
+
+    ds.write_dataset(
+        frame.to_arrow(),
+        root,
+        format="parquet",
+        partitioning=PARTITION_COLUMNS,
+        partitioning_flavor="hive",
+        existing_data_behavior="delete_matching",
+        basename_template="decks-{i}.parquet",
+    )
+    return root
+
+
+def scan_decks(root: str, location_ids: Optional[List[int]] = None,
+               snapshot_dates: Optional[List[str]] = None) -> pl.LazyFrame:
+    """Lazily scan a deck dataset; filters on partition columns prune whole files"""
+    frame = pl.scan_parquet(os.path.join(root, "**", "*.parquet"), hive_partitioning=True)
+    frame = frame.with_columns(pl.col("snapshot_date").cast(pl.Utf8))
+
+    if location_ids is not None:
+        frame = frame.filter(pl.col("location_id").is_in(location_ids))
+    if snapshot_dates is not None:
+        frame = frame.filter(pl.col("snapshot_date").is_in(snapshot_dates))
+    return frame
+
+
+def load_decks(root: str, location_ids: Optional[List[int]] = None,
+               snapshot_dates: Optional[List[str]] = None,
+               engine: str = "pandas") -> Union[pd.DataFrame, pl.DataFrame]:
+    """
+    Load decks as a pandas (default) or polars frame
+
+    With pandas the card columns hold one NumPy array per deck, which supports
+    the same iteration and `in` checks the analysis code uses on lists.
+    """
+    frame = scan_decks(root, location_ids, snapshot_dates).collect()
+    if engine == "polars":
+        return frame
+    if engine != "pandas":
+        raise ValueError(f"Unknown engine: {engine}")
+    return frame.to_pandas()
+
+
+def list_snapshots(root: str) -> List[str]:
+    """Snapshot dates present in a deck dataset, oldest first"""
+    dirs = glob.glob(os.path.join(root, "location_id=*", "snapshot_date=*"))
+    return sorted({os.path.basename(d).split("=", 1)[1] for d in dirs})
+
+
+def convert_csv(csv_path: str, root: str, snapshot_date: Optional[str] = None) -> str:
+    """One-shot conversion of a legacy stringified-list CSV into the Parquet store"""
+    if snapshot_date is None:
+        snapshot_date = date.fromtimestamp(os.path.getmtime(csv_path)).isoformat()
+    return write_deck_snapshot(read_deck_csv(csv_path), root, snapshot_date)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a deck CSV into the Parquet deck store")
+    parser.add_argument("csv_path")
+    parser.add_argument("root")
+    parser.add_argument("--snapshot-date", help="YYYY-MM-DD (defaults to the CSV's modification date)")
+    args = parser.parse_args()
+
+    convert_csv(args.csv_path, args.root, args.snapshot_date)
+    print(f"Wrote {args.csv_path} to {args.root}")
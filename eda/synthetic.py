@@ -0,0 +1,146 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from deck_matrix import DeckMatrix
+
+
+DECK_SIZE = 8
+
+
+def card_weights(n_cards: int = 110, skew: float = 1.1) -> np.ndarray:
+    """Zipf-like popularity: card j is picked with weight 1 / (j + 1) ** skew"""
+    weights = 1.0 / np.arange(1, n_cards + 1) ** skew
+    return weights / weights.sum()
+
+
+def sample_deck_indices(n_decks: int, weights: np.ndarray, rng: np.random.Generator,
+                        chunk_size: int = 200_000) -> np.ndarray:
+    """
+    (n_decks, 8) card column indices, each row 8 distinct cards drawn by weight
+
+    Gumbel top-k: perturbing log-weights with Gumbel noise and keeping the 8
+    largest draws a weighted sample without replacement, for all rows at once.
+    Row-wise weights (one row per deck) are also accepted.
+    """
+    weights = np.asarray(weights)
+    n_cards = weights.shape[-1]
+    out = np.empty((n_decks, DECK_SIZE), dtype=np.int16)
+    for start in range(0, n_decks, chunk_size):
+        rows = min(chunk_size, n_decks - start)
+        log_weights = np.log(weights if weights.ndim == 1 else weights[start:start + rows])
+        keys = log_weights - np.log(-np.log(rng.random((rows, n_cards))))
+        out[start:start + rows] = np.argpartition(-keys, DECK_SIZE, axis=1)[:, :DECK_SIZE]
+    return out
+
+
+def _regional_weights(n_regions: int, n_cards: int, skew: float, regional_spread: float,
+                      rng: np.random.Generator) -> np.ndarray:
+    """One popularity vector per region: the global Zipf curve with log-normal regional tilts"""
+    base = card_weights(n_cards, skew)
+    tilted = base[None, :] * np.exp(rng.normal(0.0, regional_spread, (n_regions, n_cards)))
+    return tilted / tilted.sum(axis=1, keepdims=True)
+
+
+def synthetic_deck_matrix(n_decks: int, n_cards: int = 110, skew: float = 1.1, seed: int = 0) -> DeckMatrix:
+    """n_decks skewed random decks straight into a DeckMatrix (no per-row Python objects)"""
+    rng = np.random.default_rng(seed)
+    weights = card_weights(n_cards, skew)
+    bits = np.empty((n_decks, (n_cards + 7) // 8), dtype=np.uint8)
+    for start in range(0, n_decks, 200_000):
+        picks = sample_deck_indices(min(200_000, n_decks - start), weights, rng)
+        dense = np.zeros((len(picks), n_cards), dtype=np.uint8)
+        np.put_along_axis(dense, picks.astype(np.int64), 1, axis=1)
+        bits[start:start + len(picks)] = np.packbits(dense, axis=1, bitorder="little")
+    return DeckMatrix(bits, list(range(n_cards)))
+
+
+def repeated_deck_matrix(n_decks: int, pool_size: int = 10_000, n_cards: int = 110, skew: float = 1.1,
+                         deck_skew: float = 1.0, seed: int = 0) -> DeckMatrix:
+    """
+    n_decks drawn from a pool of pool_size decks, deck i with weight 1 / (i + 1) ** deck_skew
+
+    Independent draws of 8 cards almost never repeat a deck, so their "top
+    decks" are ties between decks seen once or twice. Real ladders copy a
+    few popular lists; drawing from a Zipf-weighted pool reproduces that.
+    """
+    pool = synthetic_deck_matrix(pool_size, n_cards, skew, seed)
+    rng = np.random.default_rng(seed + 1)
+    return pool.subset(rng.choice(len(pool), n_decks, p=card_weights(len(pool), deck_skew)))
+
+
+def synthetic_decks(n_decks: int, n_regions: int = 5, n_clans: int = 50, n_cards: int = 110,
+                    skew: float = 1.1, regional_spread: float = 0.5, seed: int = 0,
+                    first_card_id: int = 26000000, first_location_id: int = 57000000) -> pd.DataFrame:
+    """
+    A deck table in the collector's layout (same columns as clan_based_deckss.csv)
+
+    Card popularity follows a Zipf curve tilted per region, so regional
+    variance and diversity statistics have something to find. Clans are
+    spread evenly over regions and players over clans. Card names are
+    "Card <i>" with IDs from first_card_id, matching mock_api.build_world.
+    """
+    rng = np.random.default_rng(seed)
+    n_clans = max(n_clans, n_regions)
+
+    clan_region = np.arange(n_clans) % n_regions
+    player_clan = rng.integers(0, n_clans, n_decks)
+    player_region = clan_region[player_clan]
+
+    weights = _regional_weights(n_regions, n_cards, skew, regional_spread, rng)
+    picks = np.empty((n_decks, DECK_SIZE), dtype=np.int16)
+    for region in range(n_regions):
+        rows = np.flatnonzero(player_region == region)
+        picks[rows] = sample_deck_indices(len(rows), weights[region], rng)
+
+    names = np.array([f"Card {i}" for i in range(n_cards)], dtype=object)
+    ids = np.arange(first_card_id, first_card_id + n_cards)
+    clan_tags = np.array([f"C{c:06d}" for c in range(n_clans)], dtype=object)
+    clan_names = np.array([f"Clan {c}" for c in range(n_clans)], dtype=object)
+    region_names = np.array([f"Region {r}" for r in range(n_regions)], dtype=object)
+
+    player_tags = np.char.add("P", np.char.zfill(np.arange(n_decks).astype(str), 9))
+    return pd.DataFrame({
+        "player_tag": player_tags,
+        "player_name": np.char.add("Player ", player_tags),
+        "clan_tag": clan_tags[player_clan],
+        "clan_name": clan_names[player_clan],
+        "location_id": first_location_id + player_region,
+        "location_name": region_names[player_region],
+        "cards": names[picks].tolist(),
+        "card_ids": ids[picks].tolist(),
+        "trophies": rng.integers(7000, 10001, n_decks),
+        "clan_score": 100000 - player_clan % 1000 * 10,
+    })
+
+
+def synthetic_battles(decks: pd.DataFrame, n_battles: int, seed: int = 0,
+                      start: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Random 1v1 battles between players of a synthetic deck table, in battles.battle_record's layout"""
+    rng = np.random.default_rng(seed)
+    start = start if start is not None else pd.Timestamp("2024-01-01", tz="UTC")
+    a = rng.integers(0, len(decks), n_battles)
+    b = (a + rng.integers(1, len(decks), n_battles)) % len(decks)
+    swap = decks["player_tag"].to_numpy()[a] > decks["player_tag"].to_numpy()[b]
+    a, b = np.where(swap, b, a), np.where(swap, a, b)
+
+    crowns_a = rng.integers(0, 4, n_battles)
+    crowns_b = rng.integers(0, 4, n_battles)
+    frame = {
+        "battle_id": np.char.add("B", np.arange(n_battles).astype(str)),
+        "battle_time": start + pd.to_timedelta(rng.integers(0, 30 * 24 * 3600, n_battles), unit="s"),
+        "battle_type": "PvP",
+        "game_mode": "Ladder",
+        "winner": np.where(crowns_a > crowns_b, "a", np.where(crowns_b > crowns_a, "b", "draw")),
+    }
+    for prefix, rows, crowns in (("a", a, crowns_a), ("b", b, crowns_b)):
+        frame.update({
+            f"{prefix}_tag": decks["player_tag"].to_numpy()[rows],
+            f"{prefix}_name": decks["player_name"].to_numpy()[rows],
+            f"{prefix}_crowns": crowns,
+            f"{prefix}_trophies": decks["trophies"].to_numpy()[rows],
+            f"{prefix}_cards": decks["cards"].to_numpy()[rows],
+            f"{prefix}_card_ids": decks["card_ids"].to_numpy()[rows],
+        })
+    return pd.DataFrame(frame)
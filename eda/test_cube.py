@@ -0,0 +1,28 @@
+import pandas as pd
+import polars as pl
+
+from cube import DeckCube
+from synthetic import synthetic_decks
+
+
+def test_snapshot_updates_equal_one_build(tmp_path):
+    first = synthetic_decks(2000, seed=1).assign(snapshot_date="2026-10-01")
+    second = synthetic_decks(2500, seed=2).assign(snapshot_date="2026-10-08")
+
+    DeckCube.build(first).save(str(tmp_path))
+    DeckCube.load_or_new(str(tmp_path)).update(DeckCube.build(second)).save(str(tmp_path))
+    incremental = DeckCube.load(str(tmp_path))
+    whole = DeckCube.build(pd.concat([first, second], ignore_index=True))
+
+    for name in ("cells", "totals", "clans"):
+        assert getattr(incremental, name).equals(getattr(whole, name))
+    assert DeckCube.list_snapshots(str(tmp_path)) == ["2026-10-01", "2026-10-08"]
+
+
+def test_update_replaces_a_recrawled_snapshot():
+    decks = synthetic_decks(2000, seed=1).assign(snapshot_date="2026-10-01")
+    recrawl = synthetic_decks(1500, seed=3).assign(snapshot_date="2026-10-01")
+
+    cube = DeckCube.build(decks).update(DeckCube.build(recrawl))
+    assert len(cube) == len(recrawl)
+    assert cube.totals.filter(pl.col("snapshot_date") == "2026-10-01")["decks"].sum() == len(recrawl)
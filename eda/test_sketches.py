@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketches import ApproximateDeckAggregates
+from synthetic import synthetic_decks
+
+
+@pytest.fixture(scope="module")
+def decks() -> pd.DataFrame:
+    return synthetic_decks(3000, n_regions=4, n_clans=20, seed=7)
+
+
+def _round_trip(aggregates):
+    return type(aggregates).from_dict(json.loads(json.dumps(aggregates.to_dict())))
+
+
+def test_merge_of_parts_equals_whole(decks):
+    whole = ApproximateDeckAggregates()
+    whole.update(decks)
+
+    merged = ApproximateDeckAggregates()
+    bounds = np.linspace(0, len(decks), 4).astype(int)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        shard = ApproximateDeckAggregates()
+        shard.update(decks.iloc[start:stop])
+        merged.merge(_round_trip(shard))
+
+    assert merged.deck_totals == whole.deck_totals
+    for group, sketch in whole.unique_decks.items():
+        np.testing.assert_array_equal(merged.unique_decks[group].registers, sketch.registers)
+    np.testing.assert_array_equal(merged.top_decks.sketch.table, whole.top_decks.sketch.table)
+
+
+def test_non_string_groups_round_trip(decks):
+    aggregates = ApproximateDeckAggregates(group_by="location_id")
+    aggregates.update(decks)
+
+    restored = _round_trip(aggregates)
+    assert restored.deck_totals == aggregates.deck_totals
+    assert all(isinstance(group, int) for group in restored.unique_decks)
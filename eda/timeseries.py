@@ -0,0 +1,331 @@
+import os
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from archetypes import ArchetypeModel, archetype_shares
+from cube import DeckCube
+from storage import list_snapshots, load_decks
+
+
+TABLES = ("card_usage", "archetype_shares")
+
+# kind -> (key column, table, value column)
+SERIES = {
+    "card": ("card", "card_usage", "usage_pct"),
+    "archetype": ("archetype", "archetype_shares", "share_pct"),
+}
+
+
+def _card_usage(deck_data: pd.DataFrame, snapshot_date: Optional[str] = None) -> pl.DataFrame:
+    """Usage % of every card per (snapshot, region); decks without a snapshot_date are stamped with snapshot_date"""
+    return DeckCube.build(deck_data, snapshot_date).rollup(["snapshot_date", "location_name"])
+
+
+def _archetype_shares(archetypes: Sequence[str], regions: Sequence[str], snapshot_date: str) -> pl.DataFrame:
+    shares = archetype_shares(archetypes, regions)
+    shares["total_decks"] = shares.groupby("location_name")["decks"].transform("sum")
+    return pl.from_pandas(shares).select(
+        pl.lit(snapshot_date).alias("snapshot_date"), pl.col("location_name").cast(pl.Utf8),
+        pl.col("archetype").cast(pl.Utf8), pl.col("decks").cast(pl.Int64),
+        pl.col("total_decks").cast(pl.Int64), pl.col("share_pct"))
+
+
+class MetaHistory:
+    """
+    Card usage and archetype shares per region and snapshot, and the trajectories built on them
+
+    Each snapshot is summarized once, when it is added, into a few hundred
+    rows per region. Trajectories, trends and change points only read those
+    rows, so adding a day never re-reads the decks of earlier days.
+    Archetype shares are only comparable across snapshots labelled with the
+    same model. Saved as one Parquet file per table.
+    """
+
+    def __init__(self, card_usage: pl.DataFrame, archetype_shares: pl.DataFrame):
+        self.card_usage = card_usage
+        self.archetype_shares = archetype_shares
+
+    @classmethod
+    def empty(cls) -> "MetaHistory":
+        keys = {"snapshot_date": pl.Utf8, "location_name": pl.Utf8}
+        counts = {"decks": pl.Int64, "total_decks": pl.Int64}
+        return cls(
+            pl.DataFrame(schema={**keys, "card_id": pl.Int64, "card": pl.Utf8, **counts, "usage_pct": pl.Float64}),
+            pl.DataFrame(schema={**keys, "archetype": pl.Utf8, **counts, "share_pct": pl.Float64}),
+        )
+
+    @classmethod
+    def from_decks(cls, deck_data: pd.DataFrame, snapshot_date: Optional[str] = None) -> "MetaHistory":
+        """Card-usage history of a deck table spanning one or more snapshots (its snapshot_date column)"""
+        history = cls.empty()
+        history.card_usage = pl.concat([history.card_usage, _card_usage(deck_data, snapshot_date)])
+        return history
+
+    def save(self, root: str):
+        os.makedirs(root, exist_ok=True)
+        for name in TABLES:
+            path = os.path.join(root, f"{name}.parquet")
+            getattr(self, name).write_parquet(path + ".tmp")
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, root: str) -> "MetaHistory":
+        return cls(*(pl.read_parquet(os.path.join(root, f"{name}.parquet")) for name in TABLES))
+
+    @classmethod
+    def load_or_new(cls, root: str) -> "MetaHistory":
+        if all(os.path.exists(os.path.join(root, f"{name}.parquet")) for name in TABLES):
+            return cls.load(root)
+        return cls.empty()
+
+    @property
+    def snapshots(self) -> List[str]:
+        return sorted(self.card_usage["snapshot_date"].unique().to_list())
+
+    def _has(self, table: str, snapshot_date: str) -> bool:
+        return getattr(self, table).filter(pl.col("snapshot_date") == snapshot_date).height > 0
+
+    def _put(self, table: str, snapshot_date: str, rows: pl.DataFrame):
+        frame = getattr(self, table).filter(pl.col("snapshot_date") != snapshot_date)
+        setattr(self, table, pl.concat([frame, rows.select(frame.columns)]).sort(
+            ["snapshot_date", "location_name", "decks"], descending=[False, False, True]))
+
+    def add_snapshot(self, deck_data: pd.DataFrame, snapshot_date: Optional[str] = None,
+                     archetypes: Optional[Sequence[str]] = None, replace: bool = False) -> bool:
+        """
+        Summarize one snapshot's decks (a pandas deck table); returns whether anything was added
+
+        Card usage is added unless the snapshot is already present (or
+        replace=True); archetype shares likewise, when labels are given.
+        """
+        snapshot_date = snapshot_date or date.today().isoformat()
+        if "snapshot_date" in deck_data.columns:
+            deck_data = deck_data.drop(columns=["snapshot_date"])
+
+        added = False
+        if replace or not self._has("card_usage", snapshot_date):
+            self._put("card_usage", snapshot_date, _card_usage(deck_data, snapshot_date))
+            added = True
+        if archetypes is not None and (replace or not self._has("archetype_shares", snapshot_date)):
+            self._put("archetype_shares", snapshot_date,
+                      _archetype_shares(archetypes, deck_data["location_name"], snapshot_date))
+            added = True
+        return added
+
+    def add_from_store(self, root: str, model: Optional[ArchetypeModel] = None,
+                       snapshot_dates: Optional[Sequence[str]] = None) -> List[str]:
+        """
+        Add the snapshots of a Parquet deck store the history lacks
+
+        Only those snapshots' partitions are read. With a model, snapshots
+        without archetype shares are labelled too.
+        """
+        added = []
+        for snapshot in snapshot_dates or list_snapshots(root):
+            needs_shares = model is not None and not self._has("archetype_shares", snapshot)
+            if self._has("card_usage", snapshot) and not needs_shares:
+                continue
+            decks = load_decks(root, snapshot_dates=[snapshot])
+            archetypes = model.predict_many(decks[model.deck_column]) if needs_shares else None
+            if self.add_snapshot(decks, snapshot, archetypes):
+                added.append(snapshot)
+        return added
+
+    def trajectories(self, kind: str = "card", locations: Optional[Sequence[str]] = None,
+                     keys: Optional[Sequence[str]] = None) -> pl.DataFrame:
+        """
+        One row per (region, card or archetype, snapshot) in which the region was crawled
+
+        Keys absent from a crawled snapshot count as 0% rather than missing.
+        """
+        key, table, value = SERIES[kind]
+        frame = getattr(self, table)
+        if locations is not None:
+            frame = frame.filter(pl.col("location_name").is_in(list(locations)))
+
+        crawled = frame.select(["snapshot_date", "location_name", "total_decks"]).unique(
+            ["snapshot_date", "location_name"])
+        observed = frame.select(["location_name", key]).unique()
+        if keys is not None:
+            observed = observed.filter(pl.col(key).is_in(list(keys)))
+        return (
+            crawled.join(observed, on="location_name")
+            .join(frame.select(["snapshot_date", "location_name", key, "decks", value]),
+                  on=["snapshot_date", "location_name", key], how="left")
+            .with_columns(pl.col("decks").fill_null(0), pl.col(value).fill_null(0.0))
+            .sort(["location_name", key, "snapshot_date"])
+        )
+
+    def _series(self, kind: str, locations: Optional[Sequence[str]],
+                window: Optional[int]) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray, List[str]]:
+        """(series labels, values (series x snapshot, NaN where not crawled), day offsets, snapshots)"""
+        key, _, value = SERIES[kind]
+        snapshots = self.snapshots if kind == "card" else sorted(
+            self.archetype_shares["snapshot_date"].unique().to_list())
+        if window is not None:
+            snapshots = snapshots[-window:]
+        frame = self.trajectories(kind, locations).filter(pl.col("snapshot_date").is_in(snapshots)).to_pandas()
+        if frame.empty:
+            return (pd.DataFrame(columns=["location_name", key]), np.zeros((0, len(snapshots))),
+                    np.zeros(len(snapshots)), snapshots)
+
+        wide = frame.pivot_table(index=["location_name", key], columns="snapshot_date", values=value,
+                                 aggfunc="first").reindex(columns=snapshots)
+        dates = pd.to_datetime(pd.Series(snapshots))
+        days = (dates - dates.iloc[0]).dt.days.to_numpy(dtype=float)
+        return wide.index.to_frame(index=False), wide.to_numpy(dtype=float), days, snapshots
+
+    def trends(self, kind: str = "card", locations: Optional[Sequence[str]] = None,
+               window: Optional[int] = None, min_snapshots: int = 3, t_threshold: float = 2.0,
+               min_change: float = 1.0) -> pl.DataFrame:
+        """
+        Rising and falling cards (or archetypes) per region
+
+        Fits a least-squares line to each series over the last `window`
+        snapshots (all by default), in percentage points per day against
+        the real snapshot dates. A series is "rising" or "falling" when the
+        slope's t statistic reaches t_threshold and the first-to-last change
+        is at least min_change points, otherwise "flat". All series are
+        fitted at once as masked array sums.
+        """
+        labels, values, days, _ = self._series(kind, locations, window)
+        key = SERIES[kind][0]
+        mask = ~np.isnan(values)
+        y = np.where(mask, values, 0.0)
+        n = mask.sum(axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_mean = (mask * days).sum(axis=1) / n
+            y_mean = y.sum(axis=1) / n
+            dx = np.where(mask, days - x_mean[:, None], 0.0)
+            dy = np.where(mask, y - y_mean[:, None], 0.0)
+            sxx = (dx * dx).sum(axis=1)
+            slope = (dx * dy).sum(axis=1) / sxx
+            residual = np.where(mask, dy - slope[:, None] * dx, 0.0)
+            stderr = np.sqrt((residual * residual).sum(axis=1) / np.maximum(n - 2, 1) / sxx)
+            t_stat = np.where(stderr > 0, slope / stderr, np.sign(slope) * np.inf)
+
+        positions = np.arange(values.shape[1])
+        first = np.take_along_axis(y, np.where(mask, positions, values.shape[1]).argmin(axis=1)[:, None], 1)[:, 0]
+        last = np.take_along_axis(y, np.where(mask, positions, -1).argmax(axis=1)[:, None], 1)[:, 0]
+        change = last - first
+
+        significant = (np.abs(t_stat) >= t_threshold) & (np.abs(change) >= min_change)
+        direction = np.where(significant & (slope > 0), "rising",
+                             np.where(significant & (slope < 0), "falling", "flat"))
+
+        result = pl.DataFrame({
+            "location_name": labels["location_name"].tolist(),
+            key: labels[key].tolist(),
+            "snapshots": n,
+            "first": first,
+            "last": last,
+            "change": change,
+            "slope_per_day": slope,
+            "t_stat": t_stat,
+            "direction": direction,
+        })
+        return (result.filter(pl.col("snapshots") >= min_snapshots)
+                .sort(["location_name", "slope_per_day"], descending=[False, True]))
+
+    def change_points(self, kind: str = "card", locations: Optional[Sequence[str]] = None,
+                      min_segment: int = 2, min_shift: float = 2.0, min_score: float = 3.0) -> pl.DataFrame:
+        """
+        The strongest level shift in each series
+
+        For every split of a series into before/after, the two-segment
+        squared error comes from cumulative sums, so all splits of all series
+        cost one pass. The best split is reported when both sides span at
+        least min_segment snapshots, the means differ by at least min_shift
+        points and that shift is min_score times the residual standard
+        deviation. change_date is the first snapshot after the shift.
+        """
+        labels, values, _, snapshots = self._series(kind, locations, None)
+        key = SERIES[kind][0]
+        columns = ["location_name", key, "change_date", "before", "after", "shift", "score"]
+        if values.shape[1] < 2 * min_segment:
+            return pl.DataFrame(schema={name: (pl.Float64 if name in ("before", "after", "shift", "score")
+                                               else pl.Utf8) for name in columns})
+
+        mask = ~np.isnan(values)
+        y = np.where(mask, values, 0.0)
+        count = np.cumsum(mask, axis=1)
+        total = np.cumsum(y, axis=1)
+        squares = (y * y).sum(axis=1)
+
+        # Split after column k: left = [0, k], right = (k, end]
+        n_left, n_right = count[:, :-1], count[:, -1:] - count[:, :-1]
+        s_left, s_right = total[:, :-1], total[:, -1:] - total[:, :-1]
+        valid = (n_left >= min_segment) & (n_right >= min_segment)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sse = squares[:, None] - s_left ** 2 / n_left - s_right ** 2 / n_right
+            sse = np.where(valid, sse, np.inf)
+            split = sse.argmin(axis=1)
+            rows = np.arange(len(y))
+            before = s_left[rows, split] / n_left[rows, split]
+            after = s_right[rows, split] / n_right[rows, split]
+            shift = after - before
+            noise = np.sqrt(np.maximum(sse[rows, split], 0) / np.maximum(count[:, -1] - 2, 1))
+            score = np.where(noise > 0, np.abs(shift) / noise, np.inf)
+
+        # First crawled snapshot after each split
+        observed_at = np.where(mask, np.arange(values.shape[1]), values.shape[1])
+        next_observed = np.minimum.accumulate(observed_at[:, ::-1], axis=1)[:, ::-1]
+        change_at = next_observed[rows, np.minimum(split + 1, values.shape[1] - 1)]
+
+        found = np.isfinite(sse[rows, split]) & (np.abs(shift) >= min_shift) & (score >= min_score)
+        found = np.flatnonzero(found)
+        return pl.DataFrame({
+            "location_name": labels["location_name"].to_numpy()[found].tolist(),
+            key: labels[key].to_numpy()[found].tolist(),
+            "change_date": [snapshots[i] for i in change_at[found]],
+            "before": before[found],
+            "after": after[found],
+            "shift": shift[found],
+            "score": score[found],
+        }).sort("score", descending=True)
+
+    def movers(self, n: int = 4, kind: str = "card", window: Optional[int] = None) -> Dict[str, List[str]]:
+        """Per region, the n series with the steepest trend (rising or falling), steepest first"""
+        key = SERIES[kind][0]
+        trends = self.trends(kind, window=window, min_snapshots=2)
+        ranked = trends.sort(["location_name", pl.col("slope_per_day").abs()], descending=[False, True])
+        return {location: group[key].head(n).to_list()
+                for (location,), group in ranked.group_by(["location_name"], maintain_order=True)}
+
+    def mover_trajectories(self, n: int = 4, window: Optional[int] = None) -> Dict[str, List[Dict]]:
+        """
+        Per region, the usage trajectories of its n fastest-moving cards as plain lists
+
+        With a single snapshot there is no movement yet, so each region's n
+        most used cards are returned instead.
+        """
+        movers = self.movers(n, window=window)
+        if not movers:
+            latest = self.card_usage.filter(pl.col("snapshot_date") == self.snapshots[-1]) if self.snapshots else None
+            movers = {} if latest is None else {
+                location: group.sort("decks", descending=True)["card"].head(n).to_list()
+                for (location,), group in latest.group_by(["location_name"], maintain_order=True)}
+
+        cards = sorted({card for region in movers.values() for card in region})
+        trajectories = self.trajectories("card", keys=cards)
+        directions = {(location, card): direction for location, card, direction in
+                      self.trends("card", window=window, min_snapshots=2)
+                      .select(["location_name", "card", "direction"]).iter_rows()}
+
+        regions = {}
+        for location in sorted(movers):
+            regions[location] = []
+            for card in movers[location]:
+                series = trajectories.filter((pl.col("location_name") == location) & (pl.col("card") == card))
+                regions[location].append({
+                    "card": card,
+                    "dates": series["snapshot_date"].to_list(),
+                    "usage": series["usage_pct"].to_list(),
+                    "direction": directions.get((location, card), "flat"),
+                })
+        return regions
@@ -1,40 +1,200 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional
+
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # headless backend; also what the render worker processes use
 import matplotlib.pyplot as plt
 import seaborn as sns
-from collections import Counter
-
-
-def create_clash_royale_visualizations(deck_data: pd.DataFrame, output_dir: str = "."):
-
-
-    if deck_data.empty:
-        print("No data to visualize!")
-        return None
-
-    # Set style
-    sns.set_style("whitegrid")
-    plt.rcParams['figure.figsize'] = (12, 8)
-
-    print("\n" + "=" * 60)
-    print("CREATING VISUALIZATIONS")
-    print("=" * 60)
-
-    viz_paths = {}
 
+from deck_matrix import DeckMatrix
+from cooccurrence import CooccurrenceEngine
+from catalog import CardCatalog
+from sketches import ApproximateDeckAggregates
+from metrics import Metrics
+from cube import DeckCube
+from timeseries import MetaHistory
+
+
+COLORS = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F']
+
+
+# Figures whose data a DeckCube can supply without touching the decks
+CUBE_FIGURES = ('distribution', 'grouping')
+
+# Decks encoded at a time by the chart pass
+DECK_BATCH_SIZE = 250_000
+
+
+def cube_chart_data(cube: DeckCube, figures: Iterable[str] = CUBE_FIGURES) -> Dict[str, Dict]:
+    """The distribution and grouping bundles as roll-ups of the aggregate cube"""
+    names = set(figures)
+    overall = cube.rollup()
+    data = {}
+
+    if 'distribution' in names:
+        top_15 = overall.head(15)
+        data['distribution'] = {'cards': top_15['card'].to_list(), 'counts': top_15['decks'].to_list()}
+
+    if 'grouping' in names:
+        top_8 = overall.head(8)
+        regional = cube.rollup(['location_name'])
+        usage = {(location, card_id): pct for location, card_id, pct
+                 in regional.select(['location_name', 'card_id', 'usage_pct']).iter_rows()}
+        locations = cube.group_totals(['location_name'])['location_name'].to_list()
+        data['grouping'] = {
+            'cards': top_8['card'].to_list(),
+            'usage': {location: [usage.get((location, card_id), 0.0) for card_id in top_8['card_id'].to_list()]
+                      for location in locations},
+        }
+    return data
+
+
+def trend_chart_data(history: MetaHistory, n: int = 4) -> Dict:
+    """The trend bundle: each region's n fastest-moving cards across the history's snapshots"""
+    return {'snapshots': history.snapshots, 'regions': history.mover_trajectories(n)}
+
+
+def compute_chart_data(deck_data: Optional[pd.DataFrame], catalog: Optional[CardCatalog] = None,
+                       approximate: bool = False, figures: Optional[Iterable[str]] = None,
+                       cube: Optional[DeckCube] = None,
+                       history: Optional[MetaHistory] = None) -> Dict[str, Dict]:
+    """
+    Compute every aggregate the requested charts need in one place
+
+    With a cube, the distribution and grouping bundles are roll-ups of its
+    materialized counts; with a history, the trend bundle comes from its
+    per-snapshot usage. The decks are only read for the other figures
+    (deck_data may be None if none are requested).
+    """
+    names = list(figures) if figures is not None else list(FIGURES)
+    data = cube_chart_data(cube, [name for name in names if name in CUBE_FIGURES]) if cube is not None else {}
+    if history is not None and 'trend' in names:
+        data['trend'] = trend_chart_data(history)
+    remaining = [name for name in names if name not in data]
+    if remaining:
+        if deck_data is None:
+            raise ValueError(f"Figures {remaining} need the deck table")
+        data.update(_deck_chart_data(deck_data, catalog, approximate, remaining))
+    return data
+
+
+def _deck_chart_data(deck_data: pd.DataFrame, catalog: Optional[CardCatalog] = None,
+                     approximate: bool = False, figures: Iterable[str] = (),
+                     batch_size: int = DECK_BATCH_SIZE) -> Dict[str, Dict]:
+    """
+    Chart bundles computed from the decks themselves
+
+    The decks are encoded in batches in a single pass and each chart gets a
+    small, picklable bundle of plain arrays, so rendering can happen in other
+    processes without shipping (or re-scanning) the deck data. With a catalog
+    the decks are encoded from their card IDs on the catalog's columns and
+    labelled by name. approximate=True counts distinct decks with an
+    ApproximateDeckAggregates (one HyperLogLog per region, ~0.8% error) fed
+    each encoded batch, so no more than batch_size encoded decks are held at
+    once; the exact count keeps every deck's packed key.
+    """
+    names = set(figures)
+    if catalog is not None and 'card_ids' in deck_data.columns:
+        column, vocabulary, card_label = 'card_ids', catalog.card_ids.tolist(), catalog.card_name
+    else:
+        column, card_label = 'cards', str
+        vocabulary = sorted(set(deck_data['cards'].explode().dropna()), key=str)
+    index = {card: j for j, card in enumerate(vocabulary)}
+
+    # Encode batch_size decks at a time and keep only sums that add across
+    # batches; the one exception is the exact distinct count, which needs
+    # every deck's packed key
+    region_codes, regions = pd.factorize(deck_data['location_name'].to_numpy())
+    regions = np.asarray(regions)
+    card_counts = np.zeros(len(vocabulary), dtype=np.int64)
+    region_counts = np.zeros((len(regions), len(vocabulary)), dtype=np.int64)
+    engine = CooccurrenceEngine(vocabulary) if 'correlation' in names else None
+    sketch = ApproximateDeckAggregates(column)
+    packed = []
+    for start in range(0, len(deck_data), batch_size):
+        batch = DeckMatrix.from_decks(deck_data[column].iloc[start:start + batch_size], vocabulary)
+        codes = region_codes[start:start + batch_size]
+        card_counts += batch.card_counts()
+        region_counts += batch.code_counts(codes, len(regions))
+        if engine is not None:
+            engine.update(batch)
+        if 'diversity' in names and approximate:
+            sketch.update_matrix(batch, deck_data['location_name'].iloc[start:start + batch_size].to_numpy())
+        elif 'diversity' in names:
+            packed.append(batch.bits)
+    region_totals = np.bincount(region_codes[region_codes >= 0], minlength=len(regions))
+    popularity = np.argsort(-card_counts, kind="stable")
+
+    def most_common(n):
+        return [vocabulary[j] for j in popularity[:n] if card_counts[j] > 0]
+
+    def labels(cards):
+        return [card_label(card) for card in cards]
+
+    data = {}
+
+    # Distribution
+    if 'distribution' in names:
+        top_15_cards = most_common(15)
+        data['distribution'] = {
+            'cards': labels(top_15_cards),
+            'counts': [int(card_counts[index[card]]) for card in top_15_cards],
+        }
+
+    # Correlation: full card x card co-occurrence summed over the batches, normalized by
+    # each row's card frequency (P(column card | row card)), then cut to the top 12
+    if 'correlation' in names:
+        top_12_cards = most_common(12)
+        top_12_idx = [index[card] for card in top_12_cards]
+        data['correlation'] = {
+            'cards': labels(top_12_cards),
+            'matrix': engine.conditional()[np.ix_(top_12_idx, top_12_idx)],
+        }
+
+    # Grouping: usage percentage of the top 8 cards by region
+    if 'grouping' in names:
+        top_8_cards = most_common(8)
+        data['grouping'] = {
+            'cards': labels(top_8_cards),
+            'usage': {
+                location: [region_counts[g, index[card]] / region_totals[g] * 100 for card in top_8_cards]
+                for g, location in enumerate(regions)
+            },
+        }
+
+    # Trend: usage trajectories of the fastest-moving cards, over the snapshots in the data
+    if 'trend' in names:
+        data['trend'] = trend_chart_data(MetaHistory.from_decks(deck_data))
+
+    # Diversity: identical card sets share the same packed key (or deck hash, when approximate)
+    if 'diversity' in names:
+        if approximate:
+            diversity = sketch.snapshot()['unique_decks']
+            diversity_regions, unique_counts = diversity['location_name'].to_list(), diversity['unique_decks'].to_list()
+        else:
+            matrix = DeckMatrix(np.concatenate(packed), vocabulary)
+            diversity_regions, unique_counts = matrix.unique_deck_counts(deck_data['location_name'])
+        totals = dict(zip(regions, region_totals))
+        data['diversity'] = {
+            'regions': list(diversity_regions),
+            'rates': [unique / totals[location] * 100
+                      for location, unique in zip(diversity_regions, unique_counts)],
+            'unique': [int(unique) for unique in unique_counts],
+            'totals': [int(totals[location]) for location in diversity_regions],
+        }
+
+    return data
+
+
+def _plot_distribution(data: Dict):
     # === VISUALIZATION 1: Distribution - Top Cards Overall ===
-    print("\n1. Creating card usage distribution chart...")
-
-    all_cards = []
-    for cards in deck_data['cards']:
-        all_cards.extend(cards)
-
-    card_freq = Counter(all_cards)
-    top_cards = dict(card_freq.most_common(15))
-
     plt.figure(figsize=(12, 6))
-    bars = plt.bar(range(len(top_cards)), list(top_cards.values()), color='steelblue')
-    plt.xticks(range(len(top_cards)), list(top_cards.keys()), rotation=45, ha='right')
+    bars = plt.bar(range(len(data['cards'])), data['counts'], color='steelblue')
+    plt.xticks(range(len(data['cards'])), data['cards'], rotation=45, ha='right')
     plt.xlabel('Card Name', fontsize=12, fontweight='bold')
     plt.ylabel('Usage Count', fontsize=12, fontweight='bold')
     plt.title('Top 15 Most Used Cards Across All Regions', fontsize=14, fontweight='bold')
@@ -47,36 +207,13 @@ def create_clash_royale_visualizations(deck_data: pd.DataFrame, output_dir: str
                  f'{int(height)}',
                  ha='center', va='bottom', fontsize=9)
 
-    viz1_path = f"{output_dir}/viz1_card_distribution.png"
-    plt.savefig(viz1_path, dpi=300, bbox_inches='tight')
-    print(f"   Saved to: {viz1_path}")
-    plt.close()
-    viz_paths['distribution'] = viz1_path
 
+def _plot_correlation(data: Dict):
     # === VISUALIZATION 2: Correlation - Card Co-occurrence Heatmap ===
-    print("\n2. Creating card co-occurrence correlation heatmap...")
-
-    # Get top 12 cards for readability
-    top_12_cards = list(dict(card_freq.most_common(12)).keys())
-
-    # Create co-occurrence matrix
-    cooccurrence = np.zeros((len(top_12_cards), len(top_12_cards)))
-
-    for cards in deck_data['cards']:
-        for i, card1 in enumerate(top_12_cards):
-            for j, card2 in enumerate(top_12_cards):
-                if card1 in cards and card2 in cards:
-                    cooccurrence[i][j] += 1
-
-    # Normalize by diagonal (individual card frequency)
-    for i in range(len(top_12_cards)):
-        if cooccurrence[i][i] > 0:
-            cooccurrence[i] = cooccurrence[i] / cooccurrence[i][i]
-
     plt.figure(figsize=(10, 8))
-    sns.heatmap(cooccurrence,
-                xticklabels=top_12_cards,
-                yticklabels=top_12_cards,
+    sns.heatmap(data['matrix'],
+                xticklabels=data['cards'],
+                yticklabels=data['cards'],
                 annot=True,
                 fmt='.2f',
                 cmap='YlOrRd',
@@ -89,42 +226,20 @@ def create_clash_royale_visualizations(deck_data: pd.DataFrame, output_dir: str
     plt.yticks(rotation=0)
     plt.tight_layout()
 
-    viz2_path = f"{output_dir}/viz2_card_correlation.png"
-    plt.savefig(viz2_path, dpi=300, bbox_inches='tight')
-    print(f"   Saved to: {viz2_path}")
-    plt.close()
-    viz_paths['correlation'] = viz2_path
 
+def _plot_grouping(data: Dict):
     # === VISUALIZATION 3: Grouping - Regional Card Preferences ===
-    print("\n3. Creating regional card preference comparison...")
-
-    # Get top 8 cards
-    top_8_cards = list(dict(card_freq.most_common(8)).keys())
-
-    # Calculate usage percentage by region
-    regional_usage = {}
-    for location in deck_data['location_name'].unique():
-        location_data = deck_data[deck_data['location_name'] == location]
-        regional_usage[location] = {}
-
-        for card in top_8_cards:
-            count = sum(1 for cards in location_data['cards'] if card in cards)
-            percentage = (count / len(location_data)) * 100
-            regional_usage[location][card] = percentage
-
-    # Create grouped bar chart
-    locations = list(regional_usage.keys())
+    top_8_cards = data['cards']
+    locations = list(data['usage'].keys())
     x = np.arange(len(top_8_cards))
     width = 0.8 / len(locations)
 
     fig, ax = plt.subplots(figsize=(14, 7))
 
-    colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F']
-
     for i, location in enumerate(locations):
-        values = [regional_usage[location][card] for card in top_8_cards]
+        values = data['usage'][location]
         offset = width * i - (width * len(locations) / 2) + width / 2
-        bars = ax.bar(x + offset, values, width, label=location, color=colors[i % len(colors)])
+        bars = ax.bar(x + offset, values, width, label=location, color=COLORS[i % len(COLORS)])
 
         # Add value labels
         for bar in bars:
@@ -144,92 +259,48 @@ def create_clash_royale_visualizations(deck_data: pd.DataFrame, output_dir: str
     ax.grid(axis='y', alpha=0.3)
     plt.tight_layout()
 
-    viz3_path = f"{output_dir}/viz3_regional_comparison.png"
-    plt.savefig(viz3_path, dpi=300, bbox_inches='tight')
-    print(f"    Saved to: {viz3_path}")
-    plt.close()
-    viz_paths['grouping'] = viz3_path
-
-    # === VISUALIZATION 4: Trend - Trophy Distribution by Region === Might not work because it using the top amount of 10k
-    print("\n4. Creating trophy distribution by region (box plot)...")
-
-    fig, ax = plt.subplots(figsize=(12, 7))
-
-    # Prepare data for box plot
-    trophy_data = []
-    labels = []
-
-    for location in deck_data['location_name'].unique():
-        location_data = deck_data[deck_data['location_name'] == location]
-        trophy_data.append(location_data['trophies'].values)
-        labels.append(f"{location}\n(n={len(location_data)})")
-
-    # Create box plot
-    bp = ax.boxplot(trophy_data, patch_artist=True,
-                    showmeans=True, meanline=True)
-
-    # Color the boxes
-    colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F']
-    for patch, color in zip(bp['boxes'], colors):
-        patch.set_facecolor(color)
-        patch.set_alpha(0.7)
-
-    # Style the plot
-    ax.set_xlabel('Region', fontsize=12, fontweight='bold')
-    ax.set_ylabel('Trophies', fontsize=12, fontweight='bold')
-    ax.set_title('Trophy Distribution by Region\n(Shows competitive level differences)',
-                 fontsize=14, fontweight='bold')
-    ax.grid(axis='y', alpha=0.3)
-
-    # Add mean values as text
-    means = [np.mean(data) for data in trophy_data]
-    for i, mean in enumerate(means):
-        ax.text(i + 1, mean, f'μ={int(mean)}',
-                ha='center', va='bottom', fontsize=9, fontweight='bold')
 
+def _plot_trend(data: Dict):
+    # === VISUALIZATION 4: Trend - Card Usage Across Crawl Snapshots ===
+    regions = list(data['regions'])
+    n_cols = min(3, max(len(regions), 1))
+    n_rows = max(1, -(-len(regions) // n_cols))
+    fig, axes = plt.subplots(n_rows, n_cols, figsize=(6 * n_cols, 4.5 * n_rows), squeeze=False, sharey=True)
+    styles = {'rising': '-', 'falling': '--', 'flat': ':'}
+
+    for ax, location in zip(axes.flat, regions):
+        for i, series in enumerate(data['regions'][location]):
+            ax.plot(pd.to_datetime(series['dates']), series['usage'], linestyle=styles[series['direction']],
+                    marker='o', color=COLORS[i % len(COLORS)], label=f"{series['card']} ({series['direction']})")
+        ax.set_title(location, fontsize=12, fontweight='bold')
+        ax.grid(alpha=0.3)
+        ax.tick_params(axis='x', rotation=45)
+        ax.legend(fontsize=8, loc='best')
+    for ax in axes.flat[len(regions):]:
+        ax.axis('off')
+
+    fig.supylabel('Usage Percentage (%)', fontsize=12, fontweight='bold')
+    title = 'Card Usage Trends by Region\n(Fastest-moving cards across crawl snapshots)'
+    if len(data['snapshots']) < 2:
+        title = 'Card Usage by Region\n(One snapshot so far - trends appear after more crawls)'
+    fig.suptitle(title, fontsize=14, fontweight='bold')
     plt.tight_layout()
 
-    viz4_path = f"{output_dir}/viz4_trophy_distribution.png"
-    plt.savefig(viz4_path, dpi=300, bbox_inches='tight')
-    print(f"    Saved to: {viz4_path}")
-    plt.close()
-    viz_paths['trend'] = viz4_path
 
+def _plot_diversity(data: Dict):
     # === VISUALIZATION 5: Deck Diversity by Region ===
-    print("\n5. Creating deck diversity comparison...")
-
     fig, ax = plt.subplots(figsize=(10, 6))
 
-    diversity_data = []
-    for location in deck_data['location_name'].unique():
-        location_data = deck_data[deck_data['location_name'] == location]
-
-        # Count unique decks (convert to tuples for hashing)
-        unique_decks = set()
-        for cards in location_data['cards']:
-            unique_decks.add(tuple(sorted(cards)))
-
-        diversity_rate = len(unique_decks) / len(location_data) * 100
-        diversity_data.append({
-            'Region': location,
-            'Diversity Rate': diversity_rate,
-            'Total Decks': len(location_data),
-            'Unique Decks': len(unique_decks)
-        })
-
-    diversity_df = pd.DataFrame(diversity_data)
-
-    bars = ax.bar(diversity_df['Region'], diversity_df['Diversity Rate'],
-                  color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8'][:len(diversity_df)])
+    bars = ax.bar(data['regions'], data['rates'],
+                  color=COLORS[:5][:len(data['regions'])])
 
     ax.set_xlabel('Region', fontsize=12, fontweight='bold')
     ax.set_ylabel('Deck Diversity Rate (%)', fontsize=12, fontweight='bold')
     ax.set_title('Deck Diversity by Region\n(Higher = more unique deck compositions)',
                  fontsize=14, fontweight='bold')
 
-
     # Add value labels
-    for bar, row in zip(bars, diversity_df.itertuples()):
+    for bar in bars:
         height = bar.get_height()
         ax.text(bar.get_x() + bar.get_width() / 2., height,
                 f'{height:.1f}%\n({"Unique"}/{"Total Decks"})',
@@ -238,26 +309,107 @@ def create_clash_royale_visualizations(deck_data: pd.DataFrame, output_dir: str
     plt.xticks(rotation=45, ha='right')
     plt.tight_layout()
 
-    viz5_path = f"{output_dir}/viz5_deck_diversity.png"
-    plt.savefig(viz5_path, dpi=300, bbox_inches='tight')
-    print(f"    Saved to: {viz5_path}")
-    plt.close()
-    viz_paths['diversity'] = viz5_path
+
+# name -> (file stem, plot function, description)
+FIGURES = {
+    'distribution': ('viz1_card_distribution', _plot_distribution, 'Card usage distribution'),
+    'correlation': ('viz2_card_correlation', _plot_correlation, 'Card correlation heatmap'),
+    'grouping': ('viz3_regional_comparison', _plot_grouping, 'Regional comparison'),
+    'trend': ('viz4_card_trends', _plot_trend, 'Card usage trends'),
+    'diversity': ('viz5_deck_diversity', _plot_diversity, 'Deck diversity'),
+}
+
+
+def render_figure(name: str, data: Dict, path: str, dpi: int) -> str:
+    """Draw one figure and save it; safe to run in a worker process"""
+    sns.set_style("whitegrid")
+    plt.rcParams['figure.figsize'] = (12, 8)
+
+    FIGURES[name][1](data)
+    plt.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close('all')
+    return path
+
+
+def _render_timed(name: str, data: Dict, path: str, dpi: int):
+    """render_figure plus its wall time, measured where it runs"""
+    start = time.perf_counter()
+    render_figure(name, data, path, dpi)
+    return path, time.perf_counter() - start
+
+
+def create_clash_royale_visualizations(deck_data: pd.DataFrame, output_dir: str = ".",
+                                       figures: Optional[Iterable[str]] = None,
+                                       preview: bool = False, fmt: Optional[str] = None,
+                                       dpi: Optional[int] = None,
+                                       workers: Optional[int] = None,
+                                       catalog: Optional[CardCatalog] = None,
+                                       approximate: bool = False,
+                                       metrics: Optional[Metrics] = None,
+                                       cube: Optional[DeckCube] = None,
+                                       history: Optional[MetaHistory] = None):
+    """
+    Render the EDA figures
+
+    The aggregates are computed once (compute_chart_data) and the figures,
+    which are independent, are rendered in a process pool. `figures` picks a
+    subset by name (see FIGURES). preview=True drops to 72 dpi for quick
+    iteration; fmt="svg" skips raster encoding altogether. workers=1 renders
+    in this process. approximate=True uses sketches for the diversity counts.
+    Stage timings (chart data and each figure) go to `metrics` when given.
+    With a cube, the distribution and grouping charts are drawn from its
+    materialized counts, and with a MetaHistory the trend chart from its
+    snapshots (see compute_chart_data).
+    """
+    if (deck_data is None or len(deck_data) == 0) and not (cube is not None and len(cube)) and history is None:
+        print("No data to visualize!")
+        return None
+
+    names = list(figures) if figures is not None else list(FIGURES)
+    unknown = [name for name in names if name not in FIGURES]
+    if unknown:
+        raise ValueError(f"Unknown figures {unknown}; expected some of {list(FIGURES)}")
+
+    fmt = fmt or "png"
+    dpi = dpi or (72 if preview else 300)
+
+    print("\n" + "=" * 60)
+    print("CREATING VISUALIZATIONS")
+    print("=" * 60)
+
+    metrics = metrics or Metrics()
+    with metrics.stage("compute_chart_data"):
+        chart_data = compute_chart_data(deck_data, catalog, approximate, names, cube, history)
+    viz_paths = {name: f"{output_dir}/{FIGURES[name][0]}.{fmt}" for name in names}
+
+    if workers is None:
+        workers = min(len(names), os.cpu_count() or 1)
+
+    if workers <= 1 or len(names) <= 1:
+        for name in names:
+            _, seconds = _render_timed(name, chart_data[name], viz_paths[name], dpi)
+            metrics.record_stage(f"render:{name}", seconds)
+            print(f"   Saved to: {viz_paths[name]}")
+    else:
+        with metrics.stage("render"), ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {name: pool.submit(_render_timed, name, chart_data[name], viz_paths[name], dpi)
+                       for name in names}
+            for name, future in futures.items():
+                path, seconds = future.result()
+                metrics.record_stage(f"render:{name}", seconds)
+                print(f"   Saved to: {path}")
 
     print("\n" + "=" * 60)
     print(" ALL VISUALIZATIONS CREATED SUCCESSFULLY!")
     print("=" * 60)
     print("\nGenerated files:")
-    print(f"  1. {viz1_path} - Card usage distribution")
-    print(f"  2. {viz2_path} - Card correlation heatmap")
-    print(f"  3. {viz3_path} - Regional comparison")
-    print(f"  4. {viz4_path} - Trophy distribution")
-    print(f"  5. {viz5_path} - Deck diversity")
+    for i, name in enumerate(names, 1):
+        print(f"  {i}. {viz_paths[name]} - {FIGURES[name][2]}")
     print("\nThese visualizations show:")
     print("  • Distribution: Which cards are most popular overall")
     print("  • Correlation: Which cards are played together (synergies)")
     print("  • Grouping: How card preferences differ by region")
-    print("  • Trend: Competitive levels across regions")
+    print("  • Trend: Which cards are rising or falling in each region")
     print("  • Diversity: How varied the meta is in each region")
 
     return viz_paths
@@ -265,17 +417,30 @@ def create_clash_royale_visualizations(deck_data: pd.DataFrame, output_dir: str
 
 # === EXAMPLE USAGE ===
 if __name__ == "__main__":
-
-    deck_data = pd.read_csv("../clan_based_deckss.csv")
-
-
-    import ast
-
-    if isinstance(deck_data['cards'].iloc[0], str):
-        deck_data['cards'] = deck_data['cards'].apply(ast.literal_eval)
+    from storage import list_snapshots, load_decks, read_deck_csv
+
+    # Prefer the Parquet store (no per-row parsing); fall back to the legacy CSV.
+    # Each snapshot is a full copy of the decks, so only the latest is charted
+    if os.path.isdir("../decks_parquet"):
+        deck_data = load_decks("../decks_parquet", snapshot_dates=list_snapshots("../decks_parquet")[-1:] or None)
+    else:
+        deck_data = read_deck_csv("../clan_based_deckss.csv")
+
+    # Card/location lookups saved by the collector, or recovered from the data itself
+    if os.path.exists("../card_catalog.json"):
+        catalog = CardCatalog.load("../card_catalog.json")
+    elif 'card_ids' in deck_data.columns:
+        catalog = CardCatalog.from_frame(deck_data)
+    else:
+        catalog = None
+
+    # The collector's aggregate cube and snapshot history, when present, supply the usage and trend charts
+    cube = (DeckCube.load("../deck_cube", DeckCube.list_snapshots("../deck_cube")[-1:])
+            if os.path.isdir("../deck_cube") else None)
+    history = MetaHistory.load("../meta_history") if os.path.isdir("../meta_history") else None
 
     # Create visualizations
-    viz_paths = create_clash_royale_visualizations(deck_data, output_dir="visualizations")
+    viz_paths = create_clash_royale_visualizations(deck_data, output_dir="visualizations", catalog=catalog,
+                                                   cube=cube, history=history)
 
     print("\n Done! Check the visualizations folder for all charts.")
-
@@ -0,0 +1,265 @@
+from typing import Dict, Hashable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from deck_matrix import DeckMatrix
+from catalog import CardCatalog
+from archetypes import ArchetypeModel
+
+
+# Player dimensions carried over from the deck crawl onto each battle side
+PLAYER_DIMENSIONS = ("location_name", "clan_name")
+
+
+def wilson_interval(wins: np.ndarray, games: np.ndarray, z: float = 1.96) -> Tuple[np.ndarray, np.ndarray]:
+    """Wilson score interval for win rates, elementwise; (nan, nan) where games == 0"""
+    wins = np.asarray(wins, dtype=float)
+    games = np.asarray(games, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = wins / games
+        denom = 1 + z * z / games
+        center = (p + z * z / (2 * games)) / denom
+        half = z * np.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / denom
+    return center - half, center + half
+
+
+def battle_sides(battles: Union[pd.DataFrame, pl.DataFrame], players: Optional[pd.DataFrame] = None,
+                 column: str = "card_ids") -> pl.DataFrame:
+    """
+    One row per participant of each decided battle: their deck, the opponent's deck and whether they won
+
+    Draws are dropped. `column` picks the deck encoding ("card_ids" for IDs,
+    "cards" for names). With `players` (a deck table from the crawl), each
+    side also gets that player's location_name and clan_name. Returns a
+    polars frame so the decks stay list columns WinRateEngine.from_sides
+    can encode without per-deck Python objects.
+    """
+    if isinstance(battles, pd.DataFrame):
+        battles = pl.from_pandas(battles)
+    decided = battles.filter(pl.col("winner").cast(pl.Utf8) != "draw")
+    sides = pl.concat([
+        decided.select(
+            pl.col("battle_id"),
+            pl.col("battle_time"),
+            pl.col(f"{me}_tag").alias("player_tag"),
+            pl.col(f"{them}_tag").alias("opponent_tag"),
+            pl.col(f"{me}_{column}").alias("deck"),
+            pl.col(f"{them}_{column}").alias("opponent_deck"),
+            (pl.col("winner").cast(pl.Utf8) == me).alias("win"),
+        )
+        for me, them in (("a", "b"), ("b", "a"))
+    ])
+
+    if players is not None:
+        latest = players.drop_duplicates("player_tag", keep="last")
+        tags = latest["player_tag"].astype(str).tolist()
+        sides = sides.with_columns([
+            pl.col("player_tag").replace_strict(tags, latest[dimension].tolist(), default=None).alias(dimension)
+            for dimension in PLAYER_DIMENSIONS if dimension in latest.columns
+        ])
+    return sides
+
+
+def _factorize(labels: Union[Sequence[Hashable], pl.Series]) -> Tuple[np.ndarray, np.ndarray]:
+    """pd.factorize (-1 for missing); a polars Series goes through pandas, not a Python object array"""
+    labels = labels.to_pandas() if isinstance(labels, pl.Series) else np.asarray(labels)
+    codes, distinct = pd.factorize(labels)
+    return codes, np.asarray(distinct)
+
+
+def _flat_decks(decks: pl.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Each deck's length and all card keys of a list column, flattened; null cards encode as unknown"""
+    return (decks.list.len().fill_null(0).to_numpy(),
+            decks.explode(empty_as_null=False, keep_nulls=False).to_numpy())
+
+
+class WinRateEngine:
+    """
+    Win rates and matchups computed in bulk over deck-encoded battles
+
+    Holds two aligned DeckMatrix objects, one row per battle side: the
+    side's deck and its opponent's, plus a 0/1 win vector. Every statistic
+    is a handful of chunked matrix products (X^T w, X^T diag(w) X,
+    X^T diag(w) Y), so there are no per-battle Python loops. Intervals are
+    Wilson score intervals at the given z.
+    """
+
+    def __init__(self, decks: DeckMatrix, opponents: DeckMatrix, wins: np.ndarray, z: float = 1.96):
+        if len(decks) != len(opponents) or len(decks) != len(wins):
+            raise ValueError("decks, opponents and wins must have one row per battle side")
+        if decks.vocabulary != opponents.vocabulary:
+            raise ValueError("decks and opponents must share a vocabulary")
+        self.decks = decks
+        self.opponents = opponents
+        self.wins = np.asarray(wins, dtype=np.float32)
+        self.z = z
+
+    @classmethod
+    def from_sides(cls, sides: Union[pd.DataFrame, pl.DataFrame], vocabulary: Optional[Sequence[Hashable]] = None,
+                   catalog: Optional[CardCatalog] = None, z: float = 1.96) -> "WinRateEngine":
+        """
+        Encode battle_sides() output; with a catalog, decks of card IDs go on its columns
+
+        Both deck columns are flattened once and looked up in bulk
+        (DeckMatrix.from_flat), so encoding costs no Python work per battle.
+        """
+        if isinstance(sides, pd.DataFrame):
+            sides = pl.from_pandas(sides)
+        decks, opponents = _flat_decks(sides["deck"]), _flat_decks(sides["opponent_deck"])
+        if catalog is not None:
+            vocabulary = catalog.card_ids.tolist()
+        elif vocabulary is None:
+            vocabulary = sorted(pl.Series(np.concatenate([decks[1], opponents[1]])).unique().to_list(), key=str)
+        return cls(DeckMatrix.from_flat(*decks, vocabulary), DeckMatrix.from_flat(*opponents, vocabulary),
+                   sides["win"].to_numpy(), z)
+
+    @property
+    def vocabulary(self):
+        return self.decks.vocabulary
+
+    def _chunks(self, opponents: bool = False):
+        """(decks, opponents or None, wins) per row chunk, the decks as float32 0/1"""
+        for start in range(0, len(self.decks), self.decks.chunk_size):
+            stop = start + self.decks.chunk_size
+            yield (self.decks.dense(start, stop).astype(np.float32),
+                   self.opponents.dense(start, stop).astype(np.float32) if opponents else None,
+                   self.wins[start:stop])
+
+    def _table(self, games: np.ndarray, wins: np.ndarray, **keys) -> pd.DataFrame:
+        low, high = wilson_interval(wins, games, self.z)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            win_rate = wins / games
+        return pd.DataFrame(dict(keys, games=games, wins=wins, win_rate=win_rate, ci_low=low, ci_high=high))
+
+    def card_win_rates(self, groups: Optional[Sequence[Hashable]] = None, min_games: int = 1) -> pd.DataFrame:
+        """
+        Win rate of decks holding each card, overall or per group label
+
+        `groups` is one label per battle side, e.g. sides["location_name"] or
+        sides["clan_name"]; the result then has a `group` column. The counts
+        come from DeckMatrix.code_counts over (group, win) codes.
+        """
+        vocabulary = np.asarray(self.vocabulary, dtype=object)
+        if groups is None:
+            codes, labels = np.zeros(len(self.wins), dtype=np.int64), None
+        else:
+            codes, labels = _factorize(groups)
+        # Code 2g counts group g's lost sides, code 2g + 1 its won sides
+        n_groups = 1 if labels is None else len(labels)
+        totals = self.decks.code_counts(np.where(codes >= 0, codes * 2 + (self.wins > 0), -1), 2 * n_groups)
+        wins = totals[1::2].astype(float)
+        games = totals[0::2] + wins
+
+        if labels is None:
+            table = self._table(games[0], wins[0], card=vocabulary)
+        else:
+            rows, cols = np.indices(games.shape)
+            table = self._table(games.ravel(), wins.ravel(),
+                                group=np.asarray(labels, dtype=object)[rows.ravel()], card=vocabulary[cols.ravel()])
+        table = table[table["games"] >= min_games]
+        return table.sort_values("win_rate", ascending=False, kind="stable", ignore_index=True)
+
+    def pair_win_rates(self, min_games: int = 20) -> pd.DataFrame:
+        """Win rate of decks holding both cards of each pair"""
+        n = len(self.vocabulary)
+        games = np.zeros((n, n))
+        wins = np.zeros((n, n))
+        for x, _, w in self._chunks():
+            games += x.T @ x
+            wins += (x * w[:, None]).T @ x
+
+        i, j = np.triu_indices(n, k=1)
+        vocabulary = np.asarray(self.vocabulary, dtype=object)
+        table = self._table(np.rint(games[i, j]), np.rint(wins[i, j]), card=vocabulary[i], partner=vocabulary[j])
+        table = table[table["games"] >= min_games]
+        return table.sort_values("win_rate", ascending=False, kind="stable", ignore_index=True)
+
+    def matchup_matrix(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (games, wins), both card x card: games[i, j] counts sides holding card i
+        facing an opponent holding card j, wins[i, j] how many of those sides won
+        """
+        n = len(self.vocabulary)
+        games = np.zeros((n, n))
+        wins = np.zeros((n, n))
+        for x, y, w in self._chunks(opponents=True):
+            games += x.T @ y
+            wins += (x * w[:, None]).T @ y
+        return np.rint(games), np.rint(wins)
+
+    def matchup_table(self, min_games: int = 20) -> pd.DataFrame:
+        """Long card-vs-card table of matchup win rates with intervals"""
+        games, wins = self.matchup_matrix()
+        n = len(self.vocabulary)
+        i, j = np.indices((n, n))
+        vocabulary = np.asarray(self.vocabulary, dtype=object)
+        table = self._table(games.ravel(), wins.ravel(), card=vocabulary[i.ravel()], opponent_card=vocabulary[j.ravel()])
+        table = table[(table["games"] >= min_games) & (table["card"] != table["opponent_card"])]
+        return table.sort_values("win_rate", ascending=False, kind="stable", ignore_index=True)
+
+    def label_win_rates(self, labels: Sequence[Hashable], opponent_labels: Optional[Sequence[Hashable]] = None,
+                        min_games: int = 1) -> pd.DataFrame:
+        """
+        Win rate per deck label (e.g. archetype), and per label-vs-label matchup
+        when the opponents' labels are given
+        """
+        codes, names = pd.factorize(np.asarray(labels))
+        names = np.asarray(names, dtype=object)
+        if opponent_labels is None:
+            games = np.bincount(codes[codes >= 0], minlength=len(names)).astype(float)
+            wins = np.bincount(codes[codes >= 0], weights=self.wins[codes >= 0], minlength=len(names))
+            table = self._table(games, wins, label=names)
+        else:
+            opponent_codes = pd.Index(names).get_indexer(np.asarray(opponent_labels))
+            valid = (codes >= 0) & (opponent_codes >= 0)
+            pair = codes[valid] * len(names) + opponent_codes[valid]
+            games = np.bincount(pair, minlength=len(names) ** 2).astype(float)
+            wins = np.bincount(pair, weights=self.wins[valid], minlength=len(names) ** 2)
+            table = self._table(games, wins, label=np.repeat(names, len(names)),
+                                opponent_label=np.tile(names, len(names)))
+        table = table[table["games"] >= min_games]
+        return table.sort_values("win_rate", ascending=False, kind="stable", ignore_index=True)
+
+
+def win_rate_tables(battles: Union[pd.DataFrame, pl.DataFrame], players: Optional[pd.DataFrame] = None,
+                    catalog: Optional[CardCatalog] = None, model: Optional[ArchetypeModel] = None,
+                    min_games: int = 20, z: float = 1.96) -> Dict[str, pd.DataFrame]:
+    """
+    The engine's standard tables for a battle frame (e.g. scan_battles(root).collect())
+
+    card_win_rates, pair_win_rates and matchups always; per-region and
+    per-clan card win rates when players supply those dimensions; and
+    archetype and archetype-vs-archetype win rates with a model. Decks are
+    encoded by card ID unless the model is keyed by name. Card keys are
+    replaced by names when a catalog is given.
+    """
+    column = model.deck_column if model is not None else "card_ids"
+    sides = battle_sides(battles, players, column)
+    engine = WinRateEngine.from_sides(sides, catalog=catalog if column == "card_ids" else None, z=z)
+
+    tables = {
+        "card_win_rates": engine.card_win_rates(min_games=min_games),
+        "pair_win_rates": engine.pair_win_rates(min_games),
+        "matchups": engine.matchup_table(min_games),
+    }
+    for dimension in PLAYER_DIMENSIONS:
+        if dimension in sides.columns:
+            name = f"card_win_rates_by_{dimension.replace('_name', '')}"
+            tables[name] = engine.card_win_rates(sides[dimension], min_games).rename(
+                columns={"group": dimension})
+
+    if model is not None:
+        labels = [model.labels(model.predict_matrix(DeckMatrix.from_flat(*_flat_decks(sides[side]),
+                                                                          model.vocabulary)))
+                  for side in ("deck", "opponent_deck")]
+        tables["archetype_win_rates"] = engine.label_win_rates(labels[0], min_games=min_games)
+        tables["archetype_matchups"] = engine.label_win_rates(labels[0], labels[1], min_games)
+
+    if catalog is not None and column == "card_ids":
+        for table in tables.values():
+            for key in ("card", "partner", "opponent_card"):
+                if key in table.columns:
+                    table[key] = table[key].map(catalog.card_name)
+    return tables